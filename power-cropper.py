@@ -1,667 +1,6011 @@
 import os
-import customtkinter as ctk
-from tkinter import filedialog, messagebox
-from PIL import Image, ImageTk
+import sys
+import time
+import math
+import shutil
+import heapq
+import signal
+import bisect
+import io
+import hashlib
+import importlib
+import functools
+import argparse
+import multiprocessing
+from PIL import Image
 import json
-from collections import defaultdict
+import sqlite3
+import queue
+import threading
+from collections import defaultdict, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait
 
-class PowerCropper:
-    def __init__(self, root):
+# Imported by import_gui() when the GUI starts, so headless commands and the spawned worker
+# processes never load Tk. numpy, tarfile and http.server are imported where they are used.
+ctk = filedialog = messagebox = ImageTk = None
+
+
+def import_gui():
+    global ctk, filedialog, messagebox, ImageTk
+    import customtkinter as ctk
+    from tkinter import filedialog, messagebox
+    from PIL import ImageTk
+
+
+DIMENSION_LABELS = [
+    ("512x512", "512x512"),
+    ("1024x1024", "1024x1024"),
+    ("512x768", "512x768"),
+    ("768x1024", "768x1024"),
+    ("768x512", "768x512"),
+    ("1024x768", "1024x768"),
+    ("Custom", "custom")
+]
+
+
+IMAGE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'bmp')
+# Written by the cropper itself, never scanned for images
+OUTPUT_FOLDERS = ('cropped', 'originals')
+
+
+def index_directories(root, dir_index=None, recursive=False, on_first=None):
+    """Lists the images of root, and of its subfolders if recursive, except output and hidden folders.
+
+    dir_index maps directory -> (mtime_ns, image names, subfolder names) from an earlier call;
+    directories whose mtime did not change are not listed again and keep their entry object.
+    on_first(path) is called with the first image (by name) of the first directory with images.
+    Returns the new index.
+    """
+    root = os.path.abspath(root)
+    old = dir_index or {}
+    index = {}
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+            entry = old.get(directory)
+            if entry is None or entry[0] != mtime:
+                files, subdirs = [], []
+                with os.scandir(directory) as entries:
+                    for e in entries:
+                        if e.name.lower().endswith(IMAGE_EXTENSIONS) and e.is_file():
+                            files.append(e.name)
+                        elif recursive and e.name not in OUTPUT_FOLDERS and not e.name.startswith(".") and e.is_dir():
+                            subdirs.append(e.name)
+                entry = (mtime, files, subdirs)
+        except OSError as e:
+            if directory == root:
+                raise
+            print(f"Cannot list {directory}: {e}")
+            continue
+        index[directory] = entry
+        if on_first and entry[1]:
+            on_first(os.path.join(directory, min(entry[1])))
+            on_first = None
+        if recursive:
+            pending.extend(os.path.join(directory, name) for name in entry[2])
+    return index
+
+
+def indexed_images(dir_index):
+    return sorted(os.path.join(directory, name) for directory, (_, files, _) in dir_index.items() for name in files)
+
+
+def scan_folder(folder, results, dir_index=None, recursive=False):
+    """Streams the images of a folder into a queue: ("first", path) as soon as one is found,
+    then ("done", (sorted paths, directory index)), or ("error", exception)."""
+    try:
+        index = index_directories(folder, dir_index, recursive, on_first=lambda path: results.put(("first", path)))
+    except OSError as e:
+        results.put(("error", e))
+        return
+    results.put(("done", (indexed_images(index), index)))
+
+
+def find_new_images(folder, dir_index, recursive=False, settle=2.0):
+    """Rescans a folder against its directory index, listing only directories that changed.
+
+    Returns (sorted new image paths, new index). Directories with files modified in the last
+    settle seconds keep their old entry, so files that are still being copied show up on a later rescan.
+    """
+    index = index_directories(folder, dir_index, recursive)
+    new_images = []
+    now = time.time()
+    for directory, entry in list(index.items()):
+        old = dir_index.get(directory)
+        if entry is old:
+            continue
+        known = set(old[1]) if old else set()
+        added = [os.path.join(directory, name) for name in entry[1] if name not in known]
+        try:
+            settled = all(now - os.path.getmtime(path) >= settle for path in added)
+        except OSError:
+            settled = False
+        if settled:
+            new_images += added
+        elif old:
+            index[directory] = old
+        else:
+            del index[directory]
+    new_images.sort()
+    return new_images, index
+
+
+def read_image_header(path):
+    """Size, mtime, dimensions, EXIF orientation and mode of an image, read from the header only."""
+    st = os.stat(path)
+    with Image.open(path) as image:
+        if image.format == "PNG":
+            # PNG getexif() may decode the image to find a trailing eXIf chunk
+            exif = Image.Exif()
+            if "exif" in image.info:
+                exif.load(image.info["exif"])
+        else:
+            exif = image.getexif()
+        return {"path": path, "size": st.st_size, "mtime": st.st_mtime, "width": image.width,
+                "height": image.height, "orientation": exif.get(0x0112, 1), "mode": image.mode}
+
+
+def choose_preset(width, height, prefer, dimension_labels=DIMENSION_LABELS):
+    """Returns the largest preset fitting into width x height, preferring the given orientation."""
+    fitting = []
+    for label, value in dimension_labels:
+        if value == "custom":
+            continue
+        w, h = map(int, value.split("x"))
+        if w <= width and h <= height:
+            fitting.append((w, h, value))
+
+    if not fitting:
+        return None
+
+    if prefer == "portrait":
+        fitting.sort(key=lambda x: (x[0] <= x[1], x[0]*x[1]), reverse=True)
+    else:
+        fitting.sort(key=lambda x: (x[0] >= x[1], x[0]*x[1]), reverse=True)
+    return fitting[0][2]
+
+
+def preset_box_at(x, y, crop_size, image_size):
+    """The crop_size box centered on image point (x, y), moved inside the image."""
+    x0 = max(0, min(int(x) - crop_size[0]//2, image_size[0] - crop_size[0]))
+    y0 = max(0, min(int(y) - crop_size[1]//2, image_size[1] - crop_size[1]))
+    return (x0, y0, x0 + crop_size[0], y0 + crop_size[1])
+
+
+def image_nbytes(image):
+    bytes_per_band = {"I": 4, "F": 4, "I;16": 2}.get(image.mode, 1)
+    return image.width * image.height * len(image.getbands()) * bytes_per_band
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * q / 100
+    lo, hi = math.floor(k), math.ceil(k)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+class _Span:
+    __slots__ = ("owner", "name", "category", "args", "start")
+
+    def __init__(self, owner, name, category, args):
+        self.owner = owner
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        if self.category == "action":
+            self.owner._phase_stack().append(defaultdict(float))
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        phases = self.owner._phase_stack().pop() if self.category == "action" else None
+        self.owner.record(self.name, self.category, self.start, end, self.args, phases)
+        return False
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class Instrumentation:
+    """Optional timing of user actions and of the phases they spend their time in.
+
+    Every span goes into a rolling histogram per name and into a bounded event log that can be
+    exported as a Chrome trace (chrome://tracing, Perfetto) or as JSON lines. Phases on the main
+    thread during an action are also summed up per action. Disabled, span() returns a shared no-op.
+    """
+
+    def __init__(self, history=500, max_events=200000):
+        self.enabled = False
+        self.history = history
+        self.histograms = {}  # (category, name) -> deque of ms
+        self.breakdowns = {}  # action -> {phase: ms} of its last run
+        self.counters = defaultdict(int)  # e.g. input events received/coalesced/dropped
+        self.events = deque(maxlen=max_events)
+        self.thread_names = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+
+    def span(self, name, category="phase", **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, category, args)
+
+    def action(self, name):
+        return self.span(name, "action")
+
+    def _phase_stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def record(self, name, category, start, end, args=None, phases=None):
+        if not self.enabled:
+            return
+        ms = (end - start) * 1000
+        thread = threading.current_thread()
+        if phases:
+            args = dict(args or {}, **phases)
+        # Nested spans, actions included, count towards the action running on this thread
+        stack = self._phase_stack()
+        if stack:
+            stack[-1][name] += ms
+        with self._lock:
+            key = (category, name)
+            if key not in self.histograms:
+                self.histograms[key] = deque(maxlen=self.history)
+            self.histograms[key].append(ms)
+            if phases is not None:
+                self.breakdowns[name] = dict(phases)
+            self.thread_names[thread.ident] = thread.name
+            self.events.append({"name": name, "cat": category, "ph": "X", "ts": (start - self._origin) * 1e6,
+                                "dur": ms * 1000, "pid": os.getpid(), "tid": thread.ident, "args": args or {}})
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += n
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.breakdowns.clear()
+            self.counters.clear()
+            self.events.clear()
+
+    def summary(self):
+        with self._lock:
+            histograms = {key: list(values) for key, values in self.histograms.items()}
+        result = defaultdict(dict)
+        for (category, name), values in sorted(histograms.items()):
+            result[category][name] = {"n": len(values), "last": values[-1], "mean": sum(values) / len(values),
+                                      "p50": percentile(values, 50), "p95": percentile(values, 95), "max": max(values)}
+        return dict(result)
+
+    def overlay_text(self):
+        summary = self.summary()
+        if not summary:
+            return "No actions timed yet"
+        lines = [f"{'ms':10s} {'last':>7s} {'p50':>7s} {'p95':>7s}"]
+        for category in ("action", "phase"):
+            for name, stats in summary.get(category, {}).items():
+                lines.append(f"{name:10s} {stats['last']:7.1f} {stats['p50']:7.1f} {stats['p95']:7.1f}")
+                breakdown = self.breakdowns.get(name) if category == "action" else None
+                if breakdown:
+                    lines.append("  " + ", ".join(f"{phase} {ms:.0f}" for phase, ms in sorted(breakdown.items(), key=lambda item: -item[1])))
+            lines.append("")
+        with self._lock:
+            counters = dict(self.counters)
+        for name in sorted({key.rsplit(".", 1)[0] for key in counters}):
+            lines.append(f"{name:10s} " + ", ".join(f"{counters[f'{name}.{kind}']} {kind}" for kind in
+                                                    ("events", "coalesced", "dropped") if f"{name}.{kind}" in counters))
+        return "\n".join(lines).rstrip()
+
+    def export(self, path):
+        """Writes the event log, as JSON lines for a .jsonl path, in Chrome trace format otherwise."""
+        with self._lock:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+            counters = dict(self.counters)
+        with open(path, 'w') as f:
+            if path.endswith(".jsonl"):
+                for event in events:
+                    f.write(json.dumps({"name": event["name"], "category": event["cat"], "start_ms": event["ts"] / 1000,
+                                        "duration_ms": event["dur"] / 1000, "thread": thread_names.get(event["tid"]),
+                                        "args": event["args"]}) + "\n")
+                if counters:
+                    f.write(json.dumps({"name": "counters", "category": "counter", "args": counters}) + "\n")
+            else:
+                metadata = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                            for tid, name in thread_names.items()]
+                if counters:
+                    # Totals at export time, as one sample of a counter track
+                    events.append({"name": "input events", "ph": "C", "pid": os.getpid(), "tid": 0,
+                                   "ts": (time.perf_counter() - self._origin) * 1e6, "args": counters})
+                json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f)
+        return len(events)
+
+
+_NULL_SPAN = _NullSpan()
+# Enabled with --trace or the stats overlay (I)
+instrumentation = Instrumentation()
+
+
+def timed_action(name):
+    """Decorator: times a method as the user action name."""
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            with instrumentation.action(name):
+                return method(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def recorded_action(event="pointer"):
+    """Decorator: logs calls of a user action method to the session recording (--record).
+
+    Calls made while another recorded action runs belong to it and are not logged. Event
+    arguments are logged as the pointer position in image coordinates, or as the new canvas
+    size for event="size".
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            recorder = self.recorder
+            if recorder is None or recorder.depth:
+                return method(self, *args, **kwargs)
+            recorder.log(self, method.__name__, args, kwargs, event)
+            recorder.depth += 1
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                recorder.depth -= 1
+        return wrapper
+    return decorate
+
+
+class EventCoalescer:
+    """Collapses bursts of input events (motion, wheel) into at most one handler call per display frame.
+
+    post(name, handler, value) runs handler(value) at the next frame. A later post of the same
+    name before that replaces the value, or combines it with merge(old, new), e.g. to add up
+    wheel steps. Received, coalesced and dropped events are counted in the instrumentation.
+    """
+
+    def __init__(self, root, frame_ms=16):
         self.root = root
-        self.root.title("Power Cropper")
+        self.frame_ms = frame_ms
+        self._pending = {}  # name -> (handler, value)
+        self._frame_id = None
+        self._last_frame = 0.0
+
+    def post(self, name, handler, value, merge=None):
+        instrumentation.count(f"{name}.events")
+        if name in self._pending:
+            instrumentation.count(f"{name}.coalesced")
+            if merge is not None:
+                value = merge(self._pending[name][1], value)
+        self._pending[name] = (handler, value)
+        if self._frame_id is None:
+            # The first event after a pause is handled right away, a burst at the frame rate
+            wait = self._last_frame + self.frame_ms / 1000 - time.perf_counter()
+            self._frame_id = self.root.after(max(0, int(wait * 1000)), self._run_frame)
+
+    def discard(self, name):
+        if self._pending.pop(name, None) is not None:
+            instrumentation.count(f"{name}.dropped")
+
+    def _run_frame(self):
+        self._frame_id = None
+        self._last_frame = time.perf_counter()
+        pending, self._pending = self._pending, {}
+        with instrumentation.span("draw"):
+            for handler, value in pending.values():
+                handler(value)
+
+    def flush(self):
+        """Runs the pending handlers now instead of at the next frame (used by replay)."""
+        if self._pending:
+            if self._frame_id is not None:
+                self.root.after_cancel(self._frame_id)
+            self._run_frame()
+
+
+class SessionRecorder:
+    """Writes the actions of a GUI session to a JSON lines file, for `replay`.
+
+    The first line describes the session. Every recorded action follows with its time since the
+    start, its arguments and the options (presets, checkboxes, menus) that changed since the
+    previous action; watch(app) traces the option variables, so only changed ones are read.
+    Pointer motion is recorded per display frame, by the coalesced handlers. For every opened folder a "folder" line has a fingerprint of its image names
+    and sizes, and a "history" line the crops it had when it was entered, so a replay can start
+    from the same state.
+    """
+
+    OPTIONS = ("size_var", "orientation_preference", "show_previous_crops", "auto_suggest", "multi_crop",
+               "order_var", "filter_var", "skip_duplicates", "recursive", "overlap_mode")
+
+    def __init__(self, path):
+        self.path = path
+        self.depth = 0
+        self.actions = 0
+        self._options = {}
+        self._changed = set(self.OPTIONS)
+        self._lock = threading.Lock()
+        self._file = open(path, "w", buffering=1)
+        self._start = time.perf_counter()
+        self._write({"type": "session", "version": 1, "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                     "revision": git_revision()})
+
+    def watch(self, app):
+        for option in self.OPTIONS:
+            getattr(app, option).trace_add("write", lambda *_, option=option: self._changed.add(option))
+
+    def _write(self, record):
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(json.dumps(record) + "\n")
+
+    def log(self, app, name, args, kwargs, event):
+        record = {"t": round(time.perf_counter() - self._start, 4), "action": name}
+        if args:
+            record["args"] = [self.encode(app, value, event) for value in args]
+        if kwargs:
+            record["kwargs"] = {key: self.encode(app, value, event) for key, value in kwargs.items()}
+        options = {}
+        for option in self.OPTIONS:
+            if option not in self._changed:
+                continue
+            value = getattr(app, option).get()
+            if self._options.get(option) != value:
+                options[option] = self._options[option] = value
+        self._changed.clear()
+        if options:
+            record["options"] = options
+        self._write(record)
+        self.actions += 1
+        if name == "open_folder":
+            # Listing a large folder takes a while, the fingerprint is written when it is done
+            threading.Thread(target=self._write_fingerprint, args=(os.path.abspath(args[0]), app.recursive.get()),
+                             daemon=True).start()
+
+    @staticmethod
+    def encode(app, value, event):
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        if event == "size":
+            return {"size": [value.width, value.height]}
+        x, y = app.canvas_to_image(app.canvas.canvasx(value.x), app.canvas.canvasy(value.y))
+        return {"pointer": [round(x, 2), round(y, 2)]}
+
+    def _write_fingerprint(self, folder, recursive):
+        try:
+            fingerprint = folder_fingerprint(folder, recursive)
+        except OSError as e:
+            fingerprint = {"error": str(e)}
+        self._write({"type": "folder", "folder": folder, "recursive": recursive, "fingerprint": fingerprint})
+
+    def history(self, folder, crops, last_cropped):
+        """Records the crops of a folder when it is entered, with image paths relative to it."""
+        relative = {os.path.relpath(path, folder): [[crop["size"], list(crop["coords"])] for crop in image_crops]
+                    for path, image_crops in crops.items()}
+        last = None
+        if last_cropped:
+            last = dict(last_cropped, image_path=os.path.relpath(last_cropped["image_path"], folder))
+            last.pop("folder", None)
+        self._write({"type": "history", "folder": folder, "crops": relative, "last_cropped": last})
+
+    def close(self):
+        self._write({"type": "end", "t": round(time.perf_counter() - self._start, 4), "actions": self.actions})
+        with self._lock:
+            self._file.close()
+
+
+def decode_image(path):
+    image = Image.open(path)
+    image.load()
+    return image
+
+
+class DecodedImage:
+    """An image decoded for display: a preview, reduced on decode where possible, and the
+    full resolution image, which is only decoded when it is needed (crop, resize, zoom in).
+
+    Sizes and coordinates always refer to the full resolution.
+    """
+
+    def __init__(self, path, preview, full_size):
+        self.path = path
+        self.preview = preview
+        self.size = full_size
+        self._full = preview if preview.size == full_size else None
+        self._lock = threading.Lock()
+        self._on_full = None  # Set by the ImageCache holding it, to re-account the entry
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    @property
+    def scale(self):
+        return self.display_image().width / self.size[0]
+
+    def has_full(self):
+        return self._full is not None
+
+    def full(self):
+        with self._lock:
+            decoded = self._full is None
+            if decoded:
+                with instrumentation.span("decode_full"):
+                    image = decode_image(self.path)
+                if image.size != self.size:
+                    raise ValueError(f"{self.path} changed on disk")
+                self._full = image
+            full = self._full
+            on_full = self._on_full
+        if decoded and on_full is not None:
+            on_full(self)
+        return full
+
+    def display_image(self):
+        return self._full if self._full is not None else self.preview
+
+    def crop(self, box):
+        return self.full().crop(box)
+
+    def nbytes(self):
+        size = image_nbytes(self.preview)
+        if self._full is not None and self._full is not self.preview:
+            size += image_nbytes(self._full)
+        return size
+
+
+def decode_for_display(path, preview_scale=None):
+    """Decodes an image for display; preview_scale(full_size) returns the display scale.
+
+    Below 1.0 JPEGs are decoded reduced (draft mode scales by 1/2, 1/4 or 1/8 while decoding),
+    other formats are decoded and then reduced by an integer factor. The preview is never
+    smaller than the display size.
+    """
+    with instrumentation.span("decode"):
+        image = Image.open(path)
+        full_size = image.size
+        scale = preview_scale(full_size) if preview_scale else 1.0
+        if scale < 1.0 and image.format == "JPEG":
+            image.draft(image.mode, (math.ceil(full_size[0] * scale), math.ceil(full_size[1] * scale)))
+            image.load()
+        else:
+            image.load()
+            factor = int(1.0 / scale) if scale > 0 else 1
+            if factor >= 2:
+                try:
+                    image = image.reduce(factor)
+                except ValueError:
+                    pass  # Mode without reduce support, show it at full resolution
+    return DecodedImage(path, image, full_size)
+
+
+class ImageCache:
+    """Thread-safe LRU cache of decoded images, bounded by a memory budget in MB."""
+
+    def __init__(self, budget_mb=1024):
+        self.budget = budget_mb * 1024 * 1024
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, image):
+        if isinstance(image, DecodedImage):
+            size = image.nbytes()
+            # A later full decode (crop, resize, zoom in) grows the entry, account for it then
+            image._on_full = lambda decoded: self._resize(key, decoded)
+        else:
+            size = image_nbytes(image)
+        if size > self.budget:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.used -= old[1]
+            self._entries[key] = (image, size)
+            self.used += size
+            self._evict()
+
+    def _resize(self, key, image):
+        size = image.nbytes()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is not image:
+                return
+            self.used += size - entry[1]
+            if size > self.budget:
+                del self._entries[key]
+                self.used -= size
+                self.evictions += 1
+                return
+            self._entries[key] = (image, size)
+            self._evict()
+
+    def _evict(self):
+        while self.used > self.budget:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.used -= evicted_size
+            self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.used -= old[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.used = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "used_mb": self.used / (1024 * 1024),
+                "budget_mb": self.budget / (1024 * 1024),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class ImagePrefetcher:
+    """Decodes the images around the current index on worker threads into an ImageCache."""
+
+    def __init__(self, cache, ahead=3, behind=1, workers=2, preview_scale=None):
+        self.cache = cache
+        self.ahead = ahead
+        self.behind = behind
+        # preview_scale(full_size) -> display scale to decode at, called on the worker threads
+        self.preview_scale = preview_scale
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._pending = {}  # path -> (token, future)
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        image = self.cache.get(path)
+        if image is not None:
+            return image
+        with self._lock:
+            pending = self._pending.get(path)
+        if pending is not None:
+            try:
+                image = pending[1].result()
+                if image is not None:
+                    return image
+            except Exception:
+                pass
+        image = decode_for_display(path, self.preview_scale)
+        self.cache.put(path, image)
+        return image
+
+    def load_full(self, decoded):
+        """Decodes the full resolution of a DecodedImage in the background."""
+        def decode():
+            decoded.full()  # the cache re-accounts the larger entry
+            return decoded
+        return self._executor.submit(decode)
+
+    def schedule(self, images, index):
+        if not images:
+            return
+        n = len(images)
+        wanted = [images[(index + i) % n] for i in range(1, self.ahead + 1)]
+        wanted += [images[(index - i) % n] for i in range(1, self.behind + 1)]
+        wanted = [path for path in dict.fromkeys(wanted) if path != images[index]]
+        with self._lock:
+            # Drop queued work for images we moved away from
+            for path, (token, future) in list(self._pending.items()):
+                if path not in wanted and future.cancel():
+                    del self._pending[path]
+            for path in wanted:
+                if path in self._pending or path in self.cache:
+                    continue
+                token = object()
+                self._pending[path] = (token, self._executor.submit(self._decode, path, token))
+
+    def _decode(self, path, token):
+        try:
+            image = decode_for_display(path, self.preview_scale)
+        except Exception as e:
+            print(f"Error prefetching {path}: {e}")
+            image = None
+        with self._lock:
+            current = self._pending.get(path)
+            if current is not None and current[0] is token:
+                del self._pending[path]
+                if image is not None:
+                    self.cache.put(path, image)
+        return image
+
+    def invalidate(self, path):
+        with self._lock:
+            pending = self._pending.pop(path, None)
+            if pending is not None:
+                pending[1].cancel()
+        self.cache.discard(path)
+
+    def clear(self):
+        with self._lock:
+            for token, future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+        self.cache.clear()
+
+    def shutdown(self):
+        self.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+RESAMPLE_FILTERS = {
+    "LANCZOS": Image.LANCZOS,
+    "BICUBIC": Image.BICUBIC,
+    "BILINEAR": Image.BILINEAR,
+    "BOX": Image.BOX,
+    "NEAREST": Image.NEAREST,
+}
+
+
+def downscaled_size(width, height, target):
+    scale_factor = target / max(width, height)
+    return int(width * scale_factor), int(height * scale_factor)
+
+
+def replace_image(image, image_path, format=None):
+    # Write next to the original and swap it in, so a crash never leaves a half written image
+    tmp_path = image_path + ".tmp"
+    image.save(tmp_path, format=format or Image.registered_extensions().get(os.path.splitext(image_path)[1].lower()))
+    os.replace(tmp_path, image_path)
+
+
+def downscale_file(image_path, originals_folder, target, resample="LANCZOS"):
+    """Process pool worker: backs up an image to originals_folder and downscales it in place.
+
+    Returns the new header row (see read_image_header), or None if the image is not larger than target.
+    """
+    with Image.open(image_path) as image:
+        if max(image.size) <= target:
+            return None
+        new_size = downscaled_size(image.width, image.height, target)
+        image_format = image.format
+        if image_format == "JPEG":
+            # Decode at reduced scale, but keep at least twice the target for the resampling filter
+            image.draft(image.mode, (new_size[0] * 2, new_size[1] * 2))
+        resized = image.resize(new_size, RESAMPLE_FILTERS[resample])
+    os.makedirs(originals_folder, exist_ok=True)
+    shutil.copy2(image_path, os.path.join(originals_folder, os.path.basename(image_path)))
+    replace_image(resized, image_path, image_format)
+    return read_image_header(image_path)
+
+
+class BatchResize:
+    """Downscales many images on a process pool; poll() returns the finished (path, row, error)."""
+
+    def __init__(self, paths, originals_folder, target, resample="LANCZOS", workers=None, mp_context=None, folder=None):
+        self.total = len(paths)
+        self.resized = 0
+        self.skipped = 0
+        self.failed = 0
+        self.cancelled = False
+        self.start_time = time.perf_counter()
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=mp_context)
+        # Originals of images in subfolders of folder go to the same subfolders below originals_folder
+        self._futures = {self._pool.submit(downscale_file, path, output_folder(originals_folder, folder, path)
+                                           if folder else originals_folder, target, resample): path
+                         for path in paths}
+
+    @property
+    def completed(self):
+        return self.resized + self.skipped + self.failed
+
+    @property
+    def finished(self):
+        return not self._futures
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.start_time
+        return self.completed / elapsed if elapsed > 0 else 0.0
+
+    def poll(self):
+        done = []
+        for future in [f for f in self._futures if f.done()]:
+            path = self._futures.pop(future)
+            if future.cancelled():
+                continue
+            error = future.exception()
+            row = None if error else future.result()
+            if error is not None:
+                self.failed += 1
+            elif row is None:
+                self.skipped += 1
+            else:
+                self.resized += 1
+            done.append((path, row, error))
+        if self.finished:
+            self._pool.shutdown(wait=False)
+        return done
+
+    def cancel(self):
+        # Images being resized right now are finished, the rest is dropped
+        self.cancelled = True
+        for future in self._futures:
+            future.cancel()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def output_folder(output_root, folder, image_path):
+    """The folder below output_root that mirrors the subfolder of folder the image is in."""
+    relative = os.path.relpath(os.path.dirname(image_path), folder)
+    return output_root if relative == os.curdir else os.path.join(output_root, relative)
+
+
+def crop_save_path(save_folder, image_path, crop_size_str, extension="png"):
+    base_name = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(save_folder, f"{base_name}_cropped_{crop_size_str}.{extension}")
+
+
+def file_digest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+OUTPUT_FORMATS = ("PNG", "WEBP lossless", "WEBP", "JPEG")
+
+
+class OutputEncoder:
+    """How crops are encoded. The defaults write the same PNG as Pillow's plain save()."""
+
+    def __init__(self, format="PNG", compress_level=6, optimize=False, quality=90, method=4,
+                 keep_icc=True, keep_exif=False):
+        if format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format {format!r}")
+        self.format = format
+        self.compress_level = compress_level
+        self.optimize = optimize
+        self.quality = quality
+        self.method = method
+        self.keep_icc = keep_icc
+        self.keep_exif = keep_exif
+
+    @property
+    def extension(self):
+        return {"PNG": "png", "JPEG": "jpg"}.get(self.format, "webp")
+
+    def describe(self):
+        if self.format == "PNG":
+            return f"PNG level {self.compress_level}" + (" optimized" if self.optimize else "")
+        if self.format == "WEBP lossless":
+            return f"WEBP lossless method {self.method}"
+        if self.format == "WEBP":
+            return f"WEBP q{self.quality} method {self.method}"
+        return f"JPEG q{self.quality}" + (" optimized" if self.optimize else "")
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def save(self, image, fp):
+        if self.format == "PNG":
+            options = {"format": "PNG", "compress_level": self.compress_level, "optimize": self.optimize}
+        elif self.format == "JPEG":
+            options = {"format": "JPEG", "quality": self.quality, "optimize": self.optimize}
+            if image.mode not in ("RGB", "L", "CMYK"):
+                image = image.convert("RGB")
+        else:
+            options = {"format": "WEBP", "lossless": self.format == "WEBP lossless",
+                       "quality": self.quality, "method": self.method}
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+        options["icc_profile"] = image.info.get("icc_profile") if self.keep_icc else None
+        exif = image.getexif()
+        if self.keep_exif and len(exif):
+            options["exif"] = exif
+        image.save(fp, **options)
+
+
+def write_crop(image, box, save_path, encoder=None):
+    crop = image.crop(box)
+    buffer = io.BytesIO()
+    with instrumentation.span("encode"):
+        (encoder or OutputEncoder()).save(crop, buffer)
+    with instrumentation.span("write"):
+        with open(save_path, 'wb') as f:
+            f.write(buffer.getbuffer())
+
+
+# Candidates of the encoder benchmark, roughly from fastest to smallest
+BENCHMARK_ENCODERS = [
+    OutputEncoder("PNG", compress_level=1),
+    OutputEncoder("PNG", compress_level=3),
+    OutputEncoder("PNG", compress_level=6),
+    OutputEncoder("PNG", compress_level=9, optimize=True),
+    OutputEncoder("WEBP lossless", method=0),
+    OutputEncoder("WEBP lossless", method=4),
+    OutputEncoder("WEBP", quality=90),
+    OutputEncoder("JPEG", quality=95),
+    OutputEncoder("JPEG", quality=90, optimize=True),
+]
+
+
+def benchmark_encoders(paths, encoders, crop_size=(1024, 1024), repeat=1):
+    """Encodes a center crop of every image with every encoder, in memory.
+
+    Returns per encoder (encoder, mean encode time in ms, mean output size in bytes).
+    """
+    crops = []
+    for path in paths:
+        image = decode_image(path)
+        w, h = min(crop_size[0], image.width), min(crop_size[1], image.height)
+        x0, y0 = (image.width - w) // 2, (image.height - h) // 2
+        crops.append(image.crop((x0, y0, x0 + w, y0 + h)))
+    results = []
+    for encoder in encoders:
+        times = []
+        sizes = []
+        for _ in range(repeat):
+            for crop in crops:
+                buffer = io.BytesIO()
+                start = time.perf_counter()
+                encoder.save(crop, buffer)
+                times.append((time.perf_counter() - start) * 1000)
+                sizes.append(buffer.tell())
+        results.append((encoder, sum(times) / len(times), sum(sizes) / len(sizes)))
+    return results
+
+
+def format_encoder_benchmark(results):
+    lines = [f"{'Encoder':32s} {'ms/crop':>9s} {'KB/crop':>9s}"]
+    for encoder, ms, size in results:
+        lines.append(f"{encoder.describe():32s} {ms:9.1f} {size / 1024:9.1f}")
+    return "\n".join(lines)
+
+
+class WriteBehindQueue:
+    """Runs save jobs on a thread pool and hands the results back in submission order.
+
+    At most max_pending jobs are in flight; submit() blocks beyond that (back-pressure).
+    """
+
+    def __init__(self, workers=2, max_pending=8):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="save")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._jobs = deque()  # (job, future) in submission order
+
+    def submit(self, job, fn, *args):
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._run, fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        self._jobs.append((job, future))
+        return future
+
+    def _run(self, fn, *args):
+        try:
+            return fn(*args)
+        finally:
+            self._slots.release()
+
+    def pending(self):
+        return len(self._jobs)
+
+    def completed(self):
+        done = []
+        while self._jobs and self._jobs[0][1].done():
+            job, future = self._jobs.popleft()
+            done.append((job, future.exception()))
+        return done
+
+    def flush(self):
+        wait([future for _, future in self._jobs])
+        return self.completed()
+
+    def shutdown(self):
+        done = self.flush()
+        self._executor.shutdown(wait=True)
+        return done
+
+
+def crop_orientation(size):
+    w, h = map(int, size.split("x"))
+    if w < h:
+        return "portrait"
+    if w > h:
+        return "landscape"
+    return "square"
+
+
+class FolderStats:
+    """Running crop aggregates of one folder, updated per crop instead of rescanning the folder."""
+
+    def __init__(self):
+        self.sizes = defaultdict(int)
+        self.orientations = defaultdict(int)
+        self.total_crops = 0
+        self.cropped_images = 0
+
+    @staticmethod
+    def deltas(size, image_delta=0, sign=1):
+        """Counter changes for adding (sign=1) or removing (sign=-1) one crop."""
+        deltas = [(f"size:{size}", sign), (f"orientation:{crop_orientation(size)}", sign), ("total_crops", sign)]
+        if image_delta:
+            deltas.append(("cropped_images", image_delta))
+        return deltas
+
+    def apply(self, deltas):
+        for key, delta in deltas:
+            if key.startswith("size:"):
+                self._bump(self.sizes, key[5:], delta)
+            elif key.startswith("orientation:"):
+                self._bump(self.orientations, key[12:], delta)
+            elif key == "total_crops":
+                self.total_crops += delta
+            elif key == "cropped_images":
+                self.cropped_images += delta
+
+    def _bump(self, counts, key, delta):
+        counts[key] += delta
+        if counts[key] <= 0:
+            del counts[key]
+
+    def add_crop(self, size, first_of_image=False):
+        self.apply(self.deltas(size, 1 if first_of_image else 0))
+
+    def remove_crop(self, size, last_of_image=False):
+        self.apply(self.deltas(size, -1 if last_of_image else 0, -1))
+
+    @classmethod
+    def from_counters(cls, counters):
+        stats = cls()
+        stats.apply(counters.items())
+        return stats
+
+    @classmethod
+    def from_crops(cls, images):
+        stats = cls()
+        for crops in images.values():
+            for i, crop in enumerate(crops):
+                stats.add_crop(crop["size"], first_of_image=(i == 0))
+        return stats
+
+    def as_dict(self, total_images=None):
+        stats = {
+            "sizes": dict(self.sizes),
+            "orientations": dict(self.orientations),
+            "total_crops": self.total_crops,
+            "cropped_images": self.cropped_images,
+        }
+        if total_images is not None:
+            stats["total_images"] = total_images
+            stats["uncropped_images"] = max(0, total_images - self.cropped_images)
+        return stats
+
+
+def box_iou(a, b):
+    """Intersection over union of two (x0, y0, x1, y1) boxes."""
+    iw = min(a[2], b[2]) - max(a[0], b[0])
+    ih = min(a[3], b[3]) - max(a[1], b[1])
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = iw * ih
+    return inter / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter)
+
+
+def union_area(boxes):
+    """Area covered by a few (x0, y0, x1, y1) boxes, overlaps counted once."""
+    xs = sorted({x for box in boxes for x in (box[0], box[2])})
+    area = 0
+    for left, right in zip(xs, xs[1:]):
+        spans = sorted((box[1], box[3]) for box in boxes if box[0] <= left and box[2] >= right)
+        covered, top, bottom = 0, None, None
+        for y0, y1 in spans:
+            if bottom is None or y0 > bottom:
+                covered += (bottom - top) if bottom is not None else 0
+                top, bottom = y0, y1
+            else:
+                bottom = max(bottom, y1)
+        covered += (bottom - top) if bottom is not None else 0
+        area += covered * (right - left)
+    return area
+
+
+class CropIndex:
+    """Crop rectangles of one image, for overlap checks and "which crops are under the pointer".
+
+    Boxes are kept sorted by their left edge, with the widest width seen, so a query only visits
+    the boxes whose left edge is within reach of the query (a bisect on x0) instead of all of them.
+    """
+
+    def __init__(self, crops=()):
+        self._boxes = []  # (x0, y0, x1, y1, size), sorted
+        self._max_width = 0
+        for crop in crops:
+            self.add(crop["size"], crop["coords"])
+
+    def __len__(self):
+        return len(self._boxes)
+
+    def __contains__(self, coords):
+        coords = tuple(map(int, coords))
+        i = bisect.bisect_left(self._boxes, coords)
+        return i < len(self._boxes) and self._boxes[i][:4] == coords
+
+    def add(self, size, coords):
+        box = (*map(int, coords), size)
+        i = bisect.bisect_left(self._boxes, box)
+        if i < len(self._boxes) and self._boxes[i] == box:
+            return
+        self._boxes.insert(i, box)
+        self._max_width = max(self._max_width, box[2] - box[0])
+
+    def remove(self, size, coords):
+        box = (*map(int, coords), size)
+        i = bisect.bisect_left(self._boxes, box)
+        if i < len(self._boxes) and self._boxes[i] == box:
+            del self._boxes[i]
+
+    def _candidates(self, x0, x1):
+        lo = bisect.bisect_left(self._boxes, (x0 - self._max_width,))
+        hi = bisect.bisect_right(self._boxes, (x1, math.inf))
+        return [box for box in self._boxes[lo:hi] if box[2] >= x0]
+
+    def at(self, x, y):
+        """The (size, coords) of the crops containing the point, smallest first."""
+        hits = [box for box in self._candidates(x, x) if box[1] <= y <= box[3]]
+        hits.sort(key=lambda box: (box[2] - box[0]) * (box[3] - box[1]))
+        return [(box[4], box[:4]) for box in hits]
+
+    def overlaps(self, coords):
+        """(iou, size, coords) of the other crops intersecting coords, largest overlap first."""
+        coords = tuple(map(int, coords))
+        found = []
+        for box in self._candidates(coords[0], coords[2]):
+            if box[:4] != coords:
+                iou = box_iou(box, coords)
+                if iou > 0:
+                    found.append((iou, box[4], box[:4]))
+        found.sort(reverse=True)
+        return found
+
+    def boxes(self):
+        return [box[:4] for box in self._boxes]
+
+
+def coverage_summary(crops_by_image, dimensions, total_images=None, iou_threshold=0.9, grid=10):
+    """Coverage of a folder computed from its crop records and the image dimensions, no image is read.
+
+    crops_by_image maps image paths to their crop records, dimensions(path) returns (width, height)
+    or None. The summary has the covered fraction of every cropped image (union of its crops over the
+    image area) as a histogram, the pairs of crops above iou_threshold, and a grid x grid map of how
+    many cropped images have a crop over each cell, in image-relative coordinates.
+    """
+    summary = {"total_images": total_images, "cropped_images": 0, "crops": 0, "unknown_size": 0,
+               "overlapping_pairs": 0, "mean_coverage": 0.0, "histogram": [0, 0, 0, 0],
+               "grid": [[0] * grid for _ in range(grid)], "mapped_images": 0}
+    coverage = []
+    for path, crops in crops_by_image.items():
+        if not crops:
+            continue
+        summary["cropped_images"] += 1
+        summary["crops"] += len(crops)
+        index = CropIndex(crops)
+        summary["overlapping_pairs"] += sum(1 for box in index.boxes()
+                                            for iou, _, _ in index.overlaps(box) if iou >= iou_threshold) // 2
+        dims = dimensions(path)
+        if not dims:
+            summary["unknown_size"] += 1
+            continue
+        width, height = dims
+        boxes = [(max(0, x0), max(0, y0), min(width, x1), min(height, y1)) for x0, y0, x1, y1 in index.boxes()]
+        boxes = [box for box in boxes if box[2] > box[0] and box[3] > box[1]]
+        fraction = union_area(boxes) / (width * height) if boxes else 0.0
+        coverage.append(fraction)
+        summary["histogram"][min(3, int(fraction * 4))] += 1
+        summary["mapped_images"] += 1
+        for row in range(grid):
+            y = (row + 0.5) * height / grid
+            for col in range(grid):
+                x = (col + 0.5) * width / grid
+                if index.at(x, y):
+                    summary["grid"][row][col] += 1
+    if coverage:
+        summary["mean_coverage"] = sum(coverage) / len(coverage)
+    return summary
+
+
+def format_coverage(summary):
+    lines = []
+    total = summary["total_images"]
+    cropped = summary["cropped_images"]
+    lines.append(f"Cropped images: {cropped}" + (f" of {total}" if total is not None else "") + f", {summary['crops']} crops")
+    lines.append(f"Mean coverage: {summary['mean_coverage'] * 100:.0f}% of the image area")
+    for label, count in zip(("< 25%", "25-50%", "50-75%", ">= 75%"), summary["histogram"]):
+        lines.append(f"  {label:>7s} covered: {count}")
+    lines.append(f"Crop pairs above the overlap limit: {summary['overlapping_pairs']}")
+    if summary["unknown_size"]:
+        lines.append(f"Not indexed yet (no dimensions): {summary['unknown_size']}")
+    if summary["mapped_images"]:
+        shades = " .:-=+*#%@"
+        lines.append("")
+        lines.append(f"Where the crops are (share of {summary['mapped_images']} images, top = top of the image):")
+        for row in summary["grid"]:
+            cells = [shades[min(9, round(9 * count / summary["mapped_images"]))] for count in row]
+            lines.append("  |" + "".join(cell * 2 for cell in cells) + "|")
+    return "\n".join(lines)
+
+
+class ImagePyramid:
+    """Lazily built chain of 2x reduced copies of an image."""
+
+    def __init__(self, image):
+        if image.mode not in ("L", "RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+        self.levels = [image]
+
+    @property
+    def base(self):
+        return self.levels[0]
+
+    def for_zoom(self, zoom):
+        """Returns the smallest level with at least `zoom` times the base resolution."""
+        while zoom <= 0.5 ** len(self.levels) and min(self.levels[-1].size) >= 2:
+            self.levels.append(self.levels[-1].reduce(2))
+        level = self.levels[0]
+        for candidate in self.levels:
+            if candidate.width >= self.base.width * zoom:
+                level = candidate
+        return level
+
+
+class TiledViewport:
+    """Shows an image on a canvas at any zoom; only visible tiles are converted to PhotoImages."""
+
+    tile_size = 512
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.pyramid = None
+        self.full_size = None
+        self.zoom = 1.0
+        self.tiles = {}  # (tx, ty) -> (PhotoImage, canvas item)
+
+    def set_image(self, image, full_size=None):
+        """Shows image, which may be a reduced preview of an image of full_size."""
+        self.clear()
+        self.pyramid = ImagePyramid(image) if image is not None else None
+        self.full_size = full_size or (image.size if image is not None else None)
+
+    def set_zoom(self, zoom):
+        if zoom != self.zoom:
+            self.clear()
+            self.zoom = zoom
+
+    def clear(self):
+        for photo, item in self.tiles.values():
+            self.canvas.delete(item)
+        self.tiles.clear()
+
+    def display_size(self):
+        w, h = self.full_size
+        return max(1, round(w * self.zoom)), max(1, round(h * self.zoom))
+
+    def update(self):
+        if not self.pyramid:
+            return
+        dw, dh = self.display_size()
+        t = self.tile_size
+        left, top = self.canvas.canvasx(0), self.canvas.canvasy(0)
+        right, bottom = left + self.canvas.winfo_width(), top + self.canvas.winfo_height()
+        tx0, tx1 = max(0, int(left // t)), min((dw - 1) // t, int(right // t))
+        ty0, ty1 = max(0, int(top // t)), min((dh - 1) // t, int(bottom // t))
+        visible = {(tx, ty) for tx in range(tx0, tx1 + 1) for ty in range(ty0, ty1 + 1)}
+        # Keep a one tile margin around the view, drop everything else
+        for key in list(self.tiles):
+            if not (tx0 - 1 <= key[0] <= tx1 + 1 and ty0 - 1 <= key[1] <= ty1 + 1):
+                self.canvas.delete(self.tiles.pop(key)[1])
+        created = False
+        for key in sorted(visible):
+            if key not in self.tiles:
+                self.tiles[key] = self._render_tile(*key, dw, dh)
+                created = True
+        if created:
+            self.canvas.tag_lower("tile")
+
+    def _render_tile(self, tx, ty, dw, dh):
+        t = self.tile_size
+        x0, y0 = tx * t, ty * t
+        x1, y1 = min(dw, x0 + t), min(dh, y0 + t)
+        base = self.pyramid.base
+        full_w, full_h = self.full_size
+        if self.zoom == 1.0 and base.size == self.full_size:
+            tile = base.crop((x0, y0, x1, y1))
+        else:
+            level = self.pyramid.for_zoom(self.zoom * full_w / base.width)
+            sx = level.width / full_w / self.zoom
+            sy = level.height / full_h / self.zoom
+            box = (x0 * sx, y0 * sy, min(level.width, x1 * sx), min(level.height, y1 * sy))
+            resample = Image.BILINEAR if self.zoom < 1.0 else Image.NEAREST
+            tile = level.resize((x1 - x0, y1 - y0), resample, box=box)
+        with instrumentation.span("photo"):
+            photo = ImageTk.PhotoImage(tile)
+        item = self.canvas.create_image(x0, y0, anchor="nw", image=photo, tags="tile")
+        return photo, item
+
+
+class ThumbnailCache:
+    """Thumbnails as small JPEG files on disk, keyed by the file content, shared by all folders.
+
+    The key is a digest of the file size and its first and last 64 KB, so thumbnails survive
+    renames and moves, and are regenerated when a file is replaced. Beyond max_mb the least
+    recently used thumbnails are deleted. Thread-safe, get() is called from worker threads.
+    """
+
+    def __init__(self, directory, max_mb=512, size=128):
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        self.size = size
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()  # key -> bytes on disk, least recently used first
+        self._total = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # Listing a large cache takes a while, so it happens in the background; get() waits for it
+        self._scanned = threading.Event()
+        threading.Thread(target=self._scan, name="thumb-scan", daemon=True).start()
+
+    def _scan(self):
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".jpg"):
+                    try:
+                        st = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    found.append((st.st_mtime, name[:-4], st.st_size))
+        with self._lock:
+            for _, key, nbytes in sorted(found):
+                self._entries[key] = nbytes
+                self._total += nbytes
+        self._scanned.set()
+
+    def key(self, path):
+        digest = hashlib.blake2b(digest_size=16)
+        size = os.path.getsize(path)
+        digest.update(f"{size}:{self.size}".encode())
+        with open(path, "rb") as f:
+            digest.update(f.read(64 * 1024))
+            if size > 128 * 1024:
+                f.seek(-64 * 1024, os.SEEK_END)
+                digest.update(f.read())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".jpg")
+
+    def get(self, path):
+        key = self.key(path)
+        thumb_path = self._path(key)
+        self._scanned.wait()
+        with self._lock:
+            cached = key in self._entries
+            if cached:
+                self._entries.move_to_end(key)
+        if cached:
+            try:
+                with Image.open(thumb_path) as thumb:
+                    thumb.load()
+                os.utime(thumb_path)  # Recency survives restarts
+                self.hits += 1
+                return thumb
+            except OSError:
+                pass  # Evicted meanwhile, generate it again
+        self.misses += 1
+        with Image.open(path) as image:
+            image.draft("RGB", (self.size, self.size))
+            image.thumbnail((self.size, self.size))
+            thumb = image.convert("RGB")
+        os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+        tmp_path = f"{thumb_path}.{threading.get_ident()}.tmp"
+        thumb.save(tmp_path, format="JPEG", quality=85)
+        os.replace(tmp_path, thumb_path)
+        self._add(key, os.path.getsize(thumb_path))
+        return thumb
+
+    def _add(self, key, nbytes):
+        evict = []
+        with self._lock:
+            self._total += nbytes - self._entries.pop(key, 0)
+            self._entries[key] = nbytes
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old_key, old_bytes = self._entries.popitem(last=False)
+                self._total -= old_bytes
+                evict.append(old_key)
+            self.evictions += len(evict)
+        for old_key in evict:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def stats(self):
+        return {"entries": len(self._entries), "mb": self._total / (1024 * 1024), "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+
+class Filmstrip:
+    """A horizontal strip of thumbnails over a list of images, any number of them.
+
+    Only the cells in view (plus a margin) have canvas items, and only they request thumbnails
+    and hold PhotoImages; thumbnails are loaded by load(path) -> future. status(path) returns
+    the border color of a cell.
+    """
+
+    cell = 104
+    margin = 4  # Cells beyond the view kept on each side
+
+    def __init__(self, canvas, load, status, on_select):
+        self.canvas = canvas
+        self.load = load
+        self.status = status
+        self.on_select = on_select
+        self.paths = []
+        self.length = 0
+        self.current = 0
+        self.cells = {}  # index -> (path, border item, image item or None, PhotoImage or None)
+        self.pending = {}  # index -> (path, future)
+        self._poll_id = None
+        canvas.bind("<Button-1>", self._on_click)
+        canvas.bind("<Configure>", lambda e: self.update())
+        canvas.bind("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1))
+        canvas.bind("<Button-4>", lambda e: self.scroll(-1))
+        canvas.bind("<Button-5>", lambda e: self.scroll(1))
+
+    def show(self, paths, current):
+        if paths is not self.paths or len(paths) != self.length:
+            self.clear()
+            self.paths = paths
+            self.length = len(paths)
+            self.canvas.configure(scrollregion=(0, 0, max(1, len(paths) * self.cell), self.cell))
+        self.current = current
+        self.scroll_into_view(current)
+        self.update()
+        self.refresh()
+
+    def clear(self):
+        for future in (future for _, future in self.pending.values()):
+            future.cancel()
+        self.pending = {}
+        self.cells = {}
+        self.canvas.delete("all")
+
+    def scroll(self, cells):
+        self.canvas.xview_scroll(cells * 3, "units")
+        self.update()
+
+    def scroll_into_view(self, index):
+        left = self.canvas.canvasx(0)
+        width = self.canvas.winfo_width()
+        x0 = index * self.cell
+        if x0 < left or x0 + self.cell > left + width:
+            total = max(1, len(self.paths) * self.cell)
+            self.canvas.xview_moveto(max(0, x0 - (width - self.cell) / 2) / total)
+
+    def visible_range(self):
+        left = self.canvas.canvasx(0)
+        first = int(left // self.cell) - self.margin
+        last = int((left + self.canvas.winfo_width()) // self.cell) + self.margin
+        return max(0, first), min(len(self.paths) - 1, last)
+
+    def update(self):
+        if not self.paths:
+            return
+        first, last = self.visible_range()
+        for index in [i for i in self.cells if not first <= i <= last]:
+            _, border, image_item, _ = self.cells.pop(index)
+            self.canvas.delete(border)
+            if image_item is not None:
+                self.canvas.delete(image_item)
+        for index in [i for i in self.pending if not first <= i <= last]:
+            self.pending.pop(index)[1].cancel()
+        for index in range(first, last + 1):
+            if index in self.cells:
+                continue
+            path = self.paths[index]
+            x0 = index * self.cell
+            color, width = self._style(index, path)
+            border = self.canvas.create_rectangle(x0 + 2, 2, x0 + self.cell - 2, self.cell - 2,
+                                                  outline=color, width=width, fill="gray15")
+            self.cells[index] = (path, border, None, None)
+            self.pending[index] = (path, self.load(path))
+        if self.pending and self._poll_id is None:
+            self._poll_id = self.canvas.after(30, self.poll)
+
+    def poll(self):
+        self._poll_id = None
+        for index, (path, future) in list(self.pending.items()):
+            if not future.done():
+                continue
+            del self.pending[index]
+            cell = self.cells.get(index)
+            if future.cancelled() or cell is None or cell[0] != path:
+                continue
+            try:
+                thumb = future.result()
+            except Exception as e:
+                print(f"Error creating thumbnail of {path}: {e}")
+                continue
+            photo = ImageTk.PhotoImage(thumb)
+            x, y = index * self.cell + self.cell // 2, self.cell // 2
+            image_item = self.canvas.create_image(x, y, image=photo)
+            # The placeholder fill would hide the thumbnail, only the border stays on top
+            self.canvas.itemconfig(cell[1], fill="")
+            self.canvas.tag_raise(cell[1])
+            self.cells[index] = (path, cell[1], image_item, photo)
+        if self.pending:
+            self._poll_id = self.canvas.after(30, self.poll)
+
+    def _style(self, index, path):
+        if index == self.current:
+            return "white", 3
+        return self.status(path), 2
+
+    def refresh(self):
+        """Updates the borders of the cells in view, e.g. after a crop was saved."""
+        for index, (path, border, _, _) in self.cells.items():
+            color, width = self._style(index, path)
+            self.canvas.itemconfig(border, outline=color, width=width)
+
+    def _on_click(self, event):
+        index = int(self.canvas.canvasx(event.x) // self.cell)
+        if 0 <= index < len(self.paths):
+            self.on_select(index)
+
+
+class FolderAnalyzer:
+    """Feeds the images of a folder to a worker function, nearest to the current image first.
+
+    lookup(path) may return a cached result, it is called on the polling thread.
+    poll() submits more work and returns the finished (path, result, error, cached) tuples.
+    """
+
+    def __init__(self, executor, fn, lookup=None, max_in_flight=4, lookups_per_poll=200):
+        self.executor = executor
+        self.fn = fn
+        self.lookup = lookup
+        self.max_in_flight = max_in_flight
+        self.lookups_per_poll = lookups_per_poll
+        self.paths = []
+        self._positions = {}
+        self._cursor = 0
+        self._seen = set()
+        self._in_flight = {}  # future -> path
+
+    def start(self, paths, index=0):
+        self.cancel()
+        self.paths = list(paths)
+        self._positions = {path: i for i, path in enumerate(self.paths)}
+        self._cursor = index
+
+    def cancel(self):
+        for future in self._in_flight:
+            future.cancel()
+        self._in_flight = {}
+        self._seen = set()
+        self.paths = []
+        self._positions = {}
+
+    def focus(self, path):
+        self._cursor = self._positions.get(path, self._cursor)
+
+    def requeue(self, path):
+        self._seen.discard(path)
+        if path not in self._positions:
+            self._positions[path] = len(self.paths)
+            self.paths.append(path)
+        self._cursor = self._positions[path]
+
+    def active(self):
+        return bool(self._in_flight) or len(self._seen) < len(self.paths)
+
+    def poll(self):
+        done = []
+        for future in [f for f in self._in_flight if f.done()]:
+            path = self._in_flight.pop(future)
+            if future.cancelled():
+                self._seen.discard(path)
+                continue
+            error = future.exception()
+            done.append((path, None if error else future.result(), error, False))
+
+        n = len(self.paths)
+        steps = lookups = 0
+        while (len(self._in_flight) < self.max_in_flight and len(self._seen) < n
+               and steps < n and lookups < self.lookups_per_poll):
+            self._cursor %= n
+            path = self.paths[self._cursor]
+            self._cursor += 1
+            steps += 1
+            if path in self._seen:
+                continue
+            self._seen.add(path)
+            cached = self.lookup(path) if self.lookup else None
+            lookups += 1
+            if cached is not None:
+                done.append((path, cached, None, True))
+            else:
+                self._in_flight[self.executor.submit(self.fn, path)] = path
+        return done
+
+
+class AnalysisCache:
+    """SQLite cache of per-file analysis results, keyed by the content hash of the file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS file_hashes (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    hash TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS suggestions (
+                    hash TEXT PRIMARY KEY,
+                    data TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS image_index (
+                    path TEXT PRIMARY KEY,
+                    folder TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    width INTEGER NOT NULL,
+                    height INTEGER NOT NULL,
+                    orientation INTEGER NOT NULL,
+                    mode TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS image_index_folder ON image_index (folder);
+                CREATE TABLE IF NOT EXISTS perceptual_hashes (
+                    path TEXT PRIMARY KEY,
+                    folder TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    dhash TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS perceptual_hashes_folder ON perceptual_hashes (folder);
+                CREATE TABLE IF NOT EXISTS quality_features (
+                    path TEXT PRIMARY KEY,
+                    folder TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    width INTEGER NOT NULL,
+                    height INTEGER NOT NULL,
+                    sharpness REAL NOT NULL,
+                    noise REAL NOT NULL,
+                    blockiness REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS quality_features_folder ON quality_features (folder);
+                CREATE TABLE IF NOT EXISTS directories (
+                    root TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    mtime INTEGER NOT NULL,
+                    files TEXT NOT NULL,
+                    subdirs TEXT NOT NULL,
+                    PRIMARY KEY (root, path)
+                );
+            """)
+
+    def lookup_hash(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        row = self.conn.execute("SELECT size, mtime, hash FROM file_hashes WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime:
+            return row[2]
+        return None
+
+    def store_hash(self, path, size, mtime, digest):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)", (path, size, mtime, digest))
+
+    def load_suggestions(self, digest):
+        row = self.conn.execute("SELECT data FROM suggestions WHERE hash = ?", (digest,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def store_suggestions(self, digest, suggestions):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO suggestions VALUES (?, ?)", (digest, json.dumps(suggestions)))
+
+    def load_index(self, folder):
+        rows = self.conn.execute(
+            "SELECT path, size, mtime, width, height, orientation, mode FROM image_index WHERE folder = ?", (folder,))
+        keys = ("path", "size", "mtime", "width", "height", "orientation", "mode")
+        return {row[0]: dict(zip(keys, row)) for row in rows}
+
+    def store_index(self, folder, rows):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO image_index VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(row["path"], folder, row["size"], row["mtime"], row["width"], row["height"],
+                  row["orientation"], row["mode"]) for row in rows])
+
+    def remove_index(self, path):
+        with self.conn:
+            self.conn.execute("DELETE FROM image_index WHERE path = ?", (path,))
+            self.conn.execute("DELETE FROM perceptual_hashes WHERE path = ?", (path,))
+            self.conn.execute("DELETE FROM quality_features WHERE path = ?", (path,))
+
+    def load_dhashes(self, folder):
+        rows = self.conn.execute("SELECT path, size, mtime, dhash FROM perceptual_hashes WHERE folder = ?", (folder,))
+        return {row[0]: {"size": row[1], "mtime": row[2], "dhash": int(row[3], 16)} for row in rows}
+
+    def store_dhashes(self, folder, rows):
+        # Hex text, SQLite integers are signed 64 bit
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO perceptual_hashes VALUES (?, ?, ?, ?, ?)",
+                [(row["path"], folder, row["size"], row["mtime"], f"{row['dhash']:016x}") for row in rows])
+
+    def load_quality(self, folder):
+        rows = self.conn.execute(
+            "SELECT path, size, mtime, width, height, sharpness, noise, blockiness FROM quality_features WHERE folder = ?",
+            (folder,))
+        keys = ("path", "size", "mtime", "width", "height", "sharpness", "noise", "blockiness")
+        return {row[0]: dict(zip(keys, row)) for row in rows}
+
+    def store_quality(self, folder, rows):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO quality_features VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(row["path"], folder, row["size"], row["mtime"], row["width"], row["height"],
+                  row["sharpness"], row["noise"], row["blockiness"]) for row in rows])
+
+    def load_directories(self, root):
+        rows = self.conn.execute("SELECT path, mtime, files, subdirs FROM directories WHERE root = ?", (root,))
+        return {row[0]: (row[1], json.loads(row[2]), json.loads(row[3])) for row in rows}
+
+    def store_directories(self, root, old, new):
+        """Writes the entries of the directory index new that differ from old."""
+        with self.conn:
+            self.conn.executemany("DELETE FROM directories WHERE root = ? AND path = ?",
+                                  [(root, path) for path in old if path not in new])
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?)",
+                [(root, path, mtime, json.dumps(files), json.dumps(subdirs))
+                 for path, (mtime, files, subdirs) in new.items() if old.get(path) is not new[path]])
+
+    def close(self):
+        self.conn.close()
+
+
+def suggest_crops(image, dimension_labels=DIMENSION_LABELS, analysis_size=256):
+    """Edge-energy crop position for every preset that fits the image.
+
+    Works on a grayscale copy downsampled to analysis_size (JPEGs are decoded at reduced
+    scale via draft) and returns {preset: [x0, y0, x1, y1]} in full resolution pixels.
+    """
+    import numpy as np
+    width, height = image.size
+    image.draft("L", (analysis_size, analysis_size))
+    gray = image.convert("L")
+    gray.thumbnail((analysis_size, analysis_size))
+    a = np.asarray(gray, dtype=np.float32)
+    rows, cols = a.shape
+    scale_x, scale_y = cols / width, rows / height
+
+    energy = np.zeros_like(a)
+    energy[:, 1:] += np.abs(np.diff(a, axis=1))
+    energy[1:, :] += np.abs(np.diff(a, axis=0))
+    # A mild center prior breaks ties and centers the crop on flat images
+    yy, xx = np.mgrid[0:rows, 0:cols]
+    prior = 1.0 - 0.25 * (((xx - cols / 2) / (cols / 2)) ** 2 + ((yy - rows / 2) / (rows / 2)) ** 2) / 2
+    energy = (energy + 1.0) * prior
+    integral = np.pad(energy.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+
+    suggestions = {}
+    for label, value in dimension_labels:
+        if value == "custom":
+            continue
+        pw, ph = map(int, value.split("x"))
+        if pw > width or ph > height:
+            continue
+        ww = max(1, min(cols, round(pw * scale_x)))
+        wh = max(1, min(rows, round(ph * scale_y)))
+        # Sum of every ww x wh window at once from the integral image
+        sums = integral[wh:, ww:] - integral[:-wh, ww:] - integral[wh:, :-ww] + integral[:-wh, :-ww]
+        iy, ix = np.unravel_index(np.argmax(sums), sums.shape)
+        x0 = max(0, min(width - pw, round(ix / scale_x)))
+        y0 = max(0, min(height - ph, round(iy / scale_y)))
+        suggestions[value] = [x0, y0, x0 + pw, y0 + ph]
+    return suggestions
+
+
+def analyze_crop_suggestions(image_path):
+    """Process pool worker for the suggestion stage."""
+    st = os.stat(image_path)
+    digest = file_digest(image_path)
+    with Image.open(image_path) as image:
+        suggestions = suggest_crops(image)
+    return {"size": st.st_size, "mtime": st.st_mtime, "hash": digest, "suggestions": suggestions}
+
+
+def image_dhash(path, hash_size=8):
+    """Process pool worker: difference hash (hash_size**2 bits) of a small grayscale copy of the image."""
+    import numpy as np
+    st = os.stat(path)
+    with Image.open(path) as image:
+        width, height = image.size
+        image.draft("L", (hash_size * 8, hash_size * 8))  # JPEGs are decoded reduced
+        small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return {"path": path, "size": st.st_size, "mtime": st.st_mtime, "width": width, "height": height,
+            "dhash": int.from_bytes(np.packbits(bits).tobytes(), "big")}
+
+
+def image_quality(path, side=512):
+    """Process pool worker: sharpness, noise and JPEG blockiness of a reduced grayscale decode.
+
+    The image is decoded at most 4x reduced (JPEGs while decoding), so the 8x8 blocks are still
+    2 pixels apart. Blockiness is the mean step across the block borders over the mean step
+    elsewhere (1.0 = no blocks) and noise the Immerkaer estimate of the noise sigma without the
+    strongest edges, both on the center 1024 x 1024. Sharpness is the variance of the Laplacian
+    of a copy scaled to side pixels, so images of any size compare.
+    """
+    import numpy as np
+    st = os.stat(path)
+    with Image.open(path) as image:
+        width, height = image.size
+        image.draft("L", (max(1, width // 4), max(1, height // 4)))
+        decoded = image.convert("L")
+    period = round(8 * decoded.width / width)
+    x0, y0 = (max(0, (n - 1024) // 2) // max(1, period) * max(1, period) for n in decoded.size)
+    pixels = np.asarray(decoded, dtype=np.float32)[y0:y0 + 1024, x0:x0 + 1024]
+    blockiness, noise = 1.0, 0.0
+    if period >= 2:
+        steps = []
+        for diffs in (np.abs(np.diff(pixels, axis=1)), np.abs(np.diff(pixels, axis=0)).T):
+            border = np.zeros(diffs.shape[1], dtype=bool)
+            border[period - 1::period] = True
+            if border.any() and (~border).any():
+                steps.append((diffs[:, border].mean(), diffs[:, ~border].mean()))
+        if steps:
+            across, inside = map(sum, zip(*steps))
+            blockiness = float(across / inside) if inside > 0 else 1.0
+    if min(pixels.shape) >= 3:
+        center = pixels[1:-1, 1:-1]
+        # Second differences in both directions, zero on flat areas and gradients
+        mask = (pixels[:-2, :-2] - 2 * pixels[:-2, 1:-1] + pixels[:-2, 2:]
+                - 2 * (pixels[1:-1, :-2] - 2 * center + pixels[1:-1, 2:])
+                + pixels[2:, :-2] - 2 * pixels[2:, 1:-1] + pixels[2:, 2:])
+        gradient = np.abs(pixels[1:-1, 2:] - pixels[1:-1, :-2]) + np.abs(pixels[2:, 1:-1] - pixels[:-2, 1:-1])
+        flat = gradient <= np.percentile(gradient, 90)
+        noise = float(np.sqrt(np.pi / 2) * np.abs(mask[flat]).mean() / 6)
+    scale = side / max(decoded.size)
+    if scale < 1:
+        decoded = decoded.resize((max(1, round(decoded.width * scale)), max(1, round(decoded.height * scale))),
+                                 Image.BILINEAR)
+    pixels = np.asarray(decoded, dtype=np.float32)
+    sharpness = 0.0
+    if min(pixels.shape) >= 3:
+        laplacian = (pixels[:-2, 1:-1] + pixels[2:, 1:-1] + pixels[1:-1, :-2] + pixels[1:-1, 2:]
+                     - 4 * pixels[1:-1, 1:-1])
+        sharpness = float(laplacian.var())
+    return {"path": path, "size": st.st_size, "mtime": st.st_mtime, "width": width, "height": height,
+            "sharpness": sharpness, "noise": noise, "blockiness": blockiness}
+
+
+def quality_score(features, dimension_labels=DIMENSION_LABELS):
+    """0-100 triage score from image_quality features.
+
+    Sharpness counts most, then the resolution: the area of the largest preset the image fits,
+    relative to the largest preset. Noise and blockiness are subtracted.
+    """
+    width, height = features["width"], features["height"]
+    presets = [tuple(map(int, value.split("x"))) for _, value in dimension_labels if value != "custom"]
+    largest = max(w * h for w, h in presets) if presets else 1
+    fitting = choose_preset(width, height, "portrait" if height > width else "landscape", dimension_labels)
+    resolution = 0.0
+    if fitting:
+        w, h = map(int, fitting.split("x"))
+        resolution = w * h / largest
+    sharpness = min(1.0, math.log1p(features["sharpness"]) / math.log1p(1000))
+    noise = min(1.0, features["noise"] / 10)
+    blockiness = min(1.0, max(0.0, features["blockiness"] - 1.02) / 0.1)
+    return round(100 * (0.45 * sharpness + 0.3 * resolution + 0.15 * (1 - noise) + 0.1 * (1 - blockiness)), 1)
+
+
+def hamming_weight(values):
+    import numpy as np
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    popcount = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    return popcount[values.view(np.uint8)].reshape(values.shape + (-1,)).sum(axis=-1)
+
+
+def cluster_hashes(hashes, threshold=6, block=512):
+    """Single linkage clusters of 64 bit hashes within threshold Hamming distance.
+
+    Identical hashes are merged first, then distances between the distinct hashes are computed
+    block by block (block x n) to bound memory. Returns lists of indices into hashes, only
+    clusters with more than one member.
+    """
+    import numpy as np
+    values, inverse = np.unique(np.asarray(hashes, dtype=np.uint64), return_inverse=True)
+    n = len(values)
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for start in range(0, n, block):
+        rows = values[start:start + block]
+        # Upper triangle only: row i against columns >= start
+        distances = hamming_weight(rows[:, None] ^ values[None, start:])
+        ii, jj = np.nonzero(distances <= threshold)
+        ii += start
+        jj += start
+        for a, b in zip(ii[jj > ii].tolist(), jj[jj > ii].tolist()):
+            ra, rb = find(a), find(b)
+            if ra != rb:
+                parent[max(ra, rb)] = min(ra, rb)
+    clusters = defaultdict(list)
+    for i, value in enumerate(inverse.ravel().tolist()):
+        clusters[find(value)].append(i)
+    return [members for members in clusters.values() if len(members) > 1]
+
+
+class CropStore:
+    """Storage backend for crop records and last cropped entries, keyed by folder and image."""
+
+    def load_folder(self, folder):
+        """Returns {image_path: [{"size": ..., "coords": [x0, y0, x1, y1]}]} for one folder."""
+        raise NotImplementedError
+
+    def folders(self):
+        raise NotImplementedError
+
+    def has_crops(self, folder, image_path):
+        return bool(self.load_folder(folder).get(image_path))
+
+    def add_crop(self, folder, image_path, size, coords):
+        raise NotImplementedError
+
+    def add_crops(self, crops, last_cropped=None):
+        """Adds (folder, image_path, size, coords) records and optionally sets a (folder, entry) last cropped entry."""
+        for folder, image_path, size, coords in crops:
+            self.add_crop(folder, image_path, size, coords)
+        if last_cropped:
+            self.set_last_cropped(*last_cropped)
+
+    def remove_crop(self, folder, image_path, size, coords):
+        raise NotImplementedError
+
+    def remove_image(self, folder, image_path):
+        raise NotImplementedError
+
+    def folder_stats(self, folder):
+        """Returns the FolderStats aggregates of a folder."""
+        raise NotImplementedError
+
+    def load_last_cropped(self, folder):
+        raise NotImplementedError
+
+    def set_last_cropped(self, folder, entry):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SqliteCropStore(CropStore):
+    """Crop store in a SQLite database; every change is a single atomic transaction."""
+
+    def __init__(self, path):
+        self.path = path
+        # The GUI opens the store on a loader thread and uses it only on the main thread after that
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS crops (
+                    folder TEXT NOT NULL,
+                    image_path TEXT NOT NULL,
+                    size TEXT NOT NULL,
+                    x0 INTEGER NOT NULL, y0 INTEGER NOT NULL, x1 INTEGER NOT NULL, y1 INTEGER NOT NULL,
+                    UNIQUE (folder, image_path, size, x0, y0, x1, y1)
+                );
+                CREATE TABLE IF NOT EXISTS last_cropped (
+                    folder TEXT PRIMARY KEY,
+                    entry TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                CREATE TABLE IF NOT EXISTS folder_stats (
+                    folder TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value INTEGER NOT NULL,
+                    PRIMARY KEY (folder, key)
+                );
+            """)
+        if not self.conn.execute("SELECT 1 FROM meta WHERE key = 'stats_built'").fetchone():
+            self.rebuild_stats()
+
+    def rebuild_stats(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM folder_stats")
+            folders = [row[0] for row in self.conn.execute("SELECT DISTINCT folder FROM crops")]
+            for folder in folders:
+                counters = FolderStats.from_crops(self.load_folder(folder)).as_dict()
+                rows = [(f"size:{k}", v) for k, v in counters["sizes"].items()]
+                rows += [(f"orientation:{k}", v) for k, v in counters["orientations"].items()]
+                rows += [("total_crops", counters["total_crops"]), ("cropped_images", counters["cropped_images"])]
+                self.conn.executemany("INSERT INTO folder_stats VALUES (?, ?, ?)", [(folder, k, v) for k, v in rows])
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('stats_built', '1')")
+
+    def _update_stats(self, folder, deltas):
+        self.conn.executemany(
+            "INSERT INTO folder_stats VALUES (?, ?, ?) "
+            "ON CONFLICT (folder, key) DO UPDATE SET value = value + excluded.value",
+            [(folder, key, delta) for key, delta in deltas])
+        self.conn.execute("DELETE FROM folder_stats WHERE folder = ? AND value <= 0", (folder,))
+
+    def _image_crop_count(self, folder, image_path):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM crops WHERE folder = ? AND image_path = ?", (folder, image_path)).fetchone()[0]
+
+    def load_folder(self, folder):
+        data = {}
+        rows = self.conn.execute(
+            "SELECT image_path, size, x0, y0, x1, y1 FROM crops WHERE folder = ? ORDER BY rowid", (folder,))
+        for image_path, size, x0, y0, x1, y1 in rows:
+            data.setdefault(image_path, []).append({"size": size, "coords": [x0, y0, x1, y1]})
+        return data
+
+    def folders(self):
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT folder FROM crops ORDER BY folder")]
+
+    def has_crops(self, folder, image_path):
+        return self._image_crop_count(folder, image_path) > 0
+
+    def _insert_crop(self, folder, image_path, size, coords):
+        cursor = self.conn.execute("INSERT OR IGNORE INTO crops VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   (folder, image_path, size, *map(int, coords)))
+        if cursor.rowcount:
+            first = self._image_crop_count(folder, image_path) == 1
+            self._update_stats(folder, FolderStats.deltas(size, 1 if first else 0))
+
+    def add_crop(self, folder, image_path, size, coords):
+        with self.conn:
+            self._insert_crop(folder, image_path, size, coords)
+
+    def add_crops(self, crops, last_cropped=None):
+        with self.conn:
+            for folder, image_path, size, coords in crops:
+                self._insert_crop(folder, image_path, size, coords)
+            if last_cropped:
+                folder, entry = last_cropped
+                self.conn.execute("INSERT OR REPLACE INTO last_cropped VALUES (?, ?)", (folder, json.dumps(entry)))
+
+    def remove_crop(self, folder, image_path, size, coords):
+        with self.conn:
+            cursor = self.conn.execute(
+                "DELETE FROM crops WHERE folder = ? AND image_path = ? AND size = ? AND x0 = ? AND y0 = ? AND x1 = ? AND y1 = ?",
+                (folder, image_path, size, *map(int, coords)))
+            if cursor.rowcount:
+                last = self._image_crop_count(folder, image_path) == 0
+                self._update_stats(folder, FolderStats.deltas(size, -1 if last else 0, -1))
+
+    def remove_image(self, folder, image_path):
+        with self.conn:
+            sizes = [row[0] for row in self.conn.execute(
+                "SELECT size FROM crops WHERE folder = ? AND image_path = ?", (folder, image_path))]
+            if not sizes:
+                return
+            self.conn.execute("DELETE FROM crops WHERE folder = ? AND image_path = ?", (folder, image_path))
+            deltas = [("cropped_images", -1)]
+            for size in sizes:
+                deltas += FolderStats.deltas(size, sign=-1)
+            self._update_stats(folder, deltas)
+
+    def folder_stats(self, folder):
+        rows = self.conn.execute("SELECT key, value FROM folder_stats WHERE folder = ?", (folder,))
+        return FolderStats.from_counters(dict(rows))
+
+    def load_last_cropped(self, folder):
+        row = self.conn.execute("SELECT entry FROM last_cropped WHERE folder = ?", (folder,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_last_cropped(self, folder, entry):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO last_cropped VALUES (?, ?)", (folder, json.dumps(entry)))
+
+    def import_json(self, cropped_info_file, last_cropped_file):
+        """One-time import of the cropped_info.json / last_cropped.json files of older versions."""
+        if self.conn.execute("SELECT 1 FROM meta WHERE key = 'imported_json'").fetchone():
+            return
+        cropped_info = {"data": {}}
+        last_cropped = {}
+        try:
+            with open(cropped_info_file, 'r') as f:
+                cropped_info = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        try:
+            with open(last_cropped_file, 'r') as f:
+                last_cropped = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        with self.conn:
+            for folder, images in cropped_info.get("data", {}).items():
+                for image_path, crops in images.items():
+                    self.conn.executemany(
+                        "INSERT OR IGNORE INTO crops VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [(folder, image_path, crop["size"], *map(int, crop["coords"])) for crop in crops])
+            for folder, entry in last_cropped.items():
+                self.conn.execute("INSERT OR REPLACE INTO last_cropped VALUES (?, ?)", (folder, json.dumps(entry)))
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('imported_json', ?)", (cropped_info_file,))
+        self.rebuild_stats()
+
+    def close(self):
+        self.conn.close()
+
+
+class JsonCropStore(CropStore):
+    """The original storage: everything in cropped_info.json / last_cropped.json, rewritten on every change."""
+
+    def __init__(self, cropped_info_file="cropped_info.json", last_cropped_file="last_cropped.json"):
+        self.cropped_info_file = cropped_info_file
+        self.last_cropped_file = last_cropped_file
+        self.cropped_info = self._read(cropped_info_file, {"data": {}})
+        self.last_cropped = self._read(last_cropped_file, {})
+
+    def _read(self, path, default):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return default
+
+    def _write(self, path, data):
+        # Write to a temp file and swap it in, so a crash never leaves a truncated file behind
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error saving {path}: {e}")
+
+    def load_folder(self, folder):
+        images = self.cropped_info["data"].get(folder, {})
+        return {image_path: [{"size": crop["size"], "coords": list(crop["coords"])} for crop in crops]
+                for image_path, crops in images.items()}
+
+    def folders(self):
+        return sorted(self.cropped_info["data"])
+
+    def _append_crop(self, folder, image_path, size, coords):
+        crops = self.cropped_info["data"].setdefault(folder, {}).setdefault(image_path, [])
+        if any(crop["size"] == size and list(crop["coords"]) == list(coords) for crop in crops):
+            return False
+        crops.append({"size": size, "coords": list(coords)})
+        return True
+
+    def add_crop(self, folder, image_path, size, coords):
+        if self._append_crop(folder, image_path, size, coords):
+            self._write(self.cropped_info_file, self.cropped_info)
+
+    def add_crops(self, crops, last_cropped=None):
+        added = [self._append_crop(*crop) for crop in crops]
+        if any(added):
+            self._write(self.cropped_info_file, self.cropped_info)
+        if last_cropped:
+            self.set_last_cropped(*last_cropped)
+
+    def remove_crop(self, folder, image_path, size, coords):
+        crops = self.cropped_info["data"].get(folder, {}).get(image_path, [])
+        crops[:] = [crop for crop in crops if not (crop["size"] == size and list(crop["coords"]) == list(coords))]
+        self._write(self.cropped_info_file, self.cropped_info)
+
+    def remove_image(self, folder, image_path):
+        images = self.cropped_info["data"].get(folder, {})
+        if images.pop(image_path, None) is not None:
+            if not images:
+                del self.cropped_info["data"][folder]
+            self._write(self.cropped_info_file, self.cropped_info)
+
+    def folder_stats(self, folder):
+        return FolderStats.from_crops(self.cropped_info["data"].get(folder, {}))
+
+    def load_last_cropped(self, folder):
+        return self.last_cropped.get(folder)
+
+    def set_last_cropped(self, folder, entry):
+        self.last_cropped[folder] = entry
+        self._write(self.last_cropped_file, self.last_cropped)
+
+
+class PowerCropper:
+    def __init__(self, root, crop_store_backend="sqlite", cache_budget_mb=1024, prefetch_ahead=3, prefetch_behind=1):
+        self.root = root
+        self.root.title("Power Cropper")
+
+        # --- THEME ---
+        ctk.set_default_color_theme("blue")
+
+        self.crop_size = (1024, 1024)
+        self.images = []
+        self.current_index = 0
+        self.cropped_info = {}
+        self.cropped_info["data"] = {}
+        self.cropped_info_file = "cropped_info.json"
+        self.last_cropped_file = "last_cropped.json"
+        self.crop_store_file = "cropped_info.db"
+        self.crop_store_backend = crop_store_backend  # or "json" for the plain cropped_info.json files
+        self.downscale_to = 1024
+        self.resample_filter = "LANCZOS"
+        self.resize_batch = None
+        self.folder_stats = {}  # folder -> FolderStats
+        # Spatial index of the crops of each image, built on first use: (folder, image path) -> CropIndex
+        self.crop_indexes = {}
+        self.overlap_iou = 0.9  # Crops overlapping an existing crop of the image this much are warned about or rejected
+
+        # Decoded image cache + background prefetch of neighbouring images
+        self.cache_budget_mb = cache_budget_mb
+        self.prefetch_ahead = prefetch_ahead
+        self.prefetch_behind = prefetch_behind
+        self.image_cache = ImageCache(self.cache_budget_mb)
+        # Below 100% zoom images are decoded at reduced resolution, the full resolution follows on demand
+        self.preview_decode = True
+        self._canvas_size = (1, 1)
+        self.prefetcher = ImagePrefetcher(self.image_cache, self.prefetch_ahead, self.prefetch_behind,
+                                          preview_scale=self.preview_scale_for)
+
+        # Crops are encoded and written in the background
+        self.save_workers = max(2, min(4, os.cpu_count() or 2))
+        self.max_pending_saves = 8
+        self.save_queue = WriteBehindQueue(self.save_workers, self.max_pending_saves)
+        self._save_poll_id = None
+        # Output format of this session, see the Output settings dialog
+        self.output_encoder = OutputEncoder()
+
+        # Crop suggestions are computed per folder in background processes and cached by file hash.
+        # Unlike the crop store it is opened right away: opening only reads the schema, folders are
+        # read from it when they are opened
+        self.analysis_cache_file = "analysis_cache.db"
+        self.analysis_cache = AnalysisCache(self.analysis_cache_file)
+        self.analysis_workers = max(1, (os.cpu_count() or 2) - 1)
+        # Spawned, not forked: the GUI process runs Tk and worker threads
+        self.analysis_pool = ProcessPoolExecutor(max_workers=self.analysis_workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        self.suggestions = {}  # image path -> {preset: coords}
+        self.suggestion_analyzer = FolderAnalyzer(self.analysis_pool, analyze_crop_suggestions, self.lookup_suggestions,
+                                                  max_in_flight=self.analysis_workers * 2)
+
+        # Header-only metadata index of the folder (dimensions, mode, orientation), persisted in the analysis cache
+        self.io_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="index")
+        self.image_index = {}  # image path -> header metadata
+        self.index_analyzer = FolderAnalyzer(self.io_pool, read_image_header, self.lookup_index,
+                                             max_in_flight=32, lookups_per_poll=2000)
+        # Perceptual hashes for near-duplicate detection, cached by size and mtime in the analysis cache
+        self.dhashes = {}  # image path -> hash result
+        self.dhash_analyzer = FolderAnalyzer(self.analysis_pool, image_dhash, self.lookup_dhash,
+                                             max_in_flight=self.analysis_workers * 2, lookups_per_poll=2000)
+        # Quality features for triage ordering, cached by size and mtime in the analysis cache
+        self.quality = {}  # image path -> image_quality result
+        self.quality_scores = {}  # image path -> quality_score, for the presets of the session
+        self.quality_analyzer = FolderAnalyzer(self.analysis_pool, image_quality, self.lookup_quality,
+                                               max_in_flight=self.analysis_workers * 2, lookups_per_poll=2000)
+        self.duplicate_threshold = 6  # Max Hamming distance of 64 bit dHashes
+        self.duplicates = {}  # image path -> its cluster (list of paths)
+        self._cluster_future = None
+        self.analyzers = [self.suggestion_analyzer, self.index_analyzer, self.dhash_analyzer, self.quality_analyzer]
+        self._analysis_poll_id = None
+        # Filmstrip thumbnails, cached on disk by content across folders and sessions
+        self.thumbnail_cache = ThumbnailCache("thumbnails", max_mb=512, size=Filmstrip.cell - 8)
+        self.thumbnail_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="thumb")
+
+        # All images of the folder by name; self.images is the navigation order (sorted/filtered)
+        self.folder_images = []
+        self._scan_token = None
+        # Directory listings of the open folder, persisted in the analysis cache; only directories
+        # whose mtime changed are listed again, on reopen and by the periodic rescan
+        self.dir_index = {}
+        self.recursive_scan = False
+        self.rescan_interval = 5000  # ms
+        self._rescan_id = None
+
+        self.custom_mode = False
+        self.custom_start = None
+        self.last_cropped_entry = {}  # Changed to dict
+        self.current_folder = None
+        self.radio_buttons = {}
+
+        # --- Main Frames ---
+        main_frame = ctk.CTkFrame(root)
+        main_frame.pack(side=ctk.TOP, fill=ctk.BOTH, expand=True)
+
+        # Left and right frames
+        left_frame = ctk.CTkFrame(main_frame)
+        left_frame.pack(side=ctk.LEFT, fill=ctk.BOTH, expand=True)
+
+        self.right_frame = ctk.CTkFrame(main_frame, width=200)
+        self.right_frame.pack(side=ctk.RIGHT, fill=ctk.Y)
+        self.right_frame.pack_propagate(False)
+        self.right_frame.pack_forget()
+
+        control_frame = ctk.CTkFrame(root)
+        control_frame.pack(side=ctk.BOTTOM, fill=ctk.X, pady=5)
+
+        info_frame = ctk.CTkFrame(root)
+        info_frame.pack(side=ctk.BOTTOM, fill=ctk.X, pady=5)
+
+        self.dim_label = ctk.CTkLabel(left_frame, text="", font=("Arial", 12))
+        self.dim_label.pack(pady=2)
+
+        # Cropped Info Label
+        self.cropped_label = ctk.CTkLabel(left_frame, text="", font=("Arial", 10), text_color="yellow")
+        self.cropped_label.pack(pady=2)
+
+        # Staged crops of the current image in multi-crop mode
+        self.staged_label = ctk.CTkLabel(left_frame, text="", font=("Arial", 10), text_color="orange")
+        self.staged_label.pack(pady=2)
+
+        # Overlap warnings of the last save, kept for a few seconds across image changes
+        self.overlap_label = ctk.CTkLabel(left_frame, text="", font=("Arial", 10), text_color="orange")
+        self.overlap_label.pack(pady=2)
+        self._overlap_label_id = None
+
+        # --- SCROLLABLE CANVAS SETUP ---
+        canvas_frame = ctk.CTkFrame(left_frame)
+        canvas_frame.pack(fill=ctk.BOTH, expand=True)
+
+        self.canvas = ctk.CTkCanvas(canvas_frame, cursor="cross", bg="black", highlightthickness=0)
+        self.canvas.pack(side=ctk.LEFT, fill=ctk.BOTH, expand=True)
+
+        self.v_scroll = ctk.CTkScrollbar(canvas_frame, orientation=ctk.VERTICAL, command=self.canvas.yview)
+        self.v_scroll.pack(side=ctk.RIGHT, fill=ctk.Y)
+        self.h_scroll = ctk.CTkScrollbar(left_frame, orientation=ctk.HORIZONTAL, command=self.canvas.xview)
+        self.h_scroll.pack(fill=ctk.X)
+
+        # Thumbnails of the folder, only the visible ones are loaded; toggled with V
+        self.filmstrip_frame = ctk.CTkFrame(left_frame)
+        self.filmstrip_frame.pack(fill=ctk.X)
+        filmstrip_canvas = ctk.CTkCanvas(self.filmstrip_frame, height=Filmstrip.cell, bg="gray10",
+                                         highlightthickness=0)
+        filmstrip_canvas.pack(fill=ctk.X)
+        filmstrip_scroll = ctk.CTkScrollbar(self.filmstrip_frame, orientation=ctk.HORIZONTAL,
+                                            command=self._on_filmstrip_scroll)
+        filmstrip_scroll.pack(fill=ctk.X)
+        filmstrip_canvas.configure(xscrollcommand=filmstrip_scroll.set)
+        self.filmstrip_visible = True
+        self.filmstrip = Filmstrip(filmstrip_canvas, self.load_thumbnail, self.thumbnail_status, self.select_image)
+
+        # Latency overlay of the instrumentation, toggled with I
+        self.stats_label = ctk.CTkLabel(canvas_frame, text="", font=("Courier", 11), justify=ctk.LEFT,
+                                        fg_color="gray20", corner_radius=6)
+        self.stats_visible = False
+        self.trace_file = None  # Written on close when set (--trace)
+        self.recorder = None  # SessionRecorder when the session is recorded (--record)
+
+        # The scroll commands fire on every view change, which is when new tiles may become visible
+        self.canvas.configure(yscrollcommand=self._on_yscroll, xscrollcommand=self._on_xscroll)
+        self.canvas.bind("<Configure>", self.on_canvas_configure)
+
+        # Zoom: canvas coordinates are image coordinates * zoom
+        self.viewport = TiledViewport(self.canvas)
+        self.zoom = 1.0
+        self.fit_mode = False
+        self.min_zoom = 0.05
+        self.max_zoom = 4.0
+        self._tile_update_id = None
+
+        # Motion and wheel events are handled at most once per frame
+        self.coalescer = EventCoalescer(self.root)
+        # The preset rectangle follows the cursor as a dashed outline, toggled with P
+        self.show_preset_preview = True
+        self._hovered_crops = None
+
+        # Mousewheel bindings (platform-independent)
+        self.canvas.bind("<Enter>", lambda e: self._bind_mousewheel())
+        self.canvas.bind("<Leave>", self.on_canvas_leave)
+
+        open_button = ctk.CTkButton(control_frame, text="Open Folder (O)", command=self.load_folder)
+        open_button.pack(side=ctk.LEFT, padx=5)
+        self.recursive = ctk.BooleanVar(value=False)
+        recursive_checkbox = ctk.CTkCheckBox(control_frame, text="Subfolders", variable=self.recursive, width=100)
+        recursive_checkbox.pack(side=ctk.LEFT, padx=5)
+        self.prev_button = ctk.CTkButton(control_frame, text="Prev (A)", state=ctk.DISABLED, command=self.prev_image)
+        self.prev_button.pack(side=ctk.LEFT, padx=5)
+        self.next_button = ctk.CTkButton(control_frame, text="Next (D)", state=ctk.DISABLED, command=self.next_image)
+        self.next_button.pack(side=ctk.LEFT, padx=5)
+        self.save_button = ctk.CTkButton(control_frame, text="Save (S)", state=ctk.DISABLED, command=self.quick_save)
+        self.save_button.pack(side=ctk.LEFT, padx=5)
+
+        self.delete_button = ctk.CTkButton(control_frame, text="Delete (X)", state=ctk.DISABLED, command=self.delete_current_image)
+        self.delete_button.pack(side=ctk.LEFT, padx=5)
+        self.resize_button = ctk.CTkButton(control_frame, text="Resize (R)", state=ctk.DISABLED, command=self.resize_and_save_image)
+        self.resize_button.pack(side=ctk.LEFT, padx=5)
+        self.resize_all_button = ctk.CTkButton(control_frame, text="Resize All (Shift+R)", state=ctk.DISABLED, command=self.resize_all_images)
+        self.resize_all_button.pack(side=ctk.LEFT, padx=5)
+        output_button = ctk.CTkButton(control_frame, text="Output...", command=self.output_settings)
+        output_button.pack(side=ctk.LEFT, padx=5)
+
+
+        # Size presets + custom
+        self.size_var = ctk.StringVar(value="1024x1024")
+        size_frame = ctk.CTkFrame(info_frame)
+        size_frame.pack(side=ctk.LEFT, padx=10)
+
+        # Portrait/Landscape Preference
+        self.orientation_preference = ctk.StringVar(value="portrait")
+        ctk.CTkLabel(size_frame, text="Prefer:").pack(side=ctk.LEFT)
+        self.portrait_radio = ctk.CTkRadioButton(size_frame, text="Portrait", variable=self.orientation_preference, value="portrait", command=self.on_orientation_selected)
+        self.landscape_radio = ctk.CTkRadioButton(size_frame, text="Landscape", variable=self.orientation_preference, value="landscape", command=self.on_orientation_selected)
+        self.portrait_radio.pack(side=ctk.LEFT)
+        self.landscape_radio.pack(side=ctk.LEFT)
+        self.orientation_preference.set("portrait")
+
+        # Previous crops overlay toggle
+        self.windowing_system = self.root.tk.call("tk", "windowingsystem")
+        self.show_previous_crops = ctk.BooleanVar(value=True)
+        self.overlay_checkbox = ctk.CTkCheckBox(info_frame, text="Show crops (T)", variable=self.show_previous_crops, command=self.draw_previous_crops)
+        self.overlay_checkbox.pack(side=ctk.RIGHT, padx=10)
+        self.auto_suggest = ctk.BooleanVar(value=True)
+        self.suggest_checkbox = ctk.CTkCheckBox(info_frame, text="Suggest crop (G)", variable=self.auto_suggest, command=self.on_auto_suggest_changed)
+        self.suggest_checkbox.pack(side=ctk.RIGHT, padx=10)
+
+        # Navigation order, based on the metadata index
+        self.order_var = ctk.StringVar(value="Name")
+        self.order_menu = ctk.CTkOptionMenu(info_frame, variable=self.order_var, width=130,
+                                            values=["Name", "Largest first", "Smallest first", "Best quality first"],
+                                            command=lambda _: self.on_navigation_order_changed())
+        self.order_menu.pack(side=ctk.RIGHT, padx=5)
+        self.filter_var = ctk.StringVar(value="All images")
+        self.filter_menu = ctk.CTkOptionMenu(info_frame, variable=self.filter_var, width=150,
+                                             values=["All images", "Score >= 50", "Score >= 70"]
+                                             + [f"Fits {value}" for _, value in DIMENSION_LABELS if value != "custom"],
+                                             command=lambda _: self.on_navigation_order_changed())
+        self.filter_menu.pack(side=ctk.RIGHT, padx=5)
+        self.skip_duplicates = ctk.BooleanVar(value=False)
+        self.skip_duplicates_checkbox = ctk.CTkCheckBox(info_frame, text="Skip duplicates (K)", variable=self.skip_duplicates,
+                                                        command=self.on_navigation_order_changed)
+        self.skip_duplicates_checkbox.pack(side=ctk.RIGHT, padx=10)
+        self.multi_crop = ctk.BooleanVar(value=False)
+        self.staged_crops = {}  # image path -> staged crop boxes, saved together with Enter
+        self.multi_crop_checkbox = ctk.CTkCheckBox(info_frame, text="Multi-crop (M)", variable=self.multi_crop,
+                                                   command=self.update_staged_label)
+        self.multi_crop_checkbox.pack(side=ctk.RIGHT, padx=10)
+        self.overlap_mode = ctk.StringVar(value="Warn on overlap")
+        self.overlap_menu = ctk.CTkOptionMenu(info_frame, variable=self.overlap_mode, width=150,
+                                              values=["Allow overlaps", "Warn on overlap", "Reject overlaps"])
+        self.overlap_menu.pack(side=ctk.RIGHT, padx=5)
+
+        self.dimension_labels = list(DIMENSION_LABELS)
+        self.radio_buttons = {}
+        for label in self.dimension_labels:
+            rb = ctk.CTkRadioButton(size_frame, text=label[0], variable=self.size_var, 
+                                value=label[1], command=self.on_size_selected)
+            rb.pack(side=ctk.LEFT)
+            self.radio_buttons[label[1]] = rb
+
+        # --- SHORTCUT LEGEND ---
+        shortcut_text = "Wheel=VScroll  Shift+Wheel=HScroll  Ctrl+Wheel/+/-=Zoom  F=Fit  1=100%  I=Stats"
+        self.shortcut_label = ctk.CTkLabel(control_frame, text=shortcut_text, font=("Arial", 10))
+        self.shortcut_label.pack(side=ctk.RIGHT, padx=10)
+
+        # Pending background saves
+        self.pending_label = ctk.CTkLabel(control_frame, text="", font=("Arial", 10), text_color="orange")
+        self.pending_label.pack(side=ctk.RIGHT, padx=10)
+
+        # --- DIMENSION COUNTS PANEL ---
+        self.counts_frame = ctk.CTkFrame(self.right_frame)
+        self.counts_frame.pack(side=ctk.TOP, fill=ctk.BOTH, expand=True)
+
+        self.counts_label = ctk.CTkLabel(self.counts_frame, text="Cropped Dimensions:\n\n", justify=ctk.LEFT, font=("Arial", 16))
+        self.counts_label.pack(padx=5, pady=20)
+
+        # "Jump to Last Cropped" Button
+        jump_cropped_button = ctk.CTkButton(control_frame, text="Jump to Last Cropped (W)", command=self.jump_to_last_cropped)
+        jump_cropped_button.pack(side=ctk.LEFT, padx=5)
+        
+        self.rect = None
+        self.rect_coords = None
+        self.current_image = None
+        self.save_folder = None
+        self.custom_dim_text = None
+
+        # Event bindings
+        self.canvas.bind("<Button-1>", self.on_mouse_down)
+        self.canvas.bind("<B1-Motion>", self.on_mouse_drag)
+        self.canvas.bind("<Motion>", self.on_mouse_move)
+        self.canvas.bind("<ButtonRelease-1>", self.on_mouse_up)
+        self.root.bind("o", lambda e: self.load_folder())
+        self.root.bind("a", lambda e: self.prev_image())
+        self.root.bind("d", lambda e: self.next_image())
+        self.root.bind("s", lambda e: self.quick_save())
+        self.root.bind("x", lambda e: self.delete_current_image())
+        self.root.bind("w", lambda e: self.on_jump_to_last_cropped())
+        self.root.bind("r", lambda e: self.resize_and_save_image())
+        self.root.bind("R", lambda e: self.resize_all_images())
+        self.root.bind("t", lambda e: self.toggle_previous_crops())
+        self.root.bind("g", lambda e: self.toggle_auto_suggest())
+        self.root.bind("f", lambda e: self.zoom_to_fit())
+        self.root.bind("1", lambda e: self.set_zoom(1.0))
+        self.root.bind("<plus>", lambda e: self.zoom_by(1.25))
+        self.root.bind("<equal>", lambda e: self.zoom_by(1.25))
+        self.root.bind("<minus>", lambda e: self.zoom_by(0.8))
+        self.root.bind("m", lambda e: self.toggle_multi_crop())
+        self.root.bind("<Return>", lambda e: self.commit_staged_crops())
+        self.root.bind("<Escape>", lambda e: self.clear_staged_crops())
+        self.root.bind("u", lambda e: self.show_duplicates())
+        self.root.bind("c", lambda e: self.show_coverage())
+        self.root.bind("k", lambda e: self.toggle_skip_duplicates())
+        self.root.bind("v", lambda e: self.toggle_filmstrip())
+        self.root.bind("p", lambda e: self.toggle_preset_preview())
+        self.root.bind("i", lambda e: self.toggle_stats_overlay())
+        self.root.bind("I", lambda e: self.export_trace())
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        # Open the crop store, folders are loaded lazily when opened
+        self.load_cropped_info()
+        # Warm the numpy import for duplicate clustering while the user picks a folder; an import
+        # error stays in the future, clustering reports it when it runs
+        self.io_pool.submit(importlib.import_module, "numpy")
+
+    def on_close(self):
+        if self.resize_batch and not self.resize_batch.finished:
+            self.resize_batch.cancel()
+        self.process_completed_saves(self.save_queue.shutdown())
+        self.prefetcher.shutdown()
+        for analyzer in self.analyzers:
+            analyzer.cancel()
+        self.analysis_pool.shutdown(wait=False, cancel_futures=True)
+        self.io_pool.shutdown(wait=False, cancel_futures=True)
+        self.thumbnail_pool.shutdown(wait=False, cancel_futures=True)
+        self._scan_token = None  # Drops a running rescan
+        self.analysis_cache.close()
+        self.store.close()
+        if self.trace_file:
+            print(f"Wrote {instrumentation.export(self.trace_file)} trace events to {self.trace_file}")
+        if self.recorder:
+            self.recorder.close()
+            print(f"Recorded {self.recorder.actions} actions to {self.recorder.path}")
+        self.root.destroy()
+
+    # Instrumentation
+    def toggle_stats_overlay(self):
+        self.stats_visible = not self.stats_visible
+        if self.stats_visible:
+            instrumentation.enabled = True
+            self.stats_label.place(relx=1.0, x=-25, y=10, anchor="ne")
+            self.update_stats_overlay()
+        else:
+            self.stats_label.place_forget()
+
+    def update_stats_overlay(self):
+        if not self.stats_visible:
+            return
+        self.stats_label.configure(text=instrumentation.overlay_text())
+        self.root.after(500, self.update_stats_overlay)
+
+    def export_trace(self):
+        if not instrumentation.enabled:
+            messagebox.showinfo("Info", "Nothing recorded yet, press I to start timing.")
+            return
+        path = self.trace_file or os.path.abspath(time.strftime("power-cropper-trace-%Y%m%d-%H%M%S.json"))
+        count = instrumentation.export(path)
+        messagebox.showinfo("Info", f"Wrote {count} trace events to {path}")
+
+    # Mousewheel support
+    def _on_mousewheel(self, event):
+        # Windows, macOS
+        self.scroll_canvas("y", int(-1*(event.delta/120)))
+
+    def _on_mousewheel_linux_up(self, event):
+        # Linux scroll up
+        self.scroll_canvas("y", -1)
+
+    def _on_mousewheel_linux_down(self, event):
+        # Linux scroll down
+        self.scroll_canvas("y", 1)
+
+    def scroll_canvas(self, axis, units):
+        # Steps of a wheel burst are added up and scrolled at once
+        scroll = self.canvas.yview_scroll if axis == "y" else self.canvas.xview_scroll
+        self.coalescer.post(f"scroll_{axis}", lambda n: scroll(n, "units"), units, merge=lambda a, b: a + b)
+
+    def wheel_zoom(self, factor, event):
+        # Factors of a wheel burst are multiplied, the zoom centers on the latest pointer position
+        self.coalescer.post("zoom", lambda value: self.zoom_by(*value), (factor, event),
+                            merge=lambda a, b: (a[0] * b[0], b[1]))
+
+    def _bind_mousewheel(self):
+        self.canvas.bind_all("<MouseWheel>", self._on_mousewheel)
+        self.canvas.bind_all("<Shift-MouseWheel>", lambda e: self.scroll_canvas("x", int(-1*(e.delta/120))))
+        self.canvas.bind_all("<Button-4>", self._on_mousewheel_linux_up)
+        self.canvas.bind_all("<Button-5>", self._on_mousewheel_linux_down)
+        # Horizontal scroll (Linux)
+        self.canvas.bind_all("<Shift-Button-4>", lambda e: self.scroll_canvas("x", -1))
+        self.canvas.bind_all("<Shift-Button-5>", lambda e: self.scroll_canvas("x", 1))
+        # Zoom around the mouse pointer
+        self.canvas.bind_all("<Control-MouseWheel>", lambda e: self.wheel_zoom(1.25 if e.delta > 0 else 0.8, e))
+        self.canvas.bind_all("<Control-Button-4>", lambda e: self.wheel_zoom(1.25, e))
+        self.canvas.bind_all("<Control-Button-5>", lambda e: self.wheel_zoom(0.8, e))
+
+    def _unbind_mousewheel(self):
+        self.canvas.unbind_all("<MouseWheel>")
+        self.canvas.unbind_all("<Button-4>")
+        self.canvas.unbind_all("<Button-5>")
+        self.canvas.unbind_all("<Shift-Button-4>")
+        self.canvas.unbind_all("<Shift-Button-5>")
+        self.canvas.unbind_all("<Control-MouseWheel>")
+        self.canvas.unbind_all("<Control-Button-4>")
+        self.canvas.unbind_all("<Control-Button-5>")
+
+    # Viewport / zoom
+    def _on_xscroll(self, first, last):
+        self.h_scroll.set(first, last)
+        self.schedule_tile_update()
+
+    def _on_yscroll(self, first, last):
+        self.v_scroll.set(first, last)
+        self.schedule_tile_update()
+
+    def schedule_tile_update(self):
+        if self._tile_update_id is None:
+            self._tile_update_id = self.root.after_idle(self._update_tiles)
+
+    def _update_tiles(self):
+        self._tile_update_id = None
+        with instrumentation.span("draw"):
+            self.viewport.update()
+
+    @recorded_action(event="size")
+    def on_canvas_configure(self, event):
+        self._canvas_size = (max(1, event.width), max(1, event.height))
+        if self.fit_mode and self.current_image:
+            self.set_zoom(self.fit_zoom(), keep_fit=True)
+        self.schedule_tile_update()
+
+    def preview_scale_for(self, size):
+        """Display scale to decode an image of the given full size at, called from prefetch threads."""
+        if not self.preview_decode:
+            return 1.0
+        if self.fit_mode:
+            cw, ch = self._canvas_size
+            return max(self.min_zoom, min(1.0, cw / size[0], ch / size[1]))
+        return min(1.0, self.zoom)
+
+    def ensure_resolution(self):
+        decoded = self.current_image
+        if decoded is None or decoded.has_full() or decoded.scale >= self.zoom:
+            return
+        future = self.prefetcher.load_full(decoded)
+        self.root.after(20, self.poll_full_resolution, decoded, future)
+
+    def poll_full_resolution(self, decoded, future):
+        if not future.done():
+            self.root.after(20, self.poll_full_resolution, decoded, future)
+            return
+        if future.exception() is not None:
+            print(f"Error decoding {decoded.path}: {future.exception()}")
+            return
+        if decoded is self.current_image:
+            self.viewport.set_image(decoded.display_image(), decoded.size)
+            self.schedule_tile_update()
+
+    def fit_zoom(self):
+        w, h = self.current_image.size
+        cw, ch = max(1, self.canvas.winfo_width()), max(1, self.canvas.winfo_height())
+        return max(self.min_zoom, min(1.0, cw / w, ch / h))
+
+    @recorded_action()
+    def zoom_to_fit(self):
+        if self.current_image:
+            self.set_zoom(self.fit_zoom(), keep_fit=True)
+
+    @recorded_action()
+    def zoom_by(self, factor, event=None):
+        self.set_zoom(self.zoom * factor, event=event)
+
+    @recorded_action()
+    def set_zoom(self, zoom, event=None, keep_fit=False):
+        self.fit_mode = keep_fit
+        if not self.current_image:
+            return
+        zoom = max(self.min_zoom, min(self.max_zoom, zoom))
+        if zoom == self.zoom:
+            return
+        # Keep the image point under the pointer (or the view center) in place
+        px = event.x if event is not None else self.canvas.winfo_width() / 2
+        py = event.y if event is not None else self.canvas.winfo_height() / 2
+        ix, iy = self.canvas_to_image(self.canvas.canvasx(px), self.canvas.canvasy(py))
+        self.zoom = zoom
+        self.viewport.set_zoom(zoom)
+        dw, dh = self.viewport.display_size()
+        self.canvas.configure(scrollregion=(0, 0, dw, dh))
+        self.canvas.xview_moveto((ix * zoom - px) / dw)
+        self.canvas.yview_moveto((iy * zoom - py) / dh)
+        self.redraw_rectangles()
+        self.update_dim_label()
+        self.ensure_resolution()
+        self.schedule_tile_update()
+
+    def canvas_to_image(self, x, y):
+        return x / self.zoom, y / self.zoom
+
+    def image_to_canvas(self, coords):
+        return [c * self.zoom for c in coords]
+
+    def redraw_rectangles(self):
+        self.draw_previous_crops()
+        self.draw_staged_crops()
+        if self.rect and self.rect_coords:
+            self.canvas.coords(self.rect, *self.image_to_canvas(self.rect_coords))
+
+    @recorded_action()
+    def on_size_selected(self):
+        self.update_size()
+
+    def update_size(self):
+        val = self.size_var.get()
+        if val == "custom":
+            self.custom_mode = True
+            self.clear_existing_rect()
+        else:
+            self.custom_mode = False
+            self.crop_size = tuple(map(int, val.split("x")))
+            self.clear_existing_rect()
+            self.apply_suggestion()
+
+    def load_folder(self):
+        folder = filedialog.askdirectory()
+        if not folder:
+            return
+
+        if self.resize_batch and not self.resize_batch.finished:
+            messagebox.showinfo("Info", "Please wait for 'Resize All' to finish or cancel it first.")
+            return
+
+        # Finish writing the crops of the previous folder first
+        self.flush_saves()
+        self.open_folder(folder)
+
+    @recorded_action()
+    def open_folder(self, folder):
+        # The folder is listed on a worker thread, the first image is shown as soon as it is found
+        self._scan_token = token = object()
+        self._scan_started = time.perf_counter()
+        folder = os.path.abspath(folder)
+        dir_index = self.analysis_cache.load_directories(folder)
+        results = queue.Queue()
+        threading.Thread(target=scan_folder, args=(folder, results, dir_index, self.recursive.get()), daemon=True).start()
+        self.root.after(10, self.poll_folder_scan, folder, results, token, False, dir_index)
+
+    def poll_folder_scan(self, folder, results, token, entered, dir_index):
+        if token is not self._scan_token:
+            return
+        while True:
+            try:
+                kind, value = results.get_nowait()
+            except queue.Empty:
+                self.root.after(10, self.poll_folder_scan, folder, results, token, entered, dir_index)
+                return
+            if kind == "error":
+                messagebox.showerror("Error", f"Cannot open folder: {value}")
+                return
+            if kind == "first":
+                self.enter_folder(folder, [value])
+                entered = True
+            elif kind == "done":
+                images, self.dir_index = value
+                self.analysis_cache.store_directories(folder, dir_index, self.dir_index)
+                if images:
+                    if not entered:
+                        self.enter_folder(folder, images[:1])
+                    self.finish_folder_scan(images)
+                return
+
+    @timed_action("open")
+    def enter_folder(self, folder, images):
+        self.prefetcher.clear()
+        for analyzer in self.analyzers:
+            analyzer.cancel()
+        self.folder_images = list(images)
+        self.images = list(images)
+        self.current_index = 0
+        self.recursive_scan = self.recursive.get()
+        self.save_folder = os.path.join(folder, "cropped")
+        self.originals_folder = os.path.join(folder, "originals")
+
+        os.makedirs(self.save_folder, exist_ok=True)
+        self.current_folder = folder
+        self.load_folder_cropped_info(folder, reload=True)
+        if self.recorder:
+            self.recorder.history(folder, self.cropped_info["data"].get(folder, {}), self.last_cropped_entry.get(folder))
+        self.image_index = self.analysis_cache.load_index(folder)
+        self.dhashes = self.analysis_cache.load_dhashes(folder)
+        self.quality = self.analysis_cache.load_quality(folder)
+        self.quality_scores = {}
+        self.duplicates = {}
+        self._cluster_future = None
+
+        self.suggestions = {}
+        self.load_current_image()
+        self.next_button.configure(state=ctk.NORMAL)
+        self.prev_button.configure(state=ctk.NORMAL)
+        self.resize_all_button.configure(state=ctk.NORMAL)
+
+        # Make the right panel visible
+        self.right_frame.pack(side=ctk.RIGHT, fill=ctk.Y)
+
+    def finish_folder_scan(self, images):
+        current = self.images[self.current_index]
+        self.folder_images = images
+        self.images = self.navigation_order(images) or list(images)
+        # The image shown while listing is just the first one found, the folder opens at the start of the view
+        self.current_index = 0
+        if self.images[0] != current:
+            self.load_current_image()
+        self.update_dim_label()
+        self.update_dimension_counts()
+        self.jump_to_last_cropped()
+        self.start_analysis()
+        instrumentation.record("scan", "phase", self._scan_started, time.perf_counter(), {"images": len(images)})
+        self.schedule_rescan()
+
+    # Images added to the folder while it is open
+    def schedule_rescan(self):
+        if self._rescan_id is None:
+            self._rescan_id = self.root.after(self.rescan_interval, self.rescan_folder)
+
+    def rescan_folder(self):
+        self._rescan_id = None
+        if not self.current_folder or self._scan_token is None:
+            return
+        future = self.io_pool.submit(find_new_images, self.current_folder, self.dir_index, self.recursive_scan)
+        self.root.after(50, self.poll_rescan, future, self._scan_token)
+
+    def poll_rescan(self, future, token):
+        if token is not self._scan_token:
+            return  # Another folder was opened meanwhile
+        if not future.done():
+            self.root.after(50, self.poll_rescan, future, token)
+            return
+        try:
+            new_images, dir_index = future.result()
+        except OSError as e:
+            print(f"Error rescanning {self.current_folder}: {e}")
+        else:
+            self.analysis_cache.store_directories(self.current_folder, self.dir_index, dir_index)
+            self.dir_index = dir_index
+            known = set(self.folder_images)
+            new_images = [path for path in new_images if path not in known]
+            if new_images:
+                self.insert_images(new_images)
+        self.schedule_rescan()
+
+    def insert_images(self, paths):
+        """Adds images to the open folder in sorted position, the current image stays on screen."""
+        current = self.images[self.current_index] if self.images else None
+        for path in paths:
+            bisect.insort(self.folder_images, path)
+        if self.order_var.get() == "Name" and self.filter_var.get() == "All images" and not self.skip_duplicates.get():
+            for path in paths:
+                bisect.insort(self.images, path)
+        else:
+            # Analysis results since the last rebuild may filter out the image on screen, it stays
+            # until the user moves on
+            self.images = self.navigation_order(self.folder_images, keep=current)
+        if current is None:
+            self.current_index = 0
+            self.load_current_image()
+        else:
+            self.current_index = self.images.index(current)
+        for analyzer in self.analyzers:
+            for path in paths:
+                analyzer.requeue(path)
+            if current is not None:
+                analyzer.focus(current)
+        self.schedule_analysis_poll()
+        self.prefetcher.schedule(self.images, self.current_index)
+        self.update_dim_label()
+        self.update_dimension_counts()
+
+    # Navigation order
+    def image_dimensions(self, path):
+        row = self.image_index.get(path)
+        return (row["width"], row["height"]) if row else None
+
+    def navigation_order(self, paths, keep=None):
+        """The view of paths under the current filter and order; keep is never filtered out."""
+        view = list(paths)
+        image_filter = self.filter_var.get()
+        if image_filter.startswith("Score"):
+            # Images that are not scored yet are kept
+            threshold = float(image_filter.split()[-1])
+            view = [p for p in view if p == keep or self.image_score(p) is None or self.image_score(p) >= threshold]
+        elif image_filter != "All images":
+            fw, fh = map(int, image_filter.split()[-1].split("x"))
+            # Images that are not indexed yet are kept
+            view = [p for p in view if p == keep or not self.image_dimensions(p)
+                    or (self.image_dimensions(p)[0] >= fw and self.image_dimensions(p)[1] >= fh)]
+        if self.skip_duplicates.get():
+            # Only the best image of each group of near-duplicates
+            view = [p for p in view if p == keep or p not in self.duplicates
+                    or p == self.best_duplicate(self.duplicates[p])]
+        order = self.order_var.get()
+        if order == "Best quality first":
+            known = [p for p in view if self.image_score(p) is not None]
+            unknown = [p for p in view if self.image_score(p) is None]
+            known.sort(key=self.image_score, reverse=True)
+            view = known + unknown
+        elif order != "Name":
+            def pixels(p):
+                dims = self.image_dimensions(p)
+                return dims[0] * dims[1] if dims else None
+            known = [p for p in view if pixels(p) is not None]
+            unknown = [p for p in view if pixels(p) is None]
+            known.sort(key=pixels, reverse=(order == "Largest first"))
+            view = known + unknown
+        return view
+
+    def image_score(self, path):
+        score = self.quality_scores.get(path)
+        if score is None and path in self.quality:
+            score = self.quality_scores[path] = quality_score(self.quality[path], self.dimension_labels)
+        return score
+
+    @recorded_action()
+    def on_navigation_order_changed(self):
+        self.apply_navigation_order()
+
+    def apply_navigation_order(self):
+        if not self.folder_images:
+            return
+        current = self.images[self.current_index] if self.images else None
+        view = self.navigation_order(self.folder_images)
+        if not view:
+            messagebox.showinfo("Info", f"No image matches '{self.filter_var.get()}'.")
+            self.filter_var.set("All images")
+            view = self.navigation_order(self.folder_images)
+        self.images = view
+        if current in self.images:
+            self.current_index = self.images.index(current)
+            self.update_dim_label()
+            self.prefetcher.schedule(self.images, self.current_index)
+        else:
+            self.current_index = 0
+            self.load_current_image()
+
+    def load_current_image(self):
+        if not self.images:
+            self.canvas.delete("all")
+            self.root.title("Power Cropper")
+            self.current_image = None
+            self.clear_existing_rect()
+            self.dim_label.configure(text="")
+            self.cropped_label.configure(text="")
+            self.right_frame.pack_forget()
+            return
+
+        self.current_image = self.prefetcher.get(self.images[self.current_index])
+        self.prefetcher.schedule(self.images, self.current_index)
+        for analyzer in self.analyzers:
+            analyzer.focus(self.images[self.current_index])
+        self.show_current_image()
+        w, h = self.current_image.size
+        self.clear_existing_rect()
+        self.update_radio_button_highlights(w, h)
+        self.set_largest_radio_button(w, h)
+        self.draw_previous_crops()
+        self.draw_staged_crops()
+        self.update_cropped_label()
+        self.update_staged_label()
+        self.save_button.configure(state=ctk.DISABLED)
+        self.delete_button.configure(state=ctk.NORMAL)
+        
+        if self.can_resize() is True:
+            self.resize_button.configure(state=ctk.NORMAL)
+        else:
+            self.resize_button.configure(state=ctk.DISABLED)
+
+    def show_current_image(self):
+        self.canvas.delete("all")
+        self.rect = None
+        self.custom_dim_text = None
+        self.viewport.set_image(self.current_image.display_image(), self.current_image.size)
+        if self.fit_mode:
+            self.zoom = self.fit_zoom()
+        self.viewport.set_zoom(self.zoom)
+        self.ensure_resolution()
+        # Set scroll region to the displayed image size
+        dw, dh = self.viewport.display_size()
+        self.canvas.configure(scrollregion=(0, 0, dw, dh))
+        self.canvas.xview_moveto(0)
+        self.canvas.yview_moveto(0)
+        with instrumentation.span("draw"):
+            self.viewport.update()
+        self.update_dim_label()
+        self.root.title(f"{os.path.basename(self.images[self.current_index])}")
+
+    def update_dim_label(self):
+        if not self.current_image:
+            return
+        w, h = self.current_image.size
+        index_text = f"({self.current_index + 1}/{len(self.images)})"
+        score = self.image_score(self.images[self.current_index])
+        score_text = f"  Score: {score:.0f}" if score is not None else ""
+        self.dim_label.configure(text=f"Image size: {w} x {h} px  {index_text}  Zoom: {self.zoom:.0%}{score_text}")
+        if self.filmstrip_visible:
+            self.filmstrip.show(self.images, self.current_index)
+
+    # Filmstrip
+    def load_thumbnail(self, path):
+        return self.thumbnail_pool.submit(self.thumbnail_cache.get, path)
+
+    def thumbnail_status(self, path):
+        cropped = self.cropped_info["data"].get(self.current_folder, {}).get(path)
+        return "lime green" if cropped else "gray40"
+
+    @recorded_action()
+    def select_image(self, index):
+        if index != self.current_index:
+            self.current_index = index
+            self.load_current_image()
+
+    def _on_filmstrip_scroll(self, *args):
+        self.filmstrip.canvas.xview(*args)
+        self.filmstrip.update()
+
+    @recorded_action()
+    def toggle_filmstrip(self):
+        self.filmstrip_visible = not self.filmstrip_visible
+        if not self.filmstrip_visible:
+            self.filmstrip_frame.pack_forget()
+            self.filmstrip.clear()
+            self.filmstrip.paths = []
+        else:
+            self.filmstrip_frame.pack(fill=ctk.X)
+            self.root.update_idletasks()
+            if self.images:
+                self.filmstrip.show(self.images, self.current_index)
+
+    def clear_existing_rect(self):
+        if self.rect:
+            self.canvas.delete(self.rect)
+        self.rect = None
+        self.rect_coords = None
+        if self.custom_dim_text:
+            self.canvas.delete(self.custom_dim_text)
+            self.custom_dim_text = None
+        self.save_button.configure(state=ctk.DISABLED)
+
+    @recorded_action()
+    def on_mouse_down(self, event):
+        x, y = self.canvas_to_image(self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+        self.hide_preset_preview()
+        if self.custom_mode:
+            self.clear_existing_rect()
+            self.custom_start = (x, y)
+            self.rect = self.canvas.create_rectangle(*self.image_to_canvas((x, y, x, y)), outline='red', width=2)
+        else:
+            self.place_rectangle(event)
+
+    def on_mouse_drag(self, event):
+        if (self.custom_mode and self.custom_start) or (not self.custom_mode and self.rect):
+            self.coalescer.post("drag", self.on_drag_frame, event)
+
+    @recorded_action()
+    def on_drag_frame(self, event):
+        if self.custom_mode and self.custom_start:
+            self.drag_custom_rect(event)
+        elif not self.custom_mode and self.rect:
+            # The placed preset rectangle follows the cursor while the button is held
+            self.move_rect(event)
+
+    def drag_custom_rect(self, event):
+        cx = self.canvas.canvasx(event.x)
+        cy = self.canvas.canvasy(event.y)
+        x, y = self.canvas_to_image(cx, cy)
+        if self.custom_mode and self.custom_start:
+            x0, y0 = self.custom_start
+            x1, y1 = x, y
+            self.canvas.coords(self.rect, *self.image_to_canvas((x0, y0, x1, y1)))
+            # Calculate dimensions in image pixels
+            width = abs(int(x1) - int(x0))
+            height = abs(int(y1) - int(y0))
+            dim_text = f"{width} x {height}"
+            # Show or move the dimension text near the mouse
+            if self.custom_dim_text:
+                self.canvas.coords(self.custom_dim_text, cx + 15, cy + 15)
+                self.canvas.itemconfig(self.custom_dim_text, text=dim_text, fill="yellow")
+            else:
+                self.custom_dim_text = self.canvas.create_text(
+                    cx + 15, cy + 15, text=dim_text,
+                    fill="yellow", font=("Arial", 12, "bold"), anchor="nw"
+                )
+
+    @recorded_action()
+    def on_mouse_up(self, event):
+        # The release position is final, a motion still waiting for its frame is outdated
+        self.coalescer.discard("drag")
+        if not self.custom_mode and self.rect:
+            self.move_rect(event)
+        x, y = self.canvas_to_image(self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+        if self.custom_mode and self.rect and self.custom_start:
+            x0, y0 = self.custom_start
+            x1, y1 = x, y
+            # Ensure coordinates are within image bounds
+            x0, x1 = max(0, min(x0, self.current_image.width)), max(0, min(x1, self.current_image.width))
+            y0, y1 = max(0, min(y0, self.current_image.height)), max(0, min(y1, self.current_image.height))
+            left, right = sorted([int(x0), int(x1)])
+            top, bottom = sorted([int(y0), int(y1)])
+            self.rect_coords = (left, top, right, bottom)
+            self.save_custom_crop()
+            self.custom_start = None
+            # Remove the dimension text
+            if self.custom_dim_text:
+                self.canvas.delete(self.custom_dim_text)
+                self.custom_dim_text = None
+
+    def preset_box(self, event):
+        """The preset crop centered on the pointer, moved inside the image."""
+        x, y = self.canvas_to_image(self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+        return preset_box_at(x, y, self.crop_size, self.current_image.size)
+
+    @timed_action("place")
+    def place_rectangle(self, event):
+        if not self.current_image:
+            return
+        self.draw_crop_rect(self.preset_box(event))
+
+    def move_rect(self, event):
+        if not self.rect or not self.current_image or self.custom_mode:
+            return
+        self.rect_coords = self.preset_box(event)
+        self.canvas.coords(self.rect, *self.image_to_canvas(self.rect_coords))
+
+    # Preset preview
+    def on_mouse_move(self, event):
+        if self.show_preset_preview or self.show_previous_crops.get():
+            self.coalescer.post("hover", self.on_hover_frame, event)
+
+    @recorded_action()
+    def on_hover_frame(self, event):
+        if self.show_preset_preview:
+            self.draw_preset_preview(event)
+        if self.show_previous_crops.get():
+            self.highlight_crops_at(event)
+
+    def draw_preset_preview(self, event):
+        if self.custom_mode or not self.current_image:
+            self.canvas.delete("preset_preview")
+            return
+        coords = self.image_to_canvas(self.preset_box(event))
+        items = self.canvas.find_withtag("preset_preview")
+        if items:
+            self.canvas.coords(items[0], *coords)
+            self.canvas.tag_raise("preset_preview")
+        else:
+            self.canvas.create_rectangle(*coords, outline="white", width=1, dash=(4, 4), tags="preset_preview")
+
+    def hide_preset_preview(self):
+        self.coalescer.discard("hover")
+        self.canvas.delete("preset_preview")
+
+    @recorded_action()
+    def toggle_preset_preview(self):
+        self.show_preset_preview = not self.show_preset_preview
+        if not self.show_preset_preview:
+            self.hide_preset_preview()
+
+    @recorded_action()
+    def on_canvas_leave(self, event):
+        self._unbind_mousewheel()
+        self.hide_preset_preview()
+        self.coalescer.discard("hover")
+        self.canvas.delete("hover_crop")
+        self._hovered_crops = None
+
+    # Stored crops under the pointer are outlined with their size
+    def highlight_crops_at(self, event):
+        if not self.current_image or not self.show_previous_crops.get():
+            return
+        x, y = self.canvas_to_image(self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+        hits = self.crop_index(self.images[self.current_index]).at(x, y)
+        if hits == self._hovered_crops:
+            return
+        self._hovered_crops = hits
+        self.canvas.delete("hover_crop")
+        for size, box in hits:
+            x0, y0, x1, y1 = self.image_to_canvas(box)
+            self.canvas.create_rectangle(x0, y0, x1, y1, outline="cyan", width=2, tags="hover_crop")
+            self.canvas.create_text(x0 + 5, y1 - 5, anchor="sw", fill="cyan", text=size,
+                                    font=("Arial", 12, "bold"), tags="hover_crop")
+
+    def draw_crop_rect(self, coords):
+        self.clear_existing_rect()
+        self.rect = self.canvas.create_rectangle(
+            *self.image_to_canvas(coords),
+            outline='red', width=2)
+        self.rect_coords = tuple(coords)
+        self.save_button.configure(state=ctk.NORMAL)
+
+    # Crop suggestions
+    def lookup_suggestions(self, path):
+        digest = self.analysis_cache.lookup_hash(path)
+        return self.analysis_cache.load_suggestions(digest) if digest else None
+
+    def start_analysis(self):
+        # The whole folder, not only the images passing the current filter
+        current = self.images[self.current_index] if self.images else None
+        index = self.folder_images.index(current) if current in self.folder_images else 0
+        for analyzer in self.analyzers:
+            analyzer.start(self.folder_images, index)
+        self.schedule_analysis_poll()
+
+    def schedule_analysis_poll(self):
+        if self._analysis_poll_id is None:
+            self._analysis_poll_id = self.root.after(100, self.poll_analysis)
+
+    def poll_analysis(self):
+        self._analysis_poll_id = None
+        self.handle_suggestion_results(self.suggestion_analyzer.poll())
+        index_was_active = self.index_analyzer.active()
+        self.handle_index_results(self.index_analyzer.poll())
+        if index_was_active and not self.index_analyzer.active():
+            # The whole folder is indexed now, sort/filter with complete data
+            if self.order_var.get() != "Name" or self.filter_var.get() != "All images":
+                self.apply_navigation_order()
+        hashing_was_active = self.dhash_analyzer.active()
+        self.handle_dhash_results(self.dhash_analyzer.poll())
+        if hashing_was_active and not self.dhash_analyzer.active():
+            self.start_duplicate_clustering()
+        scoring_was_active = self.quality_analyzer.active()
+        self.handle_quality_results(self.quality_analyzer.poll())
+        if scoring_was_active and not self.quality_analyzer.active():
+            if self.order_var.get() == "Best quality first" or self.filter_var.get().startswith("Score"):
+                self.apply_navigation_order()
+        if any(analyzer.active() for analyzer in self.analyzers):
+            self.schedule_analysis_poll()
+
+    def lookup_index(self, path):
+        row = self.image_index.get(path)
+        if row is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if st.st_size == row["size"] and st.st_mtime == row["mtime"]:
+            return row
+        return None
+
+    def lookup_dhash(self, path):
+        row = self.dhashes.get(path)
+        if row is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if st.st_size == row["size"] and st.st_mtime == row["mtime"]:
+            return row
+        return None
+
+    def handle_dhash_results(self, done):
+        rows = []
+        for path, row, error, cached in done:
+            if error is not None:
+                print(f"Error hashing {path}: {error}")
+                continue
+            self.dhashes[path] = row
+            if not cached:
+                rows.append(row)
+        if rows:
+            self.analysis_cache.store_dhashes(self.current_folder, rows)
+
+    def lookup_quality(self, path):
+        row = self.quality.get(path)
+        if row is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if st.st_size == row["size"] and st.st_mtime == row["mtime"]:
+            return row
+        return None
+
+    def handle_quality_results(self, done):
+        rows = []
+        for path, row, error, cached in done:
+            if error is not None:
+                print(f"Error scoring {path}: {error}")
+                continue
+            self.quality[path] = row
+            self.quality_scores.pop(path, None)
+            if not cached:
+                rows.append(row)
+        if rows:
+            self.analysis_cache.store_quality(self.current_folder, rows)
+        if done and self.current_image and any(path == self.images[self.current_index] for path, *_ in done):
+            self.update_dim_label()
+
+    # Near-duplicates
+    def start_duplicate_clustering(self):
+        folder_images = set(self.folder_images)
+        paths = [path for path in self.dhashes if path in folder_images]
+        hashes = [self.dhashes[path]["dhash"] for path in paths]
+        future = self.io_pool.submit(cluster_hashes, hashes, self.duplicate_threshold)
+        self._cluster_future = future
+        self.root.after(50, self.poll_duplicate_clustering, future, paths)
+
+    def poll_duplicate_clustering(self, future, paths):
+        if future is not self._cluster_future:
+            return
+        if not future.done():
+            self.root.after(50, self.poll_duplicate_clustering, future, paths)
+            return
+        self._cluster_future = None
+        try:
+            clusters = future.result()
+        except Exception as e:
+            print(f"Error finding duplicates: {e}")
+            return
+        self.duplicates = {}
+        for members in clusters:
+            cluster = sorted(paths[i] for i in members)
+            for path in cluster:
+                self.duplicates[path] = cluster
+        self.update_cropped_label()
+        if self.skip_duplicates.get():
+            self.apply_navigation_order()
+
+    def best_duplicate(self, cluster):
+        """The member to keep: highest resolution, then already cropped, then largest file."""
+        cropped = self.cropped_info["data"].get(self.current_folder, {})
+
+        def rank(path):
+            dims = self.image_dimensions(path)
+            row = self.dhashes.get(path, {})
+            w, h = dims if dims else (row.get("width", 0), row.get("height", 0))
+            return w * h, path in cropped, row.get("size", 0)
+        return max(cluster, key=rank)
+
+    def forget_duplicate(self, path):
+        cluster = self.duplicates.pop(path, None)
+        self.dhashes.pop(path, None)
+        if cluster is None:
+            return
+        cluster.remove(path)
+        if len(cluster) == 1:
+            self.duplicates.pop(cluster[0], None)
+
+    def redundant_duplicates(self, clusters):
+        return [path for cluster in clusters for path in cluster if path != self.best_duplicate(cluster)]
+
+    @recorded_action()
+    def toggle_skip_duplicates(self):
+        self.skip_duplicates.set(not self.skip_duplicates.get())
+        self.apply_navigation_order()
+
+    def show_duplicates(self):
+        if not self.images:
+            return
+        current = self.images[self.current_index]
+        cluster = self.duplicates.get(current)
+        if not cluster:
+            if self.dhash_analyzer.active() or self._cluster_future is not None:
+                messagebox.showinfo("Info", "Still looking for duplicates, try again in a moment.")
+            else:
+                messagebox.showinfo("Info", "No near-duplicates of this image in the folder.")
+            return
+        best = self.best_duplicate(cluster)
+        cropped = self.cropped_info["data"].get(self.current_folder, {})
+
+        dialog = ctk.CTkToplevel(self.root)
+        dialog.title(f"Duplicates of {os.path.basename(current)}")
+        dialog.transient(self.root)
+        frame = ctk.CTkScrollableFrame(dialog, width=520, height=min(600, 110 * len(cluster)))
+        frame.pack(padx=10, pady=10, fill=ctk.BOTH, expand=True)
+        thumbnails = []
+        for path in cluster:
+            row = ctk.CTkFrame(frame)
+            row.pack(fill=ctk.X, pady=3)
+            try:
+                with Image.open(path) as image:
+                    image.draft("RGB", (96, 96))
+                    image.thumbnail((96, 96))
+                    thumbnail = ctk.CTkImage(light_image=image.convert("RGB"), size=image.size)
+            except OSError:
+                thumbnail = None
+            thumbnails.append(thumbnail)
+            ctk.CTkLabel(row, text="", image=thumbnail, width=100).pack(side=ctk.LEFT, padx=5)
+            row_hash = self.dhashes.get(path, {})
+            dims = self.image_dimensions(path) or (row_hash.get("width"), row_hash.get("height"))
+            notes = [f"{dims[0]}x{dims[1]}"] if dims[0] else []
+            notes.append(f"{row_hash.get('size', 0) / 1024:.0f} KB")
+            if path in cropped:
+                notes.append("cropped")
+            if path == best:
+                notes.append("best")
+            if path == current:
+                notes.append("current")
+            ctk.CTkLabel(row, text=f"{os.path.basename(path)}\n" + ", ".join(notes), justify=ctk.LEFT).pack(side=ctk.LEFT, padx=5)
+            ctk.CTkButton(row, text="Show", width=60,
+                          command=lambda p=path: (dialog.destroy(), self.go_to_image(p))).pack(side=ctk.RIGHT, padx=5)
+
+        def delete(clusters):
+            redundant = self.redundant_duplicates(clusters)
+            with_crops = sum(1 for path in redundant if path in cropped)
+            message = f"Delete {len(redundant)} image(s), keeping the best of each group?"
+            if with_crops:
+                message += f"\n{with_crops} of them have crops, their crop records are removed too."
+            if messagebox.askyesno("Delete duplicates", message, parent=dialog):
+                dialog.destroy()
+                self.delete_images(redundant)
+
+        buttons = ctk.CTkFrame(dialog)
+        buttons.pack(padx=10, pady=10)
+        ctk.CTkButton(buttons, text="Delete all but best", command=lambda: delete([cluster])).pack(side=ctk.LEFT, padx=5)
+        groups = {id(c): c for c in self.duplicates.values()}
+        ctk.CTkButton(buttons, text=f"Delete in all {len(groups)} groups",
+                      command=lambda: delete(list(groups.values()))).pack(side=ctk.LEFT, padx=5)
+        dialog.thumbnails = thumbnails  # Keep the images alive with the dialog
+
+    @recorded_action()
+    def go_to_image(self, path):
+        if path not in self.images:
+            # Hidden by the current filter
+            self.filter_var.set("All images")
+            self.skip_duplicates.set(False)
+            self.apply_navigation_order()
+        self.current_index = self.images.index(path)
+        self.load_current_image()
+
+    def handle_index_results(self, done):
+        rows = []
+        for path, row, error, cached in done:
+            if error is not None:
+                print(f"Error indexing {path}: {error}")
+                continue
+            self.image_index[path] = row
+            if not cached:
+                rows.append(row)
+        if rows:
+            self.analysis_cache.store_index(self.current_folder, rows)
+
+    def handle_suggestion_results(self, done):
+        current_path = self.images[self.current_index] if self.images else None
+        for path, result, error, cached in done:
+            if error is not None:
+                print(f"Error analyzing {path}: {error}")
+                continue
+            if not cached:
+                self.analysis_cache.store_hash(path, result["size"], result["mtime"], result["hash"])
+                self.analysis_cache.store_suggestions(result["hash"], result["suggestions"])
+                result = result["suggestions"]
+            self.suggestions[path] = result
+            if path == current_path and not self.rect_coords:
+                self.apply_suggestion()
+
+    def apply_suggestion(self):
+        if self.custom_mode or not self.current_image or not self.auto_suggest.get():
+            return
+        suggestion = self.suggestions.get(self.images[self.current_index], {}).get(self.size_var.get())
+        if suggestion:
+            self.draw_crop_rect(suggestion)
+
+    @recorded_action()
+    def toggle_auto_suggest(self):
+        self.auto_suggest.set(not self.auto_suggest.get())
+        self.on_auto_suggest_changed()
+
+    @recorded_action()
+    def on_auto_suggest_changed(self):
+        if self.auto_suggest.get():
+            if not self.rect_coords:
+                self.apply_suggestion()
+        else:
+            self.clear_existing_rect()
+
+    @recorded_action()
+    @timed_action("save")
+    def quick_save(self):
+        if not self.rect_coords or not self.save_folder:
+            return
+        if self.multi_crop.get():
+            self.stage_crop(tuple(map(int, self.rect_coords)))
+            return
+        if self.queue_crops([tuple(map(int, self.rect_coords))]):
+            self.next_image()
+
+    @recorded_action()
+    @timed_action("save")
+    def save_custom_crop(self):
+        if not self.rect_coords or not self.save_folder:
+            return
+        x0, y0, x1, y1 = map(int, self.rect_coords)
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            return
+        if self.multi_crop.get():
+            self.stage_crop((x0, y0, x1, y1))
+            return
+        if self.queue_crops([(x0, y0, x1, y1)]):
+            self.next_image()
+
+    def queue_crops(self, boxes):
+        """Writes crops of the current image in the background, all from the same decoded image.
+
+        The crop records are updated right away; the store is updated in one transaction once
+        every file of the batch is written. Returns the number of crops queued, crops rejected for
+        overlapping an existing one are left out.
+        """
+        image_path = self.images[self.current_index]
+        boxes = self.check_overlaps(image_path, boxes)
+        if not boxes:
+            return 0
+        batch = {"remaining": len(boxes), "saved": [], "last_cropped": None}
+        # Images of subfolders are saved to the same subfolder below cropped/
+        save_folder = output_folder(self.save_folder, self.current_folder, image_path)
+        if save_folder != self.save_folder:
+            os.makedirs(save_folder, exist_ok=True)
+        for x0, y0, x1, y1 in boxes:
+            crop_size_str = f"{x1-x0}x{y1-y0}"
+            save_path = crop_save_path(save_folder, image_path, crop_size_str, self.output_encoder.extension)
+            entry = {"size": crop_size_str, "coords": (x0, y0, x1, y1), "image_path": image_path, "folder": self.current_folder}
+            is_new = self.save_cropped_info(image_path, crop_size_str, (x0, y0, x1, y1), persist=False)
+            self.last_cropped_entry[self.current_folder] = entry  # Store by folder
+            job = {"entry": entry, "save_path": save_path, "is_new": is_new, "batch": batch}
+            self.save_queue.submit(job, write_crop, self.current_image, (x0, y0, x1, y1), save_path, self.output_encoder)
+        self.update_dimension_counts()
+        self.update_pending_label()
+        if self._save_poll_id is None:
+            self._save_poll_id = self.root.after(50, self.poll_save_queue)
+        return len(boxes)
+
+    # Multi-crop: several crops of one image are staged, then saved together
+    @recorded_action()
+    def toggle_multi_crop(self):
+        self.multi_crop.set(not self.multi_crop.get())
+        self.update_staged_label()
+
+    def stage_crop(self, coords):
+        image_path = self.images[self.current_index]
+        size = f"{coords[2] - coords[0]}x{coords[3] - coords[1]}"
+        # Crops of the same size are written to the same file, the latest one wins
+        staged = [box for box in self.staged_crops.get(image_path, []) if f"{box[2] - box[0]}x{box[3] - box[1]}" != size]
+        staged.append(coords)
+        self.staged_crops[image_path] = staged
+        self.clear_existing_rect()
+        self.draw_staged_crops()
+        self.update_staged_label()
+
+    @recorded_action()
+    def clear_staged_crops(self):
+        if self.images and self.staged_crops.pop(self.images[self.current_index], None):
+            self.draw_staged_crops()
+            self.update_staged_label()
+
+    @recorded_action()
+    @timed_action("save")
+    def commit_staged_crops(self):
+        if not self.images or not self.save_folder:
+            return
+        image_path = self.images[self.current_index]
+        boxes = list(self.staged_crops.get(image_path, []))
+        if self.rect_coords:
+            # The rectangle on screen is included, as if it was staged last
+            x0, y0, x1, y1 = map(int, self.rect_coords)
+            if x1 - x0 >= 2 and y1 - y0 >= 2:
+                size = f"{x1 - x0}x{y1 - y0}"
+                boxes = [box for box in boxes if f"{box[2] - box[0]}x{box[3] - box[1]}" != size] + [(x0, y0, x1, y1)]
+        if not boxes:
+            return
+        self.staged_crops.pop(image_path, None)
+        if self.queue_crops(boxes):
+            self.next_image()
+        else:
+            self.draw_staged_crops()
+            self.update_staged_label()
+
+    def draw_staged_crops(self):
+        self.canvas.delete("staged_crop")
+        if not self.images:
+            return
+        for box in self.staged_crops.get(self.images[self.current_index], []):
+            x0, y0, x1, y1 = self.image_to_canvas(box)
+            self.canvas.create_rectangle(x0, y0, x1, y1, outline="orange", width=2, dash=(6, 3), tags="staged_crop")
+            self.canvas.create_text(x0 + 5, y0 + 5, anchor="nw", fill="orange", text=f"{box[2] - box[0]}x{box[3] - box[1]}",
+                                    font=("Arial", 12, "bold"), tags="staged_crop")
+
+    def update_staged_label(self):
+        if not self.images:
+            return
+        staged = len(self.staged_crops.get(self.images[self.current_index], []))
+        if staged:
+            self.staged_label.configure(text=f"Staged crops: {staged} (Enter saves all, Esc clears)")
+        elif self.multi_crop.get():
+            self.staged_label.configure(text="Multi-crop: S stages a crop, Enter saves all")
+        else:
+            self.staged_label.configure(text="")
+
+    def poll_save_queue(self):
+        self._save_poll_id = None
+        self.process_completed_saves(self.save_queue.completed())
+        if self.save_queue.pending():
+            self._save_poll_id = self.root.after(50, self.poll_save_queue)
+
+    def flush_saves(self):
+        self.process_completed_saves(self.save_queue.flush())
+
+    def process_completed_saves(self, done):
+        errors = []
+        finished = []
+        for job, error in done:
+            batch = job["batch"]
+            batch["remaining"] -= 1
+            entry = job["entry"]
+            if error is None:
+                batch["last_cropped"] = entry
+                if job["is_new"]:
+                    batch["saved"].append(entry)
+            else:
+                errors.append(f"{os.path.basename(job['save_path'])}: {error}")
+                if job["is_new"]:
+                    self.discard_cropped_info(entry["folder"], entry["image_path"], entry["size"], entry["coords"])
+            if batch["remaining"] == 0:
+                finished.append(batch)
+        if finished:
+            crops = [(entry["folder"], entry["image_path"], entry["size"], entry["coords"])
+                     for batch in finished for entry in batch["saved"]]
+            # Only a batch that wrote a file moves the stored last crop
+            written = [batch["last_cropped"] for batch in finished if batch["last_cropped"]]
+            last_cropped = (written[-1]["folder"], written[-1]) if written else None
+            with instrumentation.span("persist"):
+                self.store.add_crops(crops, last_cropped)
+        if errors:
+            self.update_dimension_counts()
+            self.update_cropped_label()
+            for error in errors:
+                print(f"Error saving crop {error}")
+            messagebox.showerror("Error", "Could not save crops:\n" + "\n".join(errors))
+        self.update_pending_label()
+
+    def output_settings(self):
+        encoder = self.output_encoder
+        dialog = ctk.CTkToplevel(self.root)
+        dialog.title("Output settings")
+        dialog.transient(self.root)
+        dialog.grab_set()
+
+        form = ctk.CTkFrame(dialog)
+        form.pack(padx=10, pady=10, fill=ctk.X)
+        ctk.CTkLabel(form, text="Format:").grid(row=0, column=0, padx=5, pady=2, sticky="w")
+        format_var = ctk.StringVar(value=encoder.format)
+        ctk.CTkOptionMenu(form, variable=format_var, values=list(OUTPUT_FORMATS)).grid(row=0, column=1, padx=5, pady=2, sticky="w")
+        ctk.CTkLabel(form, text="PNG level (0-9):").grid(row=1, column=0, padx=5, pady=2, sticky="w")
+        level_entry = ctk.CTkEntry(form, width=60)
+        level_entry.insert(0, str(encoder.compress_level))
+        level_entry.grid(row=1, column=1, padx=5, pady=2, sticky="w")
+        ctk.CTkLabel(form, text="Quality (JPEG/WEBP):").grid(row=2, column=0, padx=5, pady=2, sticky="w")
+        quality_entry = ctk.CTkEntry(form, width=60)
+        quality_entry.insert(0, str(encoder.quality))
+        quality_entry.grid(row=2, column=1, padx=5, pady=2, sticky="w")
+        optimize_var = ctk.BooleanVar(value=encoder.optimize)
+        ctk.CTkCheckBox(form, text="Optimize (slower, smaller)", variable=optimize_var).grid(row=3, column=0, columnspan=2, padx=5, pady=2, sticky="w")
+        icc_var = ctk.BooleanVar(value=encoder.keep_icc)
+        ctk.CTkCheckBox(form, text="Keep ICC profile", variable=icc_var).grid(row=4, column=0, columnspan=2, padx=5, pady=2, sticky="w")
+        exif_var = ctk.BooleanVar(value=encoder.keep_exif)
+        ctk.CTkCheckBox(form, text="Keep EXIF", variable=exif_var).grid(row=5, column=0, columnspan=2, padx=5, pady=2, sticky="w")
+
+        results_box = ctk.CTkTextbox(dialog, width=420, height=200, font=("Courier", 12))
+        results_box.pack(padx=10, pady=5)
+        results_box.insert("end", "Benchmark encodes a center crop of a few images of the current folder\n"
+                                  "with each candidate setting.")
+        results_box.configure(state=ctk.DISABLED)
+
+        def show(text):
+            if dialog.winfo_exists():
+                results_box.configure(state=ctk.NORMAL)
+                results_box.delete("1.0", "end")
+                results_box.insert("end", text)
+                results_box.configure(state=ctk.DISABLED)
+
+        def apply():
+            try:
+                level = int(level_entry.get())
+                quality = int(quality_entry.get())
+            except ValueError:
+                messagebox.showerror("Error", "PNG level and quality must be numbers.", parent=dialog)
+                return
+            if not 0 <= level <= 9 or not 1 <= quality <= 100:
+                messagebox.showerror("Error", "PNG level must be 0-9 and quality 1-100.", parent=dialog)
+                return
+            self.output_encoder = OutputEncoder(format_var.get(), compress_level=level, optimize=optimize_var.get(),
+                                                quality=quality, keep_icc=icc_var.get(), keep_exif=exif_var.get())
+            dialog.destroy()
+
+        def poll_benchmark(future):
+            if not future.done():
+                self.root.after(100, poll_benchmark, future)
+                return
+            benchmark_button.configure(state=ctk.NORMAL)
+            try:
+                show(format_encoder_benchmark(future.result()))
+            except Exception as e:
+                show(f"Benchmark failed: {e}")
+
+        def benchmark():
+            if not self.folder_images:
+                show("Open a folder first.")
+                return
+            # A few images spread over the folder
+            step = max(1, len(self.folder_images) // 5)
+            sample = self.folder_images[::step][:5]
+            crop_size = (1024, 1024) if self.custom_mode else self.crop_size
+            show(f"Encoding {len(sample)} crops of {crop_size[0]}x{crop_size[1]} with {len(BENCHMARK_ENCODERS)} settings...")
+            benchmark_button.configure(state=ctk.DISABLED)
+            future = self.io_pool.submit(benchmark_encoders, sample, BENCHMARK_ENCODERS, crop_size)
+            self.root.after(100, poll_benchmark, future)
+
+        buttons = ctk.CTkFrame(dialog)
+        buttons.pack(padx=10, pady=10)
+        benchmark_button = ctk.CTkButton(buttons, text="Benchmark", command=benchmark)
+        benchmark_button.pack(side=ctk.LEFT, padx=5)
+        ctk.CTkButton(buttons, text="Apply", command=apply).pack(side=ctk.LEFT, padx=5)
+
+    def update_pending_label(self):
+        pending = self.save_queue.pending()
+        self.pending_label.configure(text=f"Pending saves: {pending}" if pending else "")
+
+    @recorded_action()
+    @timed_action("navigate")
+    def next_image(self):
+        if not self.images:
+            return
+        self.current_index = (self.current_index + 1) % len(self.images)
+        self.load_current_image()
+
+    @recorded_action()
+    @timed_action("navigate")
+    def prev_image(self):
+        if not self.images:
+            return
+        self.current_index = (self.current_index - 1) % len(self.images)
+        self.load_current_image()
+
+    @recorded_action()
+    @timed_action("delete")
+    def delete_current_image(self):
+        if not self.images:
+            return
+        self.delete_images([self.images[self.current_index]])
+
+    def delete_images(self, paths):
+        """Deletes image files and everything recorded about them, then shows the next remaining image."""
+        # Queued saves of these images would record their crops again once written
+        self.flush_saves()
+        deleted = set(paths)
+        for image_path in paths:
+            self.remove_cropped_info(image_path)
+            self.prefetcher.invalidate(image_path)
+            self.suggestions.pop(image_path, None)
+
+            # Remove the physical file
+            try:
+                os.remove(image_path)
+            except OSError as e:
+                print(f"Error deleting {image_path}: {e}")
+
+            self.image_index.pop(image_path, None)
+            self.quality.pop(image_path, None)
+            self.quality_scores.pop(image_path, None)
+            self.analysis_cache.remove_index(image_path)
+            self.forget_duplicate(image_path)
+            self.staged_crops.pop(image_path, None)
+
+        # Remove from the lists and adjust index
+        current = self.images[self.current_index]
+        remaining_before = sum(1 for path in self.images[:self.current_index] if path not in deleted)
+        self.images = [path for path in self.images if path not in deleted]
+        self.folder_images = [path for path in self.folder_images if path not in deleted]
+        if not self.images:
+            self.canvas.delete("all")
+            self.images = []
+            self.current_image = None
+            self.clear_existing_rect()
+            self.dim_label.config(text="")
+            self.cropped_label.config(text="")
+            self.staged_label.configure(text="")
+            self.right_frame.pack_forget()
+            return
+
+        if current in deleted:
+            self.current_index = min(remaining_before, len(self.images) - 1)
+        else:
+            self.current_index = self.images.index(current)
+        self.load_current_image()
+        self.update_dimension_counts()
+
+    def save_current_crop(self):
+        if self.current_image and self.rect_coords:
+            x0, y0, x1, y1 = map(int, self.rect_coords)
+            crop_size_str = f"{x1-x0}x{y1-y0}"
+            image_path = self.images[self.current_index]
+            self.save_cropped_info(image_path, crop_size_str, (x0, y0, x1, y1))
+            self.update_dimension_counts()
+
+    def load_cropped_info(self):
+        # The store is opened on a loader thread while the window comes up; the first use of
+        # self.store waits for it. Folders are read from it when they are opened.
+        self._store = None
+        self._store_error = None
+        self._store_ready = threading.Event()
+        threading.Thread(target=self._open_store, name="store-loader", daemon=True).start()
+        self.cropped_info = {"data": {}}
+        self.last_cropped_entry = {}
+        self.loaded_folders = set()
+
+    def _open_store(self):
+        try:
+            with instrumentation.span("open_store"):
+                if self.crop_store_backend == "json":
+                    store = JsonCropStore(self.cropped_info_file, self.last_cropped_file)
+                else:
+                    store = SqliteCropStore(self.crop_store_file)
+                    store.import_json(self.cropped_info_file, self.last_cropped_file)
+            self._store = store
+        except Exception as e:
+            self._store_error = e
+        finally:
+            self._store_ready.set()
+
+    @property
+    def store(self):
+        if self._store is None:
+            with instrumentation.span("wait_store"):
+                self._store_ready.wait()
+            if self._store is None:
+                raise RuntimeError(f"Could not open the crop store: {self._store_error}")
+        return self._store
+
+    def load_folder_cropped_info(self, folder, reload=False):
+        if reload and folder in self.loaded_folders:
+            # Other tools (serve, a second window) may have cropped in the folder meanwhile. Queued
+            # saves are recorded in the store first, so reading it back does not lose them.
+            self.flush_saves()
+            self.loaded_folders.discard(folder)
+            self.cropped_info["data"].pop(folder, None)
+            self.folder_stats.pop(folder, None)
+            self.last_cropped_entry.pop(folder, None)
+            for key in [key for key in self.crop_indexes if key[0] == folder]:
+                del self.crop_indexes[key]
+        if folder in self.loaded_folders:
+            return
+        data = self.store.load_folder(folder)
+        if data:
+            self.cropped_info["data"][folder] = data
+        self.folder_stats[folder] = self.store.folder_stats(folder)
+        last_cropped = self.store.load_last_cropped(folder)
+        if last_cropped:
+            self.last_cropped_entry[folder] = last_cropped
+        self.loaded_folders.add(folder)
+
+    def save_cropped_info(self, image_path, size, coords, persist=True):
+        folder = self.current_folder
+        coords = list(coords)
+
+        if folder not in self.cropped_info["data"]:
+            self.cropped_info["data"][folder] = {}
+
+        if image_path not in self.cropped_info["data"][folder]:
+            self.cropped_info["data"][folder][image_path] = []
+
+        crops = self.cropped_info["data"][folder][image_path]
+        exists = any(crop["size"] == size and list(crop["coords"]) == coords for crop in crops)
+        if not exists:
+            crops.append({"size": size, "coords": coords})
+            self.folder_stats.setdefault(folder, FolderStats()).add_crop(size, first_of_image=len(crops) == 1)
+            if (folder, image_path) in self.crop_indexes:
+                self.crop_indexes[folder, image_path].add(size, coords)
+            if persist:
+                with instrumentation.span("persist"):
+                    self.store.add_crop(folder, image_path, size, coords)
+        return not exists
+
+    def discard_cropped_info(self, folder, image_path, size, coords):
+        crops = self.cropped_info["data"].get(folder, {}).get(image_path)
+        if not crops:
+            return
+        coords = list(coords)
+        remaining = [crop for crop in crops if not (crop["size"] == size and list(crop["coords"]) == coords)]
+        if len(remaining) == len(crops):
+            return
+        crops[:] = remaining
+        self.folder_stats[folder].remove_crop(size, last_of_image=not crops)
+        if (folder, image_path) in self.crop_indexes:
+            self.crop_indexes[folder, image_path].remove(size, coords)
+        if not crops:
+            del self.cropped_info["data"][folder][image_path]
+            if not self.cropped_info["data"][folder]:
+                del self.cropped_info["data"][folder]
+
+    def remove_cropped_info(self, image_path):
+        folder = self.current_folder
+        if folder in self.cropped_info["data"] and image_path in self.cropped_info["data"][folder]:
+            crops = self.cropped_info["data"][folder].pop(image_path)
+            self.crop_indexes.pop((folder, image_path), None)
+            for i, crop in enumerate(crops):
+                self.folder_stats[folder].remove_crop(crop["size"], last_of_image=(i == len(crops) - 1))
+            if not self.cropped_info["data"][folder]:
+                del self.cropped_info["data"][folder]
+            with instrumentation.span("persist"):
+                self.store.remove_image(folder, image_path)
+            self.update_dimension_counts()
+
+    # Overlapping crops
+    def crop_index(self, image_path, folder=None):
+        key = (folder or self.current_folder, image_path)
+        index = self.crop_indexes.get(key)
+        if index is None:
+            index = self.crop_indexes[key] = CropIndex(self.cropped_info["data"].get(key[0], {}).get(image_path, []))
+        return index
+
+    def check_overlaps(self, image_path, boxes):
+        """Reports boxes overlapping an existing crop of the image (or an earlier box) above overlap_iou.
+
+        In the "Reject overlaps" mode they are left out of the returned boxes. Saving a stored crop
+        again is not checked, it rewrites the file as before.
+        """
+        mode = self.overlap_mode.get()
+        if mode == "Allow overlaps":
+            return boxes
+        index = self.crop_index(image_path)
+        accepted = []
+        messages = []
+        for box in boxes:
+            if box in index:
+                accepted.append(box)
+                continue
+            size = f"{box[2] - box[0]}x{box[3] - box[1]}"
+            overlaps = index.overlaps(box) + [(box_iou(box, other), f"{other[2] - other[0]}x{other[3] - other[1]}", other)
+                                              for other in accepted if tuple(other) != tuple(box)]
+            iou, other_size, _ = max(overlaps, default=(0.0, None, None))
+            if iou >= self.overlap_iou:
+                rejected = mode == "Reject overlaps"
+                messages.append(f"{'Not saved' if rejected else 'Saved'}: {size} overlaps a {other_size} crop by {iou:.0%} (IoU)")
+                if rejected:
+                    continue
+            accepted.append(box)
+        if messages:
+            self.show_overlap_message("\n".join(messages))
+        return accepted
+
+    def show_overlap_message(self, text):
+        self.overlap_label.configure(text=text)
+        if self._overlap_label_id is not None:
+            self.root.after_cancel(self._overlap_label_id)
+        self._overlap_label_id = self.root.after(5000, self.clear_overlap_message)
+
+    def clear_overlap_message(self):
+        self._overlap_label_id = None
+        self.overlap_label.configure(text="")
+
+    def show_coverage(self):
+        if not self.current_folder:
+            return
+        folder = self.current_folder
+        with instrumentation.span("coverage"):
+            summary = coverage_summary(self.cropped_info["data"].get(folder, {}), self.image_dimensions,
+                                       total_images=len(self.folder_images), iou_threshold=self.overlap_iou)
+        dialog = ctk.CTkToplevel(self.root)
+        dialog.title(f"Crop coverage of {os.path.basename(folder)}")
+        dialog.transient(self.root)
+        text = ctk.CTkTextbox(dialog, width=460, height=400, font=("Courier", 12))
+        text.pack(padx=10, pady=10, fill=ctk.BOTH, expand=True)
+        text.insert("end", format_coverage(summary))
+        text.configure(state=ctk.DISABLED)
+
+    def get_folder_stats(self, folder=None):
+        folder = folder or self.current_folder
+        stats = self.folder_stats.get(folder) or FolderStats()
+        total_images = len(self.images) if folder == self.current_folder else None
+        return stats.as_dict(total_images)
+
+    def update_dimension_counts(self):
+        self.update_counts_label()
+        self.filmstrip.refresh()
+
+    def update_counts_label(self):
+        stats = self.get_folder_stats()
+        text = "Cropped Dimensions:\n\n"
+        for dim, count in sorted(stats["sizes"].items()):
+            text += f"{dim}: {count}\n"
+        text += "\n"
+        for orientation, count in sorted(stats["orientations"].items()):
+            text += f"{orientation.capitalize()}: {count}\n"
+        text += f"\nTotal crops: {stats['total_crops']}\n"
+        if "total_images" in stats:
+            text += f"Cropped images: {stats['cropped_images']}/{stats['total_images']}\n"
+        self.counts_label.configure(text=text)
+
+    def draw_previous_crops(self):
+        self.canvas.delete("previous_crop")
+        self.canvas.delete("hover_crop")
+        self._hovered_crops = None
+        if not self.current_image or not self.show_previous_crops.get():
+            return
+        image_path = self.images[self.current_index]
+        folder = self.current_folder
+        if folder in self.cropped_info["data"] and image_path in self.cropped_info["data"][folder]:
+            # Stippled canvas rectangles tint the region without allocating any pixels,
+            # so the cost does not depend on the crop size. Aqua has no stipple support.
+            stipple = "" if self.windowing_system == "aqua" else "gray12"
+            fill = "lime" if stipple else ""
+            with instrumentation.span("draw"):
+                for crop in self.cropped_info["data"][folder][image_path]:
+                    x0, y0, x1, y1 = self.image_to_canvas(crop["coords"])
+                    self.canvas.create_rectangle(x0, y0, x1, y1, outline="yellow", width=1,
+                                                 fill=fill, stipple=stipple, tags="previous_crop")
+
+    @recorded_action()
+    def toggle_previous_crops(self):
+        self.show_previous_crops.set(not self.show_previous_crops.get())
+        self.draw_previous_crops()
+
+    def update_cropped_label(self):
+        if not self.images:
+            return
+
+        image_path = self.images[self.current_index]
+        folder = self.current_folder
+
+        if folder in self.cropped_info["data"] and image_path in self.cropped_info["data"][folder]:
+            cropped_dims = [crop["size"] for crop in self.cropped_info["data"][folder][image_path]]
+            text = "Cropped sizes: " + ", ".join(cropped_dims)
+        else:
+            text = "Not yet cropped"
+        if image_path in self.duplicates:
+            text += f"  |  {len(self.duplicates[image_path]) - 1} near-duplicate(s) (U)"
+        self.cropped_label.configure(text=text)
+
+    @recorded_action()
+    def on_jump_to_last_cropped(self):
+        self.jump_to_last_cropped()
+
+    @timed_action("jump")
+    def jump_to_last_cropped(self):
+        if not self.current_folder:
+            return
+
+        if self.current_folder not in self.last_cropped_entry:
+            return
+
+        last_cropped = self.last_cropped_entry[self.current_folder]
+
+        image_path = last_cropped["image_path"]
+        try:
+            index = self.images.index(image_path)
+            self.current_index = index
+            self.load_current_image()
+        except ValueError:
+            print("Last cropped image not found in current folder.")
+
+    def update_radio_button_highlights(self, width, height):
+        for label, value in self.dimension_labels:
+            rb = self.radio_buttons[value]
+            if value == "custom":
+                rb.configure(text_color="lime")
+                continue
+            w, h = map(int, value.split("x"))
+            # Highlight green if fits in image
+            if w <= width and h <= height:
+                rb.configure(text_color="lime")
+                rb.configure(state=ctk.NORMAL)
+            else:
+                rb.configure(state=ctk.DISABLED) # Disable the radiobutton
+
+    def set_largest_radio_button(self, width, height):
+        best = choose_preset(width, height, self.orientation_preference.get(), self.dimension_labels)
+        if best is None:
+            self.size_var.set("custom")
+            self.update_size()
+            return
+
+        # Select the best fit
+        self.size_var.set(best)
+        self.update_size()
+
+    @recorded_action()
+    def on_orientation_selected(self):
+        self.update_largest_radio_button()
+
+    def update_largest_radio_button(self):
+        """Updates the selected radio button when orientation preference changes."""
+        if self.current_image:
+            w, h = self.current_image.size
+            self.set_largest_radio_button(w,h)
+
+    def can_resize(self):
+        if not self.current_folder:
+            return False
+
+        if not self.current_image:
+            return False    
+        
+        image_path = self.images[self.current_index]
+        if self.current_folder in self.cropped_info["data"]:
+            if image_path in self.cropped_info["data"][self.current_folder]:
+                return False
+        
+        width, height = self.current_image.size
+        max_dim = max(width, height)
+
+        if max_dim <= self.downscale_to:
+            return False
+
+        return True
+
+    @recorded_action()
+    @timed_action("resize")
+    def resize_and_save_image(self, event=None):
+        if not self.current_folder:
+            return
+
+        if not self.current_image:
+            return
+
+        image_path = self.images[self.current_index]
+
+        if self.current_folder in self.cropped_info["data"]:
+            if image_path in self.cropped_info["data"][self.current_folder]:
+                messagebox.showerror("Error", "Cannot resize: Image has already been cropped.")
+                return
+
+        width, height = self.current_image.size
+        max_dim = max(width, height)
+
+        if max_dim <= self.downscale_to:
+            return
+
+        new_width, new_height = downscaled_size(width, height, self.downscale_to)
+
+        image_path = self.images[self.current_index]
+        base_name = os.path.basename(image_path)
+        originals_folder = output_folder(self.originals_folder, self.current_folder, image_path)
+        os.makedirs(originals_folder, exist_ok=True)
+        
+        # Backup the original file into the originals folder
+        full_image = self.current_image.full()
+        full_image.save(os.path.join(originals_folder, base_name))
+
+        resized_image = full_image.resize((new_width, new_height), RESAMPLE_FILTERS[self.resample_filter])
+
+        # Save the resized image, overwriting the original
+        replace_image(resized_image, image_path, full_image.format)
+
+        # Update the displayed image
+        self.refresh_image(image_path)
+        self.schedule_analysis_poll()
+        self.current_image = self.prefetcher.get(image_path)
+        self.clear_existing_rect()
+        self.show_current_image()
+        w, h = self.current_image.size
+
+        self.update_radio_button_highlights(w, h)
+        self.update_largest_radio_button()
+        self.resize_button.configure(state=ctk.DISABLED)
+
+    # Resize all
+    def resize_candidates(self, target):
+        cropped = self.cropped_info["data"].get(self.current_folder, {})
+        candidates = []
+        for path in self.folder_images:
+            if path in cropped:
+                continue
+            # Indexed images that are small enough are skipped right away, the workers check the rest
+            dims = self.image_dimensions(path)
+            if dims and max(dims) <= target:
+                continue
+            candidates.append(path)
+        return candidates
+
+    def resize_all_images(self):
+        if not self.current_folder or not self.folder_images:
+            return
+        if self.resize_batch and not self.resize_batch.finished:
+            return
+
+        dialog = ctk.CTkToplevel(self.root)
+        dialog.title("Resize All")
+        dialog.transient(self.root)
+        dialog.grab_set()
+
+        form = ctk.CTkFrame(dialog)
+        form.pack(padx=10, pady=10, fill=ctk.X)
+        ctk.CTkLabel(form, text="Max size:").pack(side=ctk.LEFT, padx=5)
+        target_entry = ctk.CTkEntry(form, width=80)
+        target_entry.insert(0, str(self.downscale_to))
+        target_entry.pack(side=ctk.LEFT, padx=5)
+        ctk.CTkLabel(form, text="Filter:").pack(side=ctk.LEFT, padx=5)
+        filter_var = ctk.StringVar(value=self.resample_filter)
+        ctk.CTkOptionMenu(form, variable=filter_var, values=list(RESAMPLE_FILTERS)).pack(side=ctk.LEFT, padx=5)
+
+        status_label = ctk.CTkLabel(dialog, text="Uncropped images larger than the max size are downscaled.\n"
+                                                  "Originals are copied to the 'originals' folder.")
+        status_label.pack(padx=10, pady=5)
+        progress = ctk.CTkProgressBar(dialog, width=400)
+        progress.set(0)
+        progress.pack(padx=10, pady=5)
+
+        def start():
+            try:
+                target = int(target_entry.get())
+            except ValueError:
+                messagebox.showerror("Error", "Max size must be a number.", parent=dialog)
+                return
+            self.downscale_to = target
+            self.resample_filter = filter_var.get()
+            self.flush_saves()
+            candidates = self.resize_candidates(target)
+            if not candidates:
+                status_label.configure(text="No image needs resizing.")
+                return
+            self.resize_batch = BatchResize(candidates, self.originals_folder, target, self.resample_filter,
+                                            workers=self.analysis_workers, mp_context=multiprocessing.get_context("spawn"),
+                                            folder=self.current_folder)
+            button.configure(text="Cancel", command=self.resize_batch.cancel)
+            self.root.after(100, self.poll_resize_batch, self.resize_batch, dialog, status_label, progress, button)
+
+        button = ctk.CTkButton(dialog, text="Start", command=start)
+        button.pack(padx=10, pady=10)
+
+    def poll_resize_batch(self, batch, dialog, status_label, progress, button):
+        current_path = self.images[self.current_index] if self.images else None
+        reload_current = False
+        rows = []
+        for path, row, error in batch.poll():
+            if error is not None:
+                print(f"Error resizing {path}: {error}")
+            elif row is not None:
+                rows.append(row)
+                self.refresh_image(path, row)
+                reload_current = reload_current or path == current_path
+        if rows:
+            self.analysis_cache.store_index(self.current_folder, rows)
+            self.schedule_analysis_poll()
+        if reload_current:
+            self.load_current_image()
+
+        text = (f"{batch.completed}/{batch.total}  resized {batch.resized}, skipped {batch.skipped}, "
+                f"failed {batch.failed}  {batch.rate():.1f} images/s")
+        if batch.finished:
+            text = ("Cancelled: " if batch.cancelled else "Done: ") + text
+            if dialog.winfo_exists():
+                button.configure(text="Close", command=dialog.destroy)
+        else:
+            self.root.after(100, self.poll_resize_batch, batch, dialog, status_label, progress, button)
+        if dialog.winfo_exists():
+            status_label.configure(text=text)
+            progress.set(batch.completed / batch.total if batch.total else 1)
+
+    def refresh_image(self, path, row=None):
+        """Drops everything cached or derived for an image that changed on disk."""
+        self.prefetcher.invalidate(path)
+        self.suggestions.pop(path, None)
+        self.staged_crops.pop(path, None)
+        if row is not None:
+            self.image_index[path] = row
+        for analyzer in self.analyzers:
+            analyzer.requeue(path)
+
+# --- HEADLESS COMMANDS ---
+
+def open_crop_store(path):
+    if path.endswith(".json"):
+        return JsonCropStore(path, os.path.join(os.path.dirname(path), "last_cropped.json"))
+    return SqliteCropStore(path)
+
+
+def check_crop_store(path):
+    """Whether there is a crop store at path, reported if not. Commands working on the crops of the
+    GUI check it first, opening a mistyped --store would silently create an empty one."""
+    if os.path.isfile(path):
+        return True
+    print(f"No crop store at {path}, check --store (the GUI keeps cropped_info.db in its working directory)")
+    return False
+
+
+def export_image_crops(image_path, crops, check, manifest, force=False, encoder=None):
+    """Process pool worker: renders the crops of one source image, decoding it at most once.
+
+    crops is a list of (coords, save_path). Returns per crop (save_path, status, manifest entry).
+    """
+    encoder = encoder or OutputEncoder()
+    results = []
+    todo = []
+    source_mtime = os.path.getmtime(image_path)
+    source_hash = file_digest(image_path) if check == "hash" else None
+    for coords, save_path in crops:
+        entry = {"source": source_hash, "coords": list(coords), "encoder": encoder.as_dict()}
+        if force:
+            todo.append((coords, save_path, entry))
+        elif check == "mtime" and os.path.exists(save_path) and os.path.getmtime(save_path) >= source_mtime:
+            results.append((save_path, "skipped", None))
+        elif check == "hash" and os.path.exists(save_path) and manifest.get(os.path.basename(save_path)) == entry:
+            results.append((save_path, "skipped", entry))
+        else:
+            todo.append((coords, save_path, entry))
+    if todo:
+        image = decode_image(image_path)
+        for coords, save_path, entry in todo:
+            tmp_path = save_path + ".tmp"
+            write_crop(image, tuple(coords), tmp_path, encoder)
+            os.replace(tmp_path, save_path)
+            results.append((save_path, "rendered", entry))
+    return results
 
-        # --- THEME ---
-        ctk.set_default_color_theme("blue")
 
-        self.crop_size = (1024, 1024)
-        self.images = []
-        self.current_index = 0
-        self.cropped_info = {}
-        self.cropped_info["data"] = {}
-        self.cropped_info_file = "cropped_info.json"
-        self.downscale_to = 1024
-        self.dimension_counts = defaultdict(int)
+def coverage_command(args):
+    store = open_crop_store(args.store)
+    cache = AnalysisCache(args.cache)
+    folders = [os.path.abspath(f) for f in args.folders] if args.folders else store.folders()
+    for folder in folders:
+        # Dimensions come from the metadata index the GUI keeps in the analysis cache
+        index = cache.load_index(folder)
+        dimensions = lambda path: (index[path]["width"], index[path]["height"]) if path in index else None
+        summary = coverage_summary(store.load_folder(folder), dimensions, total_images=len(index) or None,
+                                   iou_threshold=args.iou)
+        print(f"\n{folder}")
+        print(format_coverage(summary))
+    cache.close()
+    store.close()
+    return 0
 
-        self.custom_mode = False
-        self.custom_start = None
-        self.last_cropped_entry = {}  # Changed to dict
-        self.current_folder = None
-        self.radio_buttons = {}
 
-        # --- Main Frames ---
-        main_frame = ctk.CTkFrame(root)
-        main_frame.pack(side=ctk.TOP, fill=ctk.BOTH, expand=True)
+def export_command(args):
+    encoder = encoder_from_args(args)
+    if not check_crop_store(args.store):
+        return 1
+    store = open_crop_store(args.store)
+    folders = [os.path.abspath(f) for f in args.folders] if args.folders else store.folders()
+    manifests = {}  # output folder -> (manifest path, manifest)
+    jobs = []
+    for folder in folders:
+        output_root = os.path.join(args.output, os.path.basename(folder)) if args.output else os.path.join(folder, "cropped")
+        for image_path, crops in store.load_folder(folder).items():
+            if not os.path.exists(image_path):
+                print(f"Missing source image {image_path}, skipping {len(crops)} crop(s)")
+                continue
+            # Images of subfolders (recursive mode) are exported to the same subfolders
+            save_folder = output_folder(output_root, folder, image_path)
+            if save_folder not in manifests:
+                os.makedirs(save_folder, exist_ok=True)
+                manifest_path = os.path.join(save_folder, ".export_manifest.json")
+                manifest = {}
+                if args.check == "hash" and not args.force:
+                    try:
+                        with open(manifest_path, 'r') as f:
+                            manifest = json.load(f)
+                    except (FileNotFoundError, json.JSONDecodeError):
+                        pass
+                manifests[save_folder] = (manifest_path, manifest)
+            # Crops of the same size share one output file, the latest record wins like in the GUI
+            outputs = {}
+            for crop in crops:
+                outputs[crop_save_path(save_folder, image_path, crop["size"], encoder.extension)] = crop["coords"]
+            jobs.append((save_folder, image_path, [(coords, path) for path, coords in outputs.items()]))
+    store.close()
 
-        # Left and right frames
-        left_frame = ctk.CTkFrame(main_frame)
-        left_frame.pack(side=ctk.LEFT, fill=ctk.BOTH, expand=True)
+    total = sum(len(crops) for _, _, crops in jobs)
+    print(f"Exporting {total} crops from {len(jobs)} images in {len(folders)} folder(s) as {encoder.describe()} with {args.jobs} jobs")
+    counts = defaultdict(int)
+    written_bytes = 0
+    done = 0
+    start = last_report = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {}
+        for save_folder, image_path, crops in jobs:
+            manifest = manifests[save_folder][1]
+            known = {name: manifest[name] for name in (os.path.basename(path) for _, path in crops) if name in manifest}
+            future = executor.submit(export_image_crops, image_path, crops, args.check, known, args.force, encoder)
+            futures[future] = (save_folder, image_path, crops)
+        for future in as_completed(futures):
+            save_folder, image_path, crops = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                print(f"Error exporting crops of {image_path}: {e}")
+                counts["failed"] += len(crops)
+                done += len(crops)
+                continue
+            for save_path, status, entry in results:
+                counts[status] += 1
+                if status == "rendered":
+                    written_bytes += os.path.getsize(save_path)
+                if entry is not None:
+                    manifests[save_folder][1][os.path.basename(save_path)] = entry
+            done += len(crops)
+            now = time.perf_counter()
+            if now - last_report >= 1.0 or done == total:
+                last_report = now
+                print(f"[{done}/{total}] rendered {counts['rendered']}, skipped {counts['skipped']}, "
+                      f"failed {counts['failed']}  {done / (now - start):.1f} crops/s")
 
-        self.right_frame = ctk.CTkFrame(main_frame, width=200)
-        self.right_frame.pack(side=ctk.RIGHT, fill=ctk.Y)
-        self.right_frame.pack_propagate(False)
-        self.right_frame.pack_forget()
+    if args.check == "hash":
+        for manifest_path, manifest in manifests.values():
+            with open(manifest_path, 'w') as f:
+                json.dump(manifest, f, indent=2)
 
-        control_frame = ctk.CTkFrame(root)
-        control_frame.pack(side=ctk.BOTTOM, fill=ctk.X, pady=5)
+    elapsed = time.perf_counter() - start
+    rendered = counts["rendered"]
+    print(f"Done in {elapsed:.2f}s: rendered {rendered}, skipped {counts['skipped']}, failed {counts['failed']}")
+    if rendered and elapsed > 0:
+        print(f"Throughput: {rendered / elapsed:.1f} crops/s, {written_bytes / elapsed / (1024 * 1024):.1f} MB/s written")
+    return 1 if counts["failed"] else 0
 
-        info_frame = ctk.CTkFrame(root)
-        info_frame.pack(side=ctk.BOTTOM, fill=ctk.X, pady=5)
 
-        self.dim_label = ctk.CTkLabel(left_frame, text="", font=("Arial", 12))
-        self.dim_label.pack(pady=2)
+def crop_bucket(width, height, presets):
+    """The preset (w, h) closest to a crop in aspect ratio, then in area, for aspect ratio bucketed training."""
+    return min(presets, key=lambda p: (abs(math.log((width / height) / (p[0] / p[1]))),
+                                       abs(math.log((width * height) / (p[0] * p[1])))))
 
-        # Cropped Info Label
-        self.cropped_label = ctk.CTkLabel(left_frame, text="", font=("Arial", 10), text_color="yellow")
-        self.cropped_label.pack(pady=2)
 
-        # --- SCROLLABLE CANVAS SETUP ---
-        canvas_frame = ctk.CTkFrame(left_frame)
-        canvas_frame.pack(fill=ctk.BOTH, expand=True)
+def render_crops(image_path, boxes, encoder):
+    """Process pool worker: encodes the crops of one source image, decoding it once. Returns the encoded bytes per box."""
+    image = decode_image(image_path)
+    results = []
+    for box in boxes:
+        buffer = io.BytesIO()
+        encoder.save(image.crop(tuple(box)), buffer)
+        results.append(buffer.getvalue())
+    return results
 
-        self.canvas = ctk.CTkCanvas(canvas_frame, cursor="cross", bg="black", highlightthickness=0)
-        self.canvas.pack(side=ctk.LEFT, fill=ctk.BOTH, expand=True)
 
-        self.v_scroll = ctk.CTkScrollbar(canvas_frame, orientation=ctk.VERTICAL, command=self.canvas.yview)
-        self.v_scroll.pack(side=ctk.RIGHT, fill=ctk.Y)
-        self.h_scroll = ctk.CTkScrollbar(left_frame, orientation=ctk.HORIZONTAL, command=self.canvas.xview)
-        self.h_scroll.pack(fill=ctk.X)
+class ShardWriter:
+    """Appends files to sequential tar shards of about max_bytes: <prefix>-00000.tar, <prefix>-00001.tar, ...
 
-        self.canvas.configure(yscrollcommand=self.v_scroll.set, xscrollcommand=self.h_scroll.set)
+    add() returns the shard name and the offset of the file data in it, so readers can seek
+    (or mmap) straight to a sample. Shards are written as .tmp and renamed when complete.
+    """
 
-        # Mousewheel bindings (platform-independent)
-        self.canvas.bind("<Enter>", lambda e: self._bind_mousewheel())
-        self.canvas.bind("<Leave>", lambda e: self._unbind_mousewheel())
+    @staticmethod
+    def is_shard_name(name):
+        """Whether name is a shard (or unfinished shard) written by a ShardWriter."""
+        base = name[:-len(".tmp")] if name.endswith(".tmp") else name
+        if not base.endswith(".tar"):
+            return False
+        prefix, _, number = base[:-len(".tar")].rpartition("-")
+        width, _, height = prefix.partition("x")
+        return len(number) == 5 and number.isdigit() and (prefix == "shard" or width.isdigit() and height.isdigit())
 
-        open_button = ctk.CTkButton(control_frame, text="Open Folder (O)", command=self.load_folder)
-        open_button.pack(side=ctk.LEFT, padx=5)
-        self.prev_button = ctk.CTkButton(control_frame, text="Prev (A)", state=ctk.DISABLED, command=self.prev_image)
-        self.prev_button.pack(side=ctk.LEFT, padx=5)
-        self.next_button = ctk.CTkButton(control_frame, text="Next (D)", state=ctk.DISABLED, command=self.next_image)
-        self.next_button.pack(side=ctk.LEFT, padx=5)
-        self.save_button = ctk.CTkButton(control_frame, text="Save (S)", state=ctk.DISABLED, command=self.quick_save)
-        self.save_button.pack(side=ctk.LEFT, padx=5)
+    def __init__(self, directory, prefix, max_bytes):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.shards = []
+        self._tar = None
+        self._mtime = int(time.time())
 
-        self.delete_button = ctk.CTkButton(control_frame, text="Delete (X)", state=ctk.DISABLED, command=self.delete_current_image)
-        self.delete_button.pack(side=ctk.LEFT, padx=5)
-        self.resize_button = ctk.CTkButton(control_frame, text="Resize (R)", state=ctk.DISABLED, command=self.resize_and_save_image)
-        self.resize_button.pack(side=ctk.LEFT, padx=5)
+    def add(self, name, data):
+        import tarfile
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = self._mtime
+        info.mode = 0o644
+        if self._tar is not None:
+            size = self._tar.offset + 512 + len(data)
+            if size > self.max_bytes:
+                self._close_shard()
+        if self._tar is None:
+            self.shards.append(f"{self.prefix}-{len(self.shards):05d}.tar")
+            self._tar = tarfile.open(os.path.join(self.directory, self.shards[-1] + ".tmp"), "w",
+                                     format=tarfile.USTAR_FORMAT)
+        offset = self._tar.offset + len(info.tobuf(self._tar.format, self._tar.encoding, self._tar.errors))
+        self._tar.addfile(info, io.BytesIO(data))
+        return self.shards[-1], offset
 
+    def _close_shard(self):
+        self._tar.close()
+        path = os.path.join(self.directory, self.shards[-1])
+        os.replace(path + ".tmp", path)
+        self._tar = None
 
-        # Size presets + custom
-        self.size_var = ctk.StringVar(value="1024x1024")
-        size_frame = ctk.CTkFrame(info_frame)
-        size_frame.pack(side=ctk.LEFT, padx=10)
+    def close(self):
+        if self._tar is not None:
+            self._close_shard()
 
-        # Portrait/Landscape Preference
-        self.orientation_preference = ctk.StringVar(value="portrait")
-        ctk.CTkLabel(size_frame, text="Prefer:").pack(side=ctk.LEFT)
-        self.portrait_radio = ctk.CTkRadioButton(size_frame, text="Portrait", variable=self.orientation_preference, value="portrait", command=self.update_largest_radio_button)
-        self.landscape_radio = ctk.CTkRadioButton(size_frame, text="Landscape", variable=self.orientation_preference, value="landscape", command=self.update_largest_radio_button)
-        self.portrait_radio.pack(side=ctk.LEFT)
-        self.landscape_radio.pack(side=ctk.LEFT)
-        self.orientation_preference.set("portrait")
 
-        self.dimension_labels = [
-            ("512x512", "512x512"),
-            ("1024x1024", "1024x1024"),
-            ("512x768", "512x768"),
-            ("768x1024", "768x1024"),
-            ("768x512", "768x512"),
-            ("1024x768", "1024x768"),
-            ("Custom", "custom")
-        ]
-        self.radio_buttons = {}
-        for label in self.dimension_labels:
-            rb = ctk.CTkRadioButton(size_frame, text=label[0], variable=self.size_var, 
-                                value=label[1], command=self.update_size)
-            rb.pack(side=ctk.LEFT)
-            self.radio_buttons[label[1]] = rb
+def shards_command(args):
+    encoder = encoder_from_args(args)
+    index_path = os.path.join(args.output, "index.jsonl")
+    existing = os.listdir(args.output) if os.path.isdir(args.output) else []
+    if existing and not args.force:
+        print(f"{args.output} is not empty, use --force to replace the shards of an earlier run")
+        return 1
 
-        # --- SHORTCUT LEGEND ---
-        shortcut_text = "Wheel=VScroll  Shift+Wheel=HScroll"
-        self.shortcut_label = ctk.CTkLabel(control_frame, text=shortcut_text, font=("Arial", 10))
-        self.shortcut_label.pack(side=ctk.RIGHT, padx=10)
+    # The store is read before anything is replaced, a wrong --store or folder keeps the earlier run
+    if not check_crop_store(args.store):
+        return 1
+    store = open_crop_store(args.store)
+    stored = store.folders()
+    folders = [os.path.abspath(f) for f in args.folders] if args.folders else stored
+    missing = [folder for folder in folders if folder not in stored]
+    if missing or not folders:
+        print(f"No crops of {', '.join(missing)} in {args.store}" if missing else f"No crops in {args.store}")
+        store.close()
+        return 1
+    jobs = []
+    for folder in folders:
+        for image_path, crops in sorted(store.load_folder(folder).items()):
+            if not os.path.exists(image_path):
+                print(f"Missing source image {image_path}, skipping {len(crops)} crop(s)")
+                continue
+            # Crops of the same size replace each other, the latest record wins like in the GUI
+            boxes = {crop["size"]: crop["coords"] for crop in crops}
+            jobs.append((image_path, list(boxes.values())))
+    store.close()
 
-        # --- DIMENSION COUNTS PANEL ---
-        self.counts_frame = ctk.CTkFrame(self.right_frame)
-        self.counts_frame.pack(side=ctk.TOP, fill=ctk.BOTH, expand=True)
+    os.makedirs(args.output, exist_ok=True)
+    # Only the shards of an earlier run are replaced, other files are left alone
+    replaced = {name for name in existing if ShardWriter.is_shard_name(name)}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            shards = (json.loads(line).get("shard") for line in f if line.strip())
+            replaced.update(name for name in shards if isinstance(name, str) and ShardWriter.is_shard_name(name))
+    for name in replaced:
+        try:
+            os.remove(os.path.join(args.output, name))
+        except FileNotFoundError:
+            pass
 
-        self.counts_label = ctk.CTkLabel(self.counts_frame, text="Cropped Dimensions:\n\n", justify=ctk.LEFT, font=("Arial", 16))
-        self.counts_label.pack(padx=5, pady=20)
+    presets = [tuple(map(int, value.split("x"))) for _, value in DIMENSION_LABELS if value != "custom"]
+    max_bytes = args.shard_size * 1024 * 1024
+    writers = {}  # bucket -> ShardWriter
+    total = sum(len(boxes) for _, boxes in jobs)
+    print(f"Writing {total} crops from {len(jobs)} images as {encoder.describe()} into "
+          f"{'one sequence of' if args.no_buckets else 'aspect ratio bucketed'} shards of up to {args.shard_size} MB")
+    counts = defaultdict(int)
+    failed = written_bytes = 0
+    start = last_report = time.perf_counter()
+    with open(index_path + ".tmp", "w") as index, ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        def write(image_path, boxes, future):
+            nonlocal failed, written_bytes
+            try:
+                results = future.result()
+            except Exception as e:
+                print(f"Error rendering crops of {image_path}: {e}")
+                failed += len(boxes)
+                return
+            for box, data in zip(boxes, results):
+                width, height = box[2] - box[0], box[3] - box[1]
+                bucket = "shard" if args.no_buckets else "{}x{}".format(*crop_bucket(width, height, presets))
+                if bucket not in writers:
+                    writers[bucket] = ShardWriter(args.output, bucket, max_bytes)
+                key = f"{sum(counts.values()):08d}"
+                shard, offset = writers[bucket].add(f"{key}.{encoder.extension}", data)
+                index.write(json.dumps({"key": key, "shard": shard, "offset": offset, "size": len(data),
+                                        "width": width, "height": height, "bucket": bucket,
+                                        "source": image_path, "coords": list(box)}) + "\n")
+                counts[bucket] += 1
+                written_bytes += len(data)
 
-        # "Jump to Last Cropped" Button
-        jump_cropped_button = ctk.CTkButton(control_frame, text="Jump to Last Cropped (W)", command=self.jump_to_last_cropped)
-        jump_cropped_button.pack(side=ctk.LEFT, padx=5)
-        
-        self.rect = None
-        self.rect_coords = None
-        self.current_image = None
-        self.save_folder = None
-        self.custom_dim_text = None
-        self.image_on_canvas = None
+        # Results are written in submission order, with a bounded number of images in flight
+        pending = deque()
+        for image_path, boxes in jobs:
+            pending.append((image_path, boxes, executor.submit(render_crops, image_path, boxes, encoder)))
+            if len(pending) >= args.jobs * 4:
+                write(*pending.popleft())
+            now = time.perf_counter()
+            if now - last_report >= 1.0:
+                last_report = now
+                done = sum(counts.values()) + failed
+                print(f"[{done}/{total}] {done / (now - start):.1f} crops/s")
+        while pending:
+            write(*pending.popleft())
+        for writer in writers.values():
+            writer.close()
+    os.replace(index_path + ".tmp", index_path)
 
-        # Event bindings
-        self.canvas.bind("<Button-1>", self.on_mouse_down)
-        self.canvas.bind("<B1-Motion>", self.on_mouse_drag)
-        self.canvas.bind("<ButtonRelease-1>", self.on_mouse_up)
-        self.root.bind("o", lambda e: self.load_folder())
-        self.root.bind("a", lambda e: self.prev_image())
-        self.root.bind("d", lambda e: self.next_image())
-        self.root.bind("s", lambda e: self.quick_save())
-        self.root.bind("x", lambda e: self.delete_current_image())
-        self.root.bind("w", lambda e: self.jump_to_last_cropped())
-        self.root.bind("r", lambda e: self.resize_and_save_image())
+    elapsed = time.perf_counter() - start
+    written = sum(counts.values())
+    shards = sum(len(writer.shards) for writer in writers.values())
+    print(f"Done in {elapsed:.2f}s: {written} crops in {shards} shard(s), failed {failed}")
+    for bucket, count in sorted(counts.items()):
+        print(f"  {bucket}: {count} crops in {len(writers[bucket].shards)} shard(s)")
+    if written and elapsed > 0:
+        print(f"Throughput: {written / elapsed:.1f} crops/s, {written_bytes / elapsed / (1024 * 1024):.1f} MB/s written")
+    return 1 if failed else 0
 
-        # Load cropped info from file
-        self.load_cropped_info()
-        self.load_last_cropped_entries()  # Load all last cropped entries
 
-    # Mousewheel support
-    def _on_mousewheel(self, event):
-        # Windows, macOS
-        self.canvas.yview_scroll(int(-1*(event.delta/120)), "units")
+def service_crop(image_path, folder, size, coords, center, prefer, encoder):
+    """Process pool worker of the service: one crop, placed the way the GUI places it.
 
-    def _on_mousewheel_linux_up(self, event):
-        # Linux scroll up
-        self.canvas.yview_scroll(-1, "units")
+    coords crops exactly (like a custom crop). Otherwise size is a preset, or "auto" for the
+    largest preset that fits (preferring the orientation prefer, like the GUI on image load),
+    centered on center or, without it, at the suggested crop position.
+    """
+    image = decode_image(image_path)
+    width, height = image.size
+    if coords:
+        box = tuple(map(int, coords))
+        if not (0 <= box[0] < box[2] <= width and 0 <= box[1] < box[3] <= height):
+            raise ValueError(f"Crop {list(box)} is not inside the {width}x{height} image")
+    else:
+        if size in (None, "auto"):
+            size = choose_preset(width, height, prefer)
+            if size is None:
+                raise ValueError(f"No preset fits the {width}x{height} image")
+        crop_size = tuple(map(int, size.split("x")))
+        if crop_size[0] > width or crop_size[1] > height:
+            raise ValueError(f"{size} does not fit the {width}x{height} image")
+        if center:
+            box = preset_box_at(center[0], center[1], crop_size, image.size)
+        else:
+            box = tuple(suggest_crops(image, [(size, size)])[size])
+    size = f"{box[2] - box[0]}x{box[3] - box[1]}"
+    save_folder = output_folder(os.path.join(folder, "cropped"), folder, image_path)
+    os.makedirs(save_folder, exist_ok=True)
+    save_path = crop_save_path(save_folder, image_path, size, encoder.extension)
+    # Other tools may read the crop as soon as it appears
+    write_crop(image, box, save_path + ".tmp", encoder)
+    os.replace(save_path + ".tmp", save_path)
+    return {"size": size, "coords": list(box), "save_path": save_path}
 
-    def _on_mousewheel_linux_down(self, event):
-        # Linux scroll down
-        self.canvas.yview_scroll(1, "units")
 
-    def _bind_mousewheel(self):
-        self.canvas.bind_all("<MouseWheel>", self._on_mousewheel)
-        self.canvas.bind_all("<Shift-MouseWheel>", lambda e: self.canvas.xview_scroll(int(-1*(e.delta/120)), "units"))
-        self.canvas.bind_all("<Button-4>", self._on_mousewheel_linux_up)
-        self.canvas.bind_all("<Button-5>", self._on_mousewheel_linux_down)
-        # Horizontal scroll (Linux)
-        self.canvas.bind_all("<Shift-Button-4>", lambda e: self.canvas.xview_scroll(-1, "units"))
-        self.canvas.bind_all("<Shift-Button-5>", lambda e: self.canvas.xview_scroll(1, "units"))
+class ServiceBusy(Exception):
+    pass
 
-    def _unbind_mousewheel(self):
-        self.canvas.unbind_all("<MouseWheel>")
-        self.canvas.unbind_all("<Button-4>")
-        self.canvas.unbind_all("<Button-5>")
-        self.canvas.unbind_all("<Shift-Button-4>")
-        self.canvas.unbind_all("<Shift-Button-5>")
 
-    def update_size(self):
-        val = self.size_var.get()
-        if val == "custom":
-            self.custom_mode = True
-            self.clear_existing_rect()
-        else:
-            self.custom_mode = False
-            self.crop_size = tuple(map(int, val.split("x")))
-            self.clear_existing_rect()
+class CropService:
+    """Runs crop and resize jobs of other tools on a process pool, recorded in the crop store of the GUI.
 
-    def load_folder(self):
-        folder = filedialog.askdirectory()
-        if not folder:
+    The store, the analysis cache and all job state changes belong to one thread, fed by a
+    queue; request handler threads only submit batches and read job snapshots.
+    """
+
+    def __init__(self, store_path, cache_path, workers, max_queue=256, encoder=None, target=1024,
+                 resample="LANCZOS", prefer="portrait", history=10000):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.encoder = encoder or OutputEncoder()
+        self.target = target
+        self.resample = resample
+        self.prefer = prefer
+        self.history = history
+        self.jobs = {}  # job id -> job
+        self.batches = {}  # batch id -> job ids
+        self.counts = defaultdict(int)
+        self.latencies = deque(maxlen=500)  # ms from submission to completion
+        self.completions = deque()  # completion times of the last minute
+        self.started = time.time()
+        self._finished = deque()  # job ids, oldest first, forgotten beyond history
+        self._futures = {}  # job id -> future
+        self._cropping = defaultdict(int)  # (folder, image) -> crop jobs not recorded yet
+        self._next_id = 1
+        self._cond = threading.Condition()
+        self._events = queue.Queue()
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self._thread = threading.Thread(target=self._run, args=(store_path, cache_path), name="store", daemon=True)
+        self._thread.start()
+
+    def submit(self, specs):
+        """Queues a batch of job specs, returns (batch id, job ids). Raises ValueError or ServiceBusy."""
+        if not isinstance(specs, list) or not specs:
+            raise ValueError("Expected a non-empty list of jobs")
+        for spec in specs:
+            if not isinstance(spec, dict) or spec.get("type") not in ("crop", "resize") or not spec.get("image"):
+                raise ValueError(f"Invalid job {spec!r}: needs a type (crop or resize) and an image")
+        with self._cond:
+            if self.depth() + len(specs) > self.max_queue:
+                self.counts["rejected"] += len(specs)
+                raise ServiceBusy(f"Queue full ({self.depth()}/{self.max_queue} jobs)")
+            batch = self._next_id
+            ids = list(range(batch, batch + len(specs)))
+            self._next_id += len(specs)
+            for job_id, spec in zip(ids, specs):
+                image = os.path.abspath(spec["image"])
+                self.jobs[job_id] = {"id": job_id, "batch": batch, "type": spec["type"], "image": image,
+                                     "folder": os.path.abspath(spec.get("folder") or os.path.dirname(image)),
+                                     "spec": spec, "state": "queued", "error": None, "result": None,
+                                     "submitted": time.time(), "finished": None, "version": 0}
+            self.batches[batch] = ids
+            self.counts["submitted"] += len(specs)
+        self._events.put(("submit", ids))
+        return batch, ids
+
+    def depth(self):
+        return self.counts["submitted"] - self.counts["done"] - self.counts["failed"]
+
+    def _run(self, store_path, cache_path):
+        store = open_crop_store(store_path)
+        cache = AnalysisCache(cache_path)
+        try:
+            while True:
+                event = self._events.get()
+                if event[0] == "stop":
+                    return
+                if event[0] == "submit":
+                    for job_id in event[1]:
+                        self._start(job_id, store)
+                else:
+                    self._finish(event[1], event[2], store, cache)
+        finally:
+            store.close()
+            cache.close()
+
+    def _start(self, job_id, store):
+        job = self.jobs[job_id]
+        spec = job["spec"]
+        try:
+            if job["type"] == "crop":
+                future = self._pool.submit(service_crop, job["image"], job["folder"], spec.get("size"),
+                                           spec.get("coords"), spec.get("center"), spec.get("prefer", self.prefer),
+                                           self.encoder)
+                self._cropping[job["folder"], job["image"]] += 1
+            else:
+                # Like Resize (R) in the GUI: cropped images keep their size, the original goes to originals/
+                if self._cropping.get((job["folder"], job["image"])) or store.has_crops(job["folder"], job["image"]):
+                    raise ValueError("Cannot resize: Image has already been cropped.")
+                originals = output_folder(os.path.join(job["folder"], "originals"), job["folder"], job["image"])
+                future = self._pool.submit(downscale_file, job["image"], originals, spec.get("target", self.target),
+                                           spec.get("filter", self.resample))
+        except Exception as e:
+            self._update(job, "failed", error=str(e))
             return
+        self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._events.put(("done", job_id, f)))
 
-        self.images = [os.path.abspath(os.path.join(folder, f)) for f in os.listdir(folder)
-                      if f.lower().endswith(('png', 'jpg', 'jpeg', 'bmp'))]
-        self.images.sort()
-        if not self.images:
+    def _finish(self, job_id, future, store, cache):
+        job = self.jobs[job_id]
+        self._futures.pop(job_id, None)
+        if job["type"] == "crop":
+            key = job["folder"], job["image"]
+            self._cropping[key] -= 1
+            if not self._cropping[key]:
+                del self._cropping[key]
+        error = future.exception()
+        if error is not None:
+            self._update(job, "failed", error=str(error))
+            return
+        result = future.result()
+        try:
+            if job["type"] == "crop":
+                entry = {"size": result["size"], "coords": result["coords"], "image_path": job["image"],
+                         "folder": job["folder"]}
+                store.add_crops([(job["folder"], job["image"], result["size"], result["coords"])],
+                                last_cropped=(job["folder"], entry))
+            elif result is not None:
+                cache.store_index(job["folder"], [result])
+                result = {"width": result["width"], "height": result["height"]}
+            else:
+                result = {"skipped": f"Not larger than {job['spec'].get('target', self.target)} px"}
+        except Exception as e:
+            self._update(job, "failed", error=f"Cannot record result: {e}")
             return
+        self._update(job, "done", result=result)
 
-        self.current_index = 0
-        self.save_folder = os.path.join(folder, "cropped")
-        self.originals_folder = os.path.join(folder, "originals")
+    def _update(self, job, state, error=None, result=None):
+        with self._cond:
+            job.update(state=state, error=error, result=result, finished=time.time(), version=job["version"] + 1)
+            self.counts[state] += 1
+            self.latencies.append((job["finished"] - job["submitted"]) * 1000)
+            self.completions.append(job["finished"])
+            self._finished.append(job["id"])
+            while len(self._finished) > self.history:
+                old = self.jobs.pop(self._finished.popleft(), None)
+                # Other jobs of the batch may still be queued or running, the batch goes with its last job
+                if old is not None and not any(job_id in self.jobs for job_id in self.batches.get(old["batch"], ())):
+                    self.batches.pop(old["batch"], None)
+            self._cond.notify_all()
 
-        os.makedirs(self.save_folder, exist_ok=True)
-        self.current_folder = folder
+    def snapshot(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        state = job["state"]
+        future = self._futures.get(job_id)
+        if state == "queued" and future is not None and future.running():
+            state = "running"
+        return {"id": job["id"], "batch": job["batch"], "type": job["type"], "image": job["image"], "state": state,
+                "error": job["error"], "result": job["result"]}
 
-        self.load_current_image()
-        self.update_dimension_counts()
-        self.jump_to_last_cropped()
-        self.next_button.configure(state=ctk.NORMAL)
-        self.prev_button.configure(state=ctk.NORMAL)
+    def batch(self, batch_id):
+        with self._cond:
+            ids = self.batches.get(batch_id)
+            return None if ids is None else [self.snapshot(job_id) or {"id": job_id, "state": "expired"} for job_id in ids]
 
-        # Make the right panel visible
-        self.right_frame.pack(side=ctk.RIGHT, fill=ctk.Y)
+    def wait_batch(self, batch_id, versions, timeout=30.0):
+        """Blocks until a job of the batch changed since versions (job id -> version, updated in place).
 
-    def load_current_image(self):
-        if not self.images:
-            self.canvas.delete("all")
-            self.root.title("Power Cropper")
-            self.current_image = None
-            self.clear_existing_rect()
-            self.dim_label.configure(text="")
-            self.cropped_label.configure(text="")
-            self.right_frame.pack_forget()
+        Returns the changed job snapshots and whether the whole batch is finished.
+        """
+        ids = self.batches.get(batch_id, [])
+
+        def changed():
+            return [i for i in ids if i in self.jobs and self.jobs[i]["version"] != versions.get(i)]
+
+        with self._cond:
+            self._cond.wait_for(changed, timeout)
+            result = []
+            for job_id in changed():
+                versions[job_id] = self.jobs[job_id]["version"]
+                result.append(self.snapshot(job_id))
+            finished = all(self.jobs.get(i, {"state": "done"})["state"] != "queued" for i in ids)
+        return result, finished
+
+    def metrics(self):
+        now = time.time()
+        with self._cond:
+            while self.completions and self.completions[0] < now - 60:
+                self.completions.popleft()
+            latencies = list(self.latencies)
+            running = sum(1 for future in list(self._futures.values()) if future.running())
+            return {"queue_depth": self.depth(), "running": running, "workers": self.workers,
+                    "max_queue": self.max_queue, "submitted": self.counts["submitted"], "done": self.counts["done"],
+                    "failed": self.counts["failed"], "rejected": self.counts["rejected"],
+                    "jobs_per_s_1m": len(self.completions) / min(60.0, max(1.0, now - self.started)),
+                    "latency_ms_p50": percentile(latencies, 50), "latency_ms_p95": percentile(latencies, 95),
+                    "uptime_s": now - self.started}
+
+    def shutdown(self):
+        # Running and queued jobs are finished and recorded first
+        self._pool.shutdown(wait=True)
+        self._events.put(("stop",))
+        self._thread.join()
+
+
+class ServiceRequests:
+    """HTTP API of CropService (self.server.service), see the README.
+
+    Mixed into http.server.BaseHTTPRequestHandler by serve_command, which imports http.server.
+    """
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            return self._send_json(404, {"error": "Not found"})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+            batch, ids = self.server.service.submit(body.get("jobs") if isinstance(body, dict) else body)
+        except (ValueError, AttributeError) as e:
+            return self._send_json(400, {"error": str(e)})
+        except ServiceBusy as e:
+            return self._send_json(503, {"error": str(e)}, {"Retry-After": "1"})
+        self._send_json(202, {"batch": batch, "jobs": ids, "status": f"/batches/{batch}",
+                              "events": f"/batches/{batch}/events"})
+
+    def do_GET(self):
+        service = self.server.service
+        parts = self.path.strip("/").split("/")
+        if parts == ["metrics"]:
+            return self._send_json(200, service.metrics())
+        if len(parts) >= 2 and parts[1].isdigit():
+            item = int(parts[1])
+            if parts[0] == "jobs" and len(parts) == 2:
+                job = service.snapshot(item)
+                return self._send_json(200, job) if job else self._send_json(404, {"error": "Unknown job"})
+            if parts[0] == "batches" and len(parts) == 2:
+                jobs = service.batch(item)
+                return self._send_json(200, {"batch": item, "jobs": jobs}) if jobs is not None else \
+                    self._send_json(404, {"error": "Unknown batch"})
+            if parts[0] == "batches" and parts[2:] == ["events"] and item in service.batches:
+                return self._stream_batch(item)
+        self._send_json(404, {"error": "Not found"})
+
+    def _stream_batch(self, batch_id):
+        # One JSON line per job state change until every job of the batch is finished
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        versions = {}
+        try:
+            while True:
+                changed, finished = self.server.service.wait_batch(batch_id, versions)
+                for job in changed:
+                    self.wfile.write(json.dumps(job).encode() + b"\n")
+                self.wfile.flush()
+                if finished:
+                    return
+        except (BrokenPipeError, ConnectionResetError):
             return
 
-        self.current_image = Image.open(self.images[self.current_index])
-        self.tk_img = ImageTk.PhotoImage(self.current_image)
-        self.canvas.delete("all")
-        self.image_on_canvas = self.canvas.create_image(0, 0, anchor=ctk.NW, image=self.tk_img)
-        # Set scroll region to image size
-        w, h = self.current_image.size
-        self.canvas.configure(scrollregion=(0, 0, w, h))
-        index_text = f"({self.current_index + 1}/{len(self.images)})"
-        self.dim_label.configure(text=f"Image size: {w} x {h} px  {index_text}")
-        self.root.title(f"{os.path.basename(self.images[self.current_index])}")
-        self.clear_existing_rect()
-        self.update_radio_button_highlights(w, h)
-        self.set_largest_radio_button(w, h)
-        self.draw_previous_crops()
-        self.update_cropped_label()
-        self.save_button.configure(state=ctk.DISABLED)
-        self.delete_button.configure(state=ctk.NORMAL)
-        
-        if self.can_resize() is True:
-            self.resize_button.configure(state=ctk.NORMAL)
+    def _send_json(self, code, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "local"
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_command(args):
+    import http.server
+    import socketserver
+
+    class ServiceHandler(ServiceRequests, http.server.BaseHTTPRequestHandler):
+        pass
+
+    class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    if not check_crop_store(args.store):
+        return 1
+    service = CropService(args.store, args.cache, args.workers, args.max_queue, encoder_from_args(args),
+                          args.target, args.filter, args.prefer)
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixHTTPServer(args.socket, ServiceHandler)
+        where = args.socket
+    else:
+        server = http.server.ThreadingHTTPServer((args.host, args.port), ServiceHandler)
+        where = f"http://{args.host}:{server.server_address[1]}"
+    server.service = service
+    # Stopped by a service manager like Ctrl+C: finish the accepted jobs, then exit
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    print(f"Serving crop jobs on {where} with {args.workers} workers, queue limit {args.max_queue}. Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+        print("Finishing queued jobs...")
+        service.shutdown()
+    return 0
+
+
+def list_images(folder, recursive=False):
+    return indexed_images(index_directories(folder, recursive=recursive))
+
+
+def folder_fingerprint(folder, recursive=False):
+    """Identifies the images of a folder by their relative names and sizes, not by path or mtime,
+    so a copy of the folder has the same fingerprint."""
+    digest = hashlib.blake2b(digest_size=16)
+    count = total = 0
+    for path in sorted(list_images(folder, recursive)):
+        size = os.path.getsize(path)
+        digest.update(f"{os.path.relpath(path, folder)}:{size}\n".encode())
+        count += 1
+        total += size
+    return {"images": count, "bytes": total, "hash": digest.hexdigest()}
+
+
+def resize_all_command(args):
+    folder = os.path.abspath(args.folder)
+    store = open_crop_store(args.store)
+    cropped = store.load_folder(folder)
+    store.close()
+    paths = [path for path in list_images(folder, args.recursive) if path not in cropped]
+    print(f"Resizing up to {len(paths)} uncropped images in {folder} to max {args.target}px ({args.filter}, {args.jobs} jobs)")
+    batch = BatchResize(paths, os.path.join(folder, "originals"), args.target, args.filter, args.jobs, folder=folder)
+    cache = AnalysisCache(args.cache)
+    last_report = time.perf_counter()
+    try:
+        while not batch.finished:
+            time.sleep(0.1)
+            rows = []
+            for path, row, error in batch.poll():
+                if error is not None:
+                    print(f"Error resizing {path}: {error}")
+                elif row is not None:
+                    rows.append(row)
+            if rows:
+                cache.store_index(folder, rows)
+            if time.perf_counter() - last_report >= 1.0 or batch.finished:
+                last_report = time.perf_counter()
+                print(f"[{batch.completed}/{batch.total}] resized {batch.resized}, skipped {batch.skipped}, "
+                      f"failed {batch.failed}  {batch.rate():.1f} images/s")
+    except KeyboardInterrupt:
+        print("Cancelling, waiting for the images in progress...")
+        batch.cancel()
+    cache.close()
+    return 1 if batch.failed else 0
+
+
+def bench_decode_command(args):
+    import numpy as np
+    import tempfile
+    paths = []
+    for path in args.images:
+        if os.path.isdir(path):
+            paths += sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(('jpg', 'jpeg')))
         else:
-            self.resize_button.configure(state=ctk.DISABLED)
+            paths.append(path)
+    tmp_dir = None
+    if not paths:
+        # Synthetic large JPEGs: smooth gradients plus noise, roughly like photos
+        tmp_dir = tempfile.TemporaryDirectory()
+        w, h = args.size
+        rng = np.random.default_rng(0)
+        for i in range(args.count):
+            gradient = np.linspace(0, 255, w, dtype=np.float32)[None, :, None] * np.ones((h, 1, 3), np.float32)
+            pixels = np.clip(gradient + rng.normal(0, 3, (h, w, 3)), 0, 255).astype(np.uint8)
+            path = os.path.join(tmp_dir.name, f"bench_{i}.jpg")
+            Image.fromarray(pixels).save(path, quality=92)
+            paths.append(path)
+
+    screen_w, screen_h = args.screen
+    fit = lambda size: min(1.0, screen_w / size[0], screen_h / size[1])
+    modes = {
+        "full": lambda path: decode_for_display(path),
+        "preview": lambda path: decode_for_display(path, fit),
+    }
+    results = {}
+    for name, decode in modes.items():
+        times = []
+        for _ in range(args.repeat):
+            for path in paths:
+                start = time.perf_counter()
+                decoded = decode(path)
+                # First pixel on screen needs the display-sized image
+                ImagePyramid(decoded.display_image()).for_zoom(fit(decoded.size) * decoded.size[0] / decoded.display_image().width)
+                times.append((time.perf_counter() - start) * 1000)
+        results[name] = times
+        print(f"{name:8s} time to first pixel: mean {sum(times) / len(times):7.1f} ms  "
+              f"p50 {percentile(times, 50):7.1f} ms  p95 {percentile(times, 95):7.1f} ms  ({len(times)} decodes)")
+    speedup = percentile(results["full"], 50) / max(1e-9, percentile(results["preview"], 50))
+    print(f"Preview decode is {speedup:.1f}x faster (median) for a {screen_w}x{screen_h} screen")
+    if tmp_dir:
+        tmp_dir.cleanup()
+    return 0
+
+
+def bench_encode_command(args):
+    paths = []
+    for path in args.images:
+        if os.path.isdir(path):
+            paths += list_images(path)
+        else:
+            paths.append(path)
+    if not paths:
+        print("No images found")
+        return 1
+    step = max(1, len(paths) // args.count)
+    sample = paths[::step][:args.count]
+    print(f"Encoding a {args.crop[0]}x{args.crop[1]} center crop of {len(sample)} images, {args.repeat} time(s) each")
+    print(format_encoder_benchmark(benchmark_encoders(sample, BENCHMARK_ENCODERS, tuple(args.crop), args.repeat)))
+    return 0
+
+
+def add_encoder_arguments(parser):
+    parser.add_argument("--format", choices=("png", "webp-lossless", "webp", "jpeg"), default="png")
+    parser.add_argument("--compress-level", type=int, default=6, choices=range(10), metavar="0-9",
+                        help="PNG zlib level, lower is faster")
+    parser.add_argument("--optimize", action="store_true", help="Extra PNG/JPEG optimization pass")
+    parser.add_argument("--quality", type=int, default=90, help="JPEG and lossy WEBP quality")
+    parser.add_argument("--no-icc", action="store_true", help="Drop the ICC profile of the source")
+    parser.add_argument("--keep-exif", action="store_true", help="Copy the EXIF data of the source")
+
+
+def encoder_from_args(args):
+    formats = {"png": "PNG", "webp-lossless": "WEBP lossless", "webp": "WEBP", "jpeg": "JPEG"}
+    return OutputEncoder(formats[args.format], compress_level=args.compress_level, optimize=args.optimize,
+                         quality=args.quality, keep_icc=not args.no_icc, keep_exif=args.keep_exif)
+
+
+# --- BENCHMARK ---
+
+class HeadlessWidget:
+    """Stands in for any Tk/customtkinter widget when benchmarking without a display; accepts every call."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return self._ignore
+
+    def _ignore(self, *args, **kwargs):
+        return None
+
+
+class HeadlessCanvas(HeadlessWidget):
+    size = (1600, 900)
+
+    def __init__(self, *args, **kwargs):
+        self.items = {}  # item id -> tags
+        self._next_id = 1
+
+    def _create(self, *args, tags=(), **kwargs):
+        item = self._next_id
+        self._next_id += 1
+        self.items[item] = (tags,) if isinstance(tags, str) else tuple(tags)
+        return item
+
+    create_image = create_rectangle = create_text = _create
+
+    def delete(self, *items):
+        for item in items:
+            if item == "all":
+                self.items.clear()
+            elif isinstance(item, int):
+                self.items.pop(item, None)
+            else:
+                self.items = {i: tags for i, tags in self.items.items() if item not in tags}
+
+    def winfo_width(self):
+        return self.size[0]
+
+    def winfo_height(self):
+        return self.size[1]
+
+    def canvasx(self, x):
+        return float(x)
+
+    def canvasy(self, y):
+        return float(y)
+
+
+class HeadlessVar:
+    def __init__(self, master=None, value=None, **kwargs):
+        self._value = value
+        self._traces = []
+
+    def get(self):
+        return self._value
+
+    def set(self, value):
+        self._value = value
+        for callback in self._traces:
+            callback("", "", "write")
+
+    def trace_add(self, mode, callback):
+        self._traces.append(callback)
+
+
+class HeadlessRoot(HeadlessWidget):
+    """Runs after() callbacks when update() is called, like the Tk event loop."""
+
+    def __init__(self, *args, **kwargs):
+        self.tk = HeadlessWidget()
+        self._timers = []  # heap of (due, seq, callback, args)
+        self._seq = 0
+
+    def after(self, ms, callback=None, *args):
+        self._seq += 1
+        heapq.heappush(self._timers, (time.perf_counter() + ms / 1000, self._seq, callback, args))
+        return self._seq
+
+    def after_idle(self, callback, *args):
+        return self.after(0, callback, *args)
+
+    def update(self):
+        now = time.perf_counter()
+        while self._timers and self._timers[0][0] <= now:
+            _, _, callback, args = heapq.heappop(self._timers)
+            callback(*args)
+
+
+class HeadlessToolkit:
+    """Replaces the customtkinter module for the benchmark."""
+    BOTH, X, Y, TOP, BOTTOM, LEFT, RIGHT = "both", "x", "y", "top", "bottom", "left", "right"
+    HORIZONTAL, VERTICAL, NORMAL, DISABLED = "horizontal", "vertical", "normal", "disabled"
+    CTk = HeadlessRoot
+    CTkCanvas = HeadlessCanvas
+    CTkButton = CTkCheckBox = CTkEntry = CTkFrame = CTkLabel = CTkOptionMenu = HeadlessWidget
+    CTkProgressBar = CTkRadioButton = CTkScrollbar = CTkTextbox = CTkToplevel = HeadlessWidget
+    CTkScrollableFrame = CTkImage = HeadlessWidget
+    StringVar = BooleanVar = HeadlessVar
+
+    @staticmethod
+    def set_default_color_theme(name):
+        pass
+
+
+class HeadlessImageTk:
+    PhotoImage = HeadlessWidget
+
 
-    def clear_existing_rect(self):
-        if self.rect:
-            self.canvas.delete(self.rect)
-        self.rect = None
-        self.rect_coords = None
-        if self.custom_dim_text:
-            self.canvas.delete(self.custom_dim_text)
-            self.custom_dim_text = None
-        self.canvas.delete("previous_crop")
-        self.save_button.configure(state=ctk.DISABLED)
+class BenchDialogs:
+    """Answers the file dialog with the benchmark folder and collects message boxes instead of showing them."""
 
-    def on_mouse_down(self, event):
-        x = self.canvas.canvasx(event.x)
-        y = self.canvas.canvasy(event.y)
-        if self.custom_mode:
-            self.clear_existing_rect()
-            self.custom_start = (x, y)
-            self.rect = self.canvas.create_rectangle(x, y, x, y, outline='red', width=2)
-        else:
-            self.place_rectangle(event)
+    def __init__(self):
+        self.folder = None
+        self.messages = []
 
-    def on_mouse_drag(self, event):
-        x = self.canvas.canvasx(event.x)
-        y = self.canvas.canvasy(event.y)
-        if self.custom_mode:
-            x0, y0 = self.custom_start
-            x1, y1 = x, y
-            self.canvas.coords(self.rect, x0, y0, x1, y1)
-            # Calculate dimensions
-            width = abs(x1 - x0)
-            height = abs(y1 - y0)
-            dim_text = f"{width} x {height}"
-            # Show or move the dimension text near the mouse
-            if self.custom_dim_text:
-                self.canvas.coords(self.custom_dim_text, x + 15, y + 15)
-                self.canvas.itemconfig(self.custom_dim_text, text=dim_text, fill="yellow")
-            else:
-                self.custom_dim_text = self.canvas.create_text(
-                    x + 15, y + 15, text=dim_text,
-                    fill="yellow", font=("Arial", 12, "bold"), anchor="nw"
-                )
+    def askdirectory(self, **kwargs):
+        return self.folder
 
-    def on_mouse_up(self, event):
-        x = self.canvas.canvasx(event.x)
-        y = self.canvas.canvasy(event.y)
-        if self.custom_mode and self.rect and self.custom_start:
-            x0, y0 = self.custom_start
-            x1, y1 = x, y
-            # Ensure coordinates are within image bounds
-            x0, x1 = max(0, min(x0, self.current_image.width)), max(0, min(x1, self.current_image.width))
-            y0, y1 = max(0, min(y0, self.current_image.height)), max(0, min(y1, self.current_image.height))
-            left, right = sorted([x0, x1])
-            top, bottom = sorted([y0, y1])
-            self.rect_coords = (left, top, right, bottom)
-            self.save_custom_crop()
-            self.custom_start = None
-            # Remove the dimension text
-            if self.custom_dim_text:
-                self.canvas.delete(self.custom_dim_text)
-                self.custom_dim_text = None
+    def showerror(self, title, message, **kwargs):
+        self.messages.append(message)
 
-    def place_rectangle(self, event):
-        if not self.current_image:
-            return
+    showinfo = showerror
 
-        x = self.canvas.canvasx(event.x)
-        y = self.canvas.canvasy(event.y)
-        self.clear_existing_rect()
-        x0 = x - self.crop_size[0]//2
-        y0 = y - self.crop_size[1]//2
-        x0 = max(0, min(x0, self.current_image.width - self.crop_size[0]))
-        y0 = max(0, min(y0, self.current_image.height - self.crop_size[1]))
-        x1 = x0 + self.crop_size[0]
-        y1 = y0 + self.crop_size[1]
-        self.rect = self.canvas.create_rectangle(
-            x0, y0, x1, y1,
-            outline='red', width=2)
-        self.rect_coords = (x0, y0, x1, y1)
-        self.save_button.configure(state=ctk.NORMAL)
+    def askyesno(self, title, message, **kwargs):
+        return True
 
-    def quick_save(self):
-        if not self.rect_coords or not self.save_folder:
-            return
-        x0, y0, x1, y1 = map(int, self.rect_coords)
-        crop = self.current_image.crop((x0, y0, x1, y1))
-        image_path = self.images[self.current_index]
-        base_name = os.path.splitext(os.path.basename(image_path))[0]
-        crop_size_str = f"{x1-x0}x{y1-y0}"
-        save_path = os.path.join(self.save_folder, f"{base_name}_cropped_{crop_size_str}.png")
-        crop.save(save_path)
-        entry = {"size": crop_size_str, "coords": (x0, y0, x1, y1), "image_path": image_path, "folder": self.current_folder}
-        self.save_cropped_info(image_path, crop_size_str, (x0, y0, x1, y1))
-        self.last_cropped_entry[self.current_folder] = entry  # Store by folder
-        self.save_last_cropped_entries()
-        self.update_dimension_counts()
-        self.next_image()
 
-    def save_custom_crop(self):
-        if not self.rect_coords or not self.save_folder:
-            return
-        x0, y0, x1, y1 = map(int, self.rect_coords)
-        if x1 - x0 < 2 or y1 - y0 < 2:
-            return
-        crop = self.current_image.crop((x0, y0, x1, y1))
-        image_path = self.images[self.current_index]
-        base_name = os.path.splitext(os.path.basename(image_path))[0]
-        crop_size_str = f"{x1-x0}x{y1-y0}"
-        save_path = os.path.join(self.save_folder, f"{base_name}_cropped_{crop_size_str}.png")
-        crop.save(save_path)
-        entry = {"size": crop_size_str, "coords": (x0, y0, x1, y1), "image_path": image_path, "folder": self.current_folder}
-        self.save_cropped_info(image_path, crop_size_str, (x0, y0, x1, y1))
-        self.last_cropped_entry[self.current_folder] = entry  # Store by folder
-        self.save_last_cropped_entries()
-        self.update_dimension_counts()
-        self.next_image()
+BENCH_SCENARIOS = {
+    # count, base image size (varied per image), format, fraction of images with a crop history
+    "photos": {"count": 200, "size": (3000, 2000), "format": "jpg", "cropped": 0.3},
+    "png": {"count": 60, "size": (2048, 1536), "format": "png", "cropped": 0.3},
+    "large": {"count": 8, "size": (8000, 6000), "format": "jpg", "cropped": 0.0},
+    "many": {"count": 20000, "size": (320, 240), "format": "jpg", "cropped": 0.5},
+}
 
-    def next_image(self):
-        if not self.images:
-            return
-        self.current_index = (self.current_index + 1) % len(self.images)
-        self.load_current_image()
+BENCH_OPERATIONS = ["load_folder", "folder_ready", "next_image", "load_current_image", "quick_save", "flush_saves",
+                    "save_cropped_info", "update_dimension_counts", "draw_previous_crops", "resize_and_save_image"]
 
-    def prev_image(self):
-        if not self.images:
-            return
-        self.current_index = (self.current_index - 1) % len(self.images)
-        self.load_current_image()
 
-    def delete_current_image(self):
-        if not self.images:
-            return
+def bench_image_size(index, base_size, seed):
+    import numpy as np
+    rng = np.random.default_rng((seed, index))
+    w, h = (int(s * rng.uniform(0.75, 1.0)) for s in base_size)
+    # Every third image is portrait
+    return (h, w) if index % 3 == 2 else (w, h)
 
-        image_path = self.images[self.current_index]
-        self.remove_cropped_info(image_path)
 
-        # Remove the physical file
-        try:
-            os.remove(image_path)
-        except OSError as e:
-            print(f"Error deleting {image_path}: {e}")
+def write_bench_image(path, size, seed):
+    """Process pool worker: smooth gradients plus noise, roughly like a photo, reproducible per seed."""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    w, h = size
+    x = np.linspace(0, 1, w, dtype=np.float32)[None, :]
+    y = np.linspace(0, 1, h, dtype=np.float32)[:, None]
+    channels = [np.broadcast_to(255 * (a * x + (1 - a) * y), (h, w)) for a in rng.uniform(0, 1, 3)]
+    # Coarse random structure, so that images are not near-duplicates of each other
+    blobs = Image.fromarray(rng.uniform(0, 255, (6, 8)).astype(np.uint8)).resize((w, h), Image.BICUBIC)
+    pixels = (0.6 * np.stack(channels, axis=-1) + 0.4 * np.asarray(blobs, dtype=np.float32)[:, :, None]
+              + rng.normal(0, 3, (h, w, 3)).astype(np.float32))
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(path, quality=92)
 
-        # Remove from the list and adjust index
-        del self.images[self.current_index]
-        if not self.images:
-            self.canvas.delete("all")
-            self.images = []
-            self.current_image = None
-            self.clear_existing_rect()
-            self.dim_label.config(text="")
-            self.cropped_label.config(text="")
-            self.right_frame.pack_forget()
-            return
 
-        self.current_index = min(self.current_index, len(self.images) - 1)
-        self.load_current_image()
+def make_bench_folder(data_dir, name, params, seed):
+    """Generates the images of a scenario once; later runs reuse them."""
+    w, h = params["size"]
+    folder = os.path.join(data_dir, f"{name}_{params['count']}_{w}x{h}_{params['format']}_seed{seed}_v2")
+    marker = os.path.join(folder, ".complete")
+    if os.path.exists(marker):
+        return folder
+    os.makedirs(folder, exist_ok=True)
+    print(f"Generating {params['count']} {params['format']} images in {folder}")
+    jobs = [(os.path.join(folder, f"img_{i:06d}.{params['format']}"), bench_image_size(i, params["size"], seed), seed * 1000003 + i)
+            for i in range(params["count"])]
+    with ProcessPoolExecutor() as executor:
+        list(executor.map(write_bench_image, *zip(*jobs), chunksize=max(1, len(jobs) // 64)))
+    open(marker, 'w').close()
+    return folder
 
-    def save_current_crop(self):
-        if self.current_image and self.rect_coords:
-            x0, y0, x1, y1 = map(int, self.rect_coords)
-            crop_size_str = f"{x1-x0}x{y1-y0}"
-            image_path = self.images[self.current_index]
-            self.save_cropped_info(image_path, crop_size_str, (x0, y0, x1, y1))
-            self.update_dimension_counts()
 
-    def load_cropped_info(self):
-        try:
-            with open(self.cropped_info_file, 'r') as f:
-                self.cropped_info = json.load(f)
-        except FileNotFoundError:
-            self.cropped_info = {"data": {}}
-        except json.JSONDecodeError:
-            self.cropped_info = {"data": {}}
+def link_bench_folder(source, folder):
+    """Hard links the generated images into a scratch folder; files the benchmark changes are replaced, not modified."""
+    os.makedirs(folder)
+    for name in os.listdir(source):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            try:
+                os.link(os.path.join(source, name), os.path.join(folder, name))
+            except OSError:
+                shutil.copy2(os.path.join(source, name), os.path.join(folder, name))
 
-    def save_cropped_info(self, image_path, size, coords):
-        folder = self.current_folder
 
-        if folder not in self.cropped_info["data"]:
-            self.cropped_info["data"][folder] = {}
+def seed_crop_history(store, folder, fraction, seed):
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    presets = [tuple(map(int, value.split('x'))) for _, value in DIMENSION_LABELS if value != "custom"]
+    last = None
+    for path in list_images(folder):
+        if rng.uniform() >= fraction:
+            continue
+        header = read_image_header(path)
+        width, height = header["width"], header["height"]
+        for _ in range(rng.integers(1, 4)):
+            cw, ch = presets[rng.integers(len(presets))]
+            cw, ch = min(cw, width), min(ch, height)
+            x0, y0 = int(rng.integers(0, width - cw + 1)), int(rng.integers(0, height - ch + 1))
+            store.add_crop(folder, path, f"{cw}x{ch}", [x0, y0, x0 + cw, y0 + ch])
+            last = {"size": f"{cw}x{ch}", "coords": [x0, y0, x0 + cw, y0 + ch], "image_path": path, "folder": folder}
+    if last:
+        store.set_last_cropped(folder, last)
 
-        if image_path not in self.cropped_info["data"][folder]:
-            self.cropped_info["data"][folder][image_path] = []
 
-        exists = any(crop["size"] == size and crop["coords"] == coords for crop in self.cropped_info["data"][folder][image_path])
-        if not exists:
-            self.cropped_info["data"][folder][image_path].append({"size": size, "coords": coords})
-            self.save_cropped_info_to_file()
+def pump_until(root, condition, timeout=120.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise RuntimeError("Benchmark timed out waiting for the application")
+        root.update()
+        time.sleep(0.001)
 
-    def remove_cropped_info(self, image_path):
-        folder = self.current_folder
-        if folder in self.cropped_info["data"] and image_path in self.cropped_info["data"][folder]:
-            del self.cropped_info["data"][folder][image_path]
-            if not self.cropped_info["data"][folder]:
-                del self.cropped_info["data"][folder]
-            self.save_cropped_info_to_file()
-            self.update_dimension_counts()
 
-    def save_cropped_info_to_file(self):
-        try:
-            with open(self.cropped_info_file, 'w') as f:
-                json.dump(self.cropped_info, f, indent=2)
-        except Exception as e:
-            print(f"Error saving cropped info: {e}")
+def pump(root, seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        root.update()
+        time.sleep(0.001)
 
-    def update_dimension_counts(self):
-        self.dimension_counts.clear()
-        folder = self.current_folder
-        if folder and folder in self.cropped_info["data"]:
-            for image_path, crops in self.cropped_info["data"][folder].items():
-                for crop in crops:
-                    self.dimension_counts[crop["size"]] += 1
-        self.update_counts_label()
 
-    def update_counts_label(self):
-        text = "Cropped Dimensions:\n\n"
-        for dim, count in sorted(self.dimension_counts.items()):
-            text += f"{dim}: {count}\n"
-        self.counts_label.configure(text=text)
+def timed(samples, name, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    samples[name].append((time.perf_counter() - start) * 1000)
+    return result
 
-    def draw_previous_crops(self):
-        if not self.current_image:
-            return
-        image_path = self.images[self.current_index]
-        folder = self.current_folder
-        self.tk_images = []
-        if folder in self.cropped_info["data"] and image_path in self.cropped_info["data"][folder]:
-            for crop in self.cropped_info["data"][folder][image_path]:
-                x0, y0, x1, y1 = crop["coords"]
-                self.canvas.create_rectangle(x0, y0, x1, y1, outline="yellow", width=1, tags="previous_crop")
 
-                width = x1 - x0
-                height = y1 - y0
-                img = Image.new('RGBA', (width, height), (0, 255, 0, 10))  # semi-transparent red
-                tk_img = ImageTk.PhotoImage(img)
-                self.tk_images.append(tk_img)
-                self.canvas.create_image(x0, y0, image=tk_img, anchor='nw')
+def bench_scenario(name, params, args):
+    """Drives a PowerCropper instance through the core workflows and returns the latencies in ms per operation."""
+    import tempfile
+    from types import SimpleNamespace
+    global ctk, ImageTk, messagebox, filedialog
+    if args.tk:
+        import_gui()
+    source = make_bench_folder(os.path.abspath(args.data), name, params, args.seed)
+    scratch = tempfile.TemporaryDirectory(prefix="power-cropper-bench-")
+    folder = os.path.join(scratch.name, name)
+    link_bench_folder(source, folder)
+    saved_toolkit = ctk, ImageTk, messagebox, filedialog
+    cwd = os.getcwd()
+    # The application keeps its stores in the working directory
+    os.chdir(scratch.name)
+    try:
+        store = SqliteCropStore("cropped_info.db")
+        seed_crop_history(store, folder, params["cropped"], args.seed)
+        store.close()
 
-    def update_cropped_label(self):
-        if not self.images:
-            return
+        dialogs = BenchDialogs()
+        dialogs.folder = folder
+        messagebox = filedialog = dialogs
+        if not args.tk:
+            ctk, ImageTk = HeadlessToolkit, HeadlessImageTk
+            HeadlessCanvas.size = tuple(args.screen)
+        root = ctk.CTk()
+        if args.tk:
+            root.withdraw()
+        app = PowerCropper(root)
+        app.on_canvas_configure(SimpleNamespace(width=args.screen[0], height=args.screen[1]))
+        samples = defaultdict(list)
+        think = args.think_ms / 1000
+        instrumentation.reset()
+        instrumentation.enabled = True
 
-        image_path = self.images[self.current_index]
-        folder = self.current_folder
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            app.load_folder()
+            pump_until(root, lambda: app.current_image is not None and app.current_folder == folder)
+            samples["load_folder"].append((time.perf_counter() - start) * 1000)
+            pump_until(root, lambda: len(app.folder_images) == params["count"] and not app.index_analyzer.active())
+            samples["folder_ready"].append((time.perf_counter() - start) * 1000)
+            pump(root, think)
 
-        if folder in self.cropped_info["data"] and image_path in self.cropped_info["data"][folder]:
-            cropped_dims = [crop["size"] for crop in self.cropped_info["data"][folder][image_path]]
-            self.cropped_label.configure(text="Cropped sizes: " + ", ".join(cropped_dims))
-        else:
-            self.cropped_label.configure(text="Not yet cropped")
+        for _ in range(min(args.steps, params["count"])):
+            timed(samples, "next_image", app.next_image)
+            pump(root, think)
 
-    def jump_to_last_cropped(self):
-        if not self.current_folder:
-            return
+        for _ in range(min(args.steps, params["count"])):
+            # Cold: evicted from the cache, decoded on the main thread
+            app.current_index = (app.current_index + 1) % len(app.images)
+            app.prefetcher.invalidate(app.images[app.current_index])
+            timed(samples, "load_current_image", app.load_current_image)
+            timed(samples, "update_dimension_counts", app.update_dimension_counts)
+            timed(samples, "draw_previous_crops", app.draw_previous_crops)
+            pump(root, think)
 
-        if self.current_folder not in self.last_cropped_entry:
-            return
+        for i in range(min(args.steps, params["count"])):
+            path = app.images[app.current_index]
+            timed(samples, "save_cropped_info", app.save_cropped_info, path, "64x64", (i, i, i + 64, i + 64))
 
-        last_cropped = self.last_cropped_entry[self.current_folder]
+        for _ in range(min(args.steps, params["count"])):
+            if not app.rect_coords:
+                app.place_rectangle(SimpleNamespace(x=args.screen[0] // 2, y=args.screen[1] // 2))
+            timed(samples, "quick_save", app.quick_save)
+            pump(root, think)
+        timed(samples, "flush_saves", app.flush_saves)
 
-        image_path = last_cropped["image_path"]
-        try:
-            index = self.images.index(image_path)
-            self.current_index = index
-            self.load_current_image()
-        except ValueError:
-            print("Last cropped image not found in current folder.")
+        cropped = app.cropped_info["data"].get(folder, {})
+        candidates = [path for path in app.images if path not in cropped
+                      and max(app.image_dimensions(path) or (0, 0)) > app.downscale_to]
+        for path in candidates[:args.steps]:
+            app.current_index = app.images.index(path)
+            app.load_current_image()
+            timed(samples, "resize_and_save_image", app.resize_and_save_image)
+            pump(root, think)
 
-    def save_last_cropped_entries(self):
-        try:
-            with open("last_cropped.json", 'w') as f:
-                json.dump(self.last_cropped_entry, f, indent=2)
-        except Exception as e:
-            print(f"Error saving last cropped entries: {e}")
+        app.on_close()
+        # Worker processes still starting up change into the scratch folder, it must outlive them
+        app.analysis_pool.shutdown(wait=True)
+        instrumentation.enabled = False
+        if dialogs.messages:
+            print("\n".join(dialogs.messages))
+    finally:
+        ctk, ImageTk, messagebox, filedialog = saved_toolkit
+        os.chdir(cwd)
+        scratch.cleanup()
 
-    def load_last_cropped_entries(self):
-        try:
-            with open("last_cropped.json", 'r') as f:
-                self.last_cropped_entry = json.load(f)
-        except FileNotFoundError:
-            self.last_cropped_entry = {}
-        except json.JSONDecodeError:
-            self.last_cropped_entry = {}
+    result = {"params": dict(params, size=list(params["size"])), "operations": {},
+              "phases": instrumentation.summary().get("phase", {})}
+    for operation in BENCH_OPERATIONS:
+        result["operations"][operation] = latency_stats(samples.get(operation, []))
+    try:
+        import resource
+        scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is in bytes on macOS, KB elsewhere
+        result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / (1024 * 1024)
+        result["peak_rss_children_mb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / (1024 * 1024)
+    except ImportError:
+        result["peak_rss_mb"] = result["peak_rss_children_mb"] = None
+    return result
 
-    def update_radio_button_highlights(self, width, height):
-        for label, value in self.dimension_labels:
-            rb = self.radio_buttons[value]
-            if value == "custom":
-                rb.configure(text_color="lime")
-                continue
-            w, h = map(int, value.split("x"))
-            # Highlight green if fits in image
-            if w <= width and h <= height:
-                rb.configure(text_color="lime")
-                rb.configure(state=ctk.NORMAL)
-            else:
-                rb.configure(state=ctk.DISABLED) # Disable the radiobutton
 
-    def set_largest_radio_button(self, width, height):
-        # Find all fitting resolutions
-        fitting = []
-        for label, value in self.dimension_labels:
-            if value == "custom":
-                continue
-            w, h = map(int, value.split("x"))
-            if w <= width and h <= height:
-                fitting.append((w, h, value))
+def latency_stats(times):
+    return {
+        "n": len(times),
+        "mean": sum(times) / len(times) if times else None,
+        **{f"p{q}": percentile(times, q) if times else None for q in (50, 95, 99)},
+        "max": max(times) if times else None,
+    }
 
-        if not fitting:
-            self.size_var.set("custom")
-            self.update_size()
-            return
 
-        # Prefer orientation
-        prefer = self.orientation_preference.get()
-        if prefer == "portrait":
-            fitting.sort(key=lambda x: (x[0] <= x[1], x[0]*x[1]), reverse=True)
-        else:
-            fitting.sort(key=lambda x: (x[0] >= x[1], x[0]*x[1]), reverse=True)
+def git_revision():
+    import subprocess
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
 
-        # Select the best fit
-        best = fitting[0][2]
-        self.size_var.set(best)
-        self.update_size()
 
-    def update_largest_radio_button(self):
-        """Updates the selected radio button when orientation preference changes."""
-        if self.current_image:
-            w, h = self.current_image.size
-            self.set_largest_radio_button(w,h)
+def print_bench_result(name, result):
+    rss = result["peak_rss_mb"]
+    print(f"\n{name}: {result['params']['count']} images of ~{result['params']['size'][0]}x{result['params']['size'][1]} "
+          f"{result['params']['format']}" + (f", peak RSS {rss:.0f} MB" if rss is not None else ""))
+    print_latency_table(result)
 
-    def can_resize(self):
-        if not self.current_folder:
-            return False
 
-        if not self.current_image:
-            return False    
-        
-        image_path = self.images[self.current_index]
-        if self.current_folder in self.cropped_info["data"]:
-            if image_path in self.cropped_info["data"][self.current_folder]:
-                return False
-        
-        width, height = self.current_image.size
-        max_dim = max(width, height)
+def print_latency_table(result):
+    print(f"  {'operation':24s} {'n':>5s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'max ms':>9s}")
+    for operation, stats in result["operations"].items():
+        if stats["n"]:
+            print(f"  {operation:24s} {stats['n']:5d} {stats['p50']:9.1f} {stats['p95']:9.1f} {stats['p99']:9.1f} {stats['max']:9.1f}")
+    print(f"  {'phase':24s} {'n':>5s} {'p50 ms':>9s} {'p95 ms':>9s} {'':>9s} {'max ms':>9s}")
+    for phase, stats in result.get("phases", {}).items():
+        print(f"  {phase:24s} {stats['n']:5d} {stats['p50']:9.1f} {stats['p95']:9.1f} {'':9s} {stats['max']:9.1f}")
 
-        if max_dim <= self.downscale_to:
-            return False
 
-        return True
+def print_bench_comparison(baseline, report):
+    print(f"\nCompared to {baseline.get('revision')} (ratio new/old, below 1 is faster):")
+    for name, result in report["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        if old["params"] != result["params"]:
+            print(f"  {name:8s} skipped, generated with different parameters")
+            continue
+        for operation, stats in result["operations"].items():
+            old_stats = old["operations"].get(operation)
+            if stats["n"] and old_stats and old_stats["n"]:
+                print(f"  {name:8s} {operation:24s} p50 {stats['p50'] / max(1e-9, old_stats['p50']):5.2f}x  "
+                      f"p95 {stats['p95'] / max(1e-9, old_stats['p95']):5.2f}x")
 
-    def resize_and_save_image(self, event=None):
-        if not self.current_folder:
-            return
 
-        if not self.current_image:
-            return
+def bench_command(args):
+    import platform
+    import subprocess
+    import tempfile
+    names = args.scenario or ["photos", "png", "large"]
+    for name in names:
+        if name not in BENCH_SCENARIOS:
+            print(f"Unknown scenario {name}, choose from {', '.join(BENCH_SCENARIOS)}")
+            return 1
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {"repeat": args.repeat, "steps": args.steps, "think_ms": args.think_ms,
+                     "screen": list(args.screen), "seed": args.seed, "tk": args.tk},
+        "scenarios": {},
+    }
+    for name in names:
+        params = dict(BENCH_SCENARIOS[name])
+        if args.count:
+            params["count"] = args.count
+        if len(names) == 1:
+            result = bench_scenario(name, params, args)
+        else:
+            # One process per scenario, so peak RSS and caches do not carry over
+            with tempfile.TemporaryDirectory() as tmp:
+                output = os.path.join(tmp, "result.json")
+                command = [sys.executable, os.path.abspath(__file__), "bench", "--scenario", name, "--output", output,
+                           "--data", args.data, "--repeat", str(args.repeat), "--steps", str(args.steps),
+                           "--think-ms", str(args.think_ms), "--seed", str(args.seed),
+                           "--screen", str(args.screen[0]), str(args.screen[1])]
+                if args.count:
+                    command += ["--count", str(args.count)]
+                if args.tk:
+                    command.append("--tk")
+                if subprocess.run(command, stdout=subprocess.DEVNULL).returncode != 0:
+                    print(f"Scenario {name} failed")
+                    return 1
+                with open(output, 'r') as f:
+                    result = json.load(f)["scenarios"][name]
+        report["scenarios"][name] = result
+        print_bench_result(name, result)
 
-        image_path = self.images[self.current_index]
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            print_bench_comparison(json.load(f), report)
+    return 0
 
-        if self.current_folder in self.cropped_info["data"]:
-            if image_path in self.cropped_info["data"][self.current_folder]:
-                messagebox.showerror("Error", "Cannot resize: Image has already been cropped.")
-                return
 
-        width, height = self.current_image.size
-        max_dim = max(width, height)
+def write_startup_history(directory, crops, backend, folders=50):
+    """Writes a synthetic crop history of about `crops` crops (two per image) spread over `folders` folders.
 
-        if max_dim <= self.downscale_to:
-            return
+    Returns the folder whose history the probe opens.
+    """
+    data = {}
+    last_cropped = {}
+    per_folder = max(1, crops // folders)
+    for f in range(folders if crops else 0):
+        folder = os.path.join(directory, "images", f"folder{f:03d}")
+        images = data[folder] = {}
+        for i in range(0, per_folder, 2):
+            image_path = os.path.join(folder, f"image{i // 2:06d}.jpg")
+            images[image_path] = [{"size": "1024x1024", "coords": [0, 0, 1024, 1024]},
+                                  {"size": "768x768", "coords": [128, 64, 896, 832]}][:per_folder - i]
+        last_cropped[folder] = {"size": "1024x1024", "coords": [0, 0, 1024, 1024], "image_path": image_path,
+                                "folder": folder}
+    cropped_info_file = os.path.join(directory, "cropped_info.json")
+    last_cropped_file = os.path.join(directory, "last_cropped.json")
+    with open(cropped_info_file, 'w') as f:
+        json.dump({"data": data}, f)
+    with open(last_cropped_file, 'w') as f:
+        json.dump(last_cropped, f)
+    if backend == "sqlite":
+        store = SqliteCropStore(os.path.join(directory, "cropped_info.db"))
+        store.import_json(cropped_info_file, last_cropped_file)
+        store.close()
+        os.remove(cropped_info_file)
+        os.remove(last_cropped_file)
+    return os.path.join(directory, "images", "folder000")
 
-        scale_factor = self.downscale_to / max_dim
-        new_width = int(width * scale_factor)
-        new_height = int(height * scale_factor)
 
-        os.makedirs(self.originals_folder, exist_ok=True)
-        image_path = self.images[self.current_index]
-        base_name = os.path.basename(image_path)
-        
-        # Backup the original file into the originals folder
-        self.current_image.save(os.path.join(self.originals_folder, base_name))
+def startup_probe_command(args):
+    """Child process of bench-startup: prints the startup milestones in ms since args.t0 as JSON."""
+    global ctk, ImageTk, messagebox, filedialog
+    milestones = {"import_ms": (time.time() - args.t0) * 1000}
+    if args.tk:
+        import_gui()
+    else:
+        ctk, ImageTk, messagebox, filedialog = HeadlessToolkit, HeadlessImageTk, BenchDialogs(), BenchDialogs()
+    instrumentation.enabled = True
+    root = ctk.CTk()
+    app = PowerCropper(root, crop_store_backend=args.backend)
+    root.update()
+    milestones["window_ms"] = (time.time() - args.t0) * 1000
+    # Interactive once the event loop runs callbacks, i.e. input would be handled
+    responsive = []
+    root.after(0, lambda: responsive.append(time.time()))
+    while not responsive:
+        root.update()
+    milestones["interactive_ms"] = (responsive[0] - args.t0) * 1000
+    # What opening the last folder needs before its crop counts can be shown
+    app.load_folder_cropped_info(args.folder)
+    milestones["history_ms"] = (time.time() - args.t0) * 1000
+    milestones["history_crops"] = sum(len(crops) for crops in app.cropped_info["data"].get(args.folder, {}).values())
+    phases = instrumentation.summary().get("phase", {})
+    milestones["store_open_ms"] = phases.get("open_store", {}).get("max")
+    milestones["store_wait_ms"] = phases.get("wait_store", {}).get("max", 0)
+    app.on_close()
+    print(json.dumps(milestones))
+    return 0
 
-        resized_image = self.current_image.resize((new_width, new_height), Image.LANCZOS)
 
-        # Save the resized image, overwriting the original
-        resized_image.save(image_path)
+def bench_startup_command(args):
+    import subprocess
+    import tempfile
+    columns = ["import_ms", "window_ms", "interactive_ms", "history_ms", "store_wait_ms"]
+    print(f"{'history':>14s}  " + " ".join(f"{name:>14s}" for name in columns) + "   (medians in ms)")
+    report = {"revision": git_revision(), "repeat": args.repeat, "tk": args.tk, "results": []}
+    for backend in args.backend:
+        for crops in args.crops:
+            with tempfile.TemporaryDirectory(prefix="power-cropper-startup-") as tmp:
+                folder = write_startup_history(tmp, crops, backend)
+                runs = []
+                for _ in range(args.repeat):
+                    command = [sys.executable, os.path.abspath(__file__), "startup-probe", "--folder", folder,
+                               "--backend", backend, "--t0", repr(time.time())]
+                    if args.tk:
+                        command.append("--tk")
+                    # The probe runs in the history directory, where the application keeps its stores
+                    probe = subprocess.run(command, cwd=tmp, capture_output=True, text=True)
+                    if probe.returncode != 0:
+                        print(f"Startup probe failed:\n{probe.stderr}")
+                        return 1
+                    runs.append(json.loads(probe.stdout.strip().splitlines()[-1]))
+            medians = {name: percentile([run[name] or 0 for run in runs], 50) for name in columns}
+            report["results"].append({"backend": backend, "crops": crops, "runs": runs, "median": medians})
+            print(f"{backend:>6s} {crops:>7d}  " + " ".join(f"{medians[name]:14.1f}" for name in columns))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
 
-        # Update the displayed image
-        self.current_image = Image.open(image_path)
-        self.tk_img = ImageTk.PhotoImage(self.current_image)
-        self.canvas.delete("all")
-        self.image_on_canvas = self.canvas.create_image(0, 0, anchor=ctk.NW, image=self.tk_img)
 
-        # Update scroll region
-        w, h = self.current_image.size
-        self.canvas.configure(scrollregion=(0, 0, w, h))
+def copy_session_folder(source, folder, recursive=False):
+    """Hard links the images of a recorded folder into a scratch folder, like link_bench_folder."""
+    for root, dirs, files in os.walk(source):
+        dirs[:] = [d for d in dirs if recursive and d not in OUTPUT_FOLDERS and not d.startswith(".")]
+        target = os.path.join(folder, os.path.relpath(root, source))
+        os.makedirs(target, exist_ok=True)
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                try:
+                    os.link(os.path.join(root, name), os.path.join(target, name))
+                except OSError:
+                    shutil.copy2(os.path.join(root, name), os.path.join(target, name))
 
-        # Update dimension label
-        index_text = f"({self.current_index + 1}/{len(self.images)})"
-        self.dim_label.configure(text=f"Image size: {w} x {h} px  {index_text}")
-        self.root.title(f"{os.path.basename(self.images[self.current_index])}")
 
-        self.update_radio_button_highlights(w, h)
-        self.update_largest_radio_button()
-        self.resize_button.configure(state=ctk.DISABLED)
+def replay_command(args):
+    """Re-executes a recorded session headlessly on copies of its folders and reports the latency per action."""
+    import tempfile
+    from types import SimpleNamespace
+    global ctk, ImageTk, messagebox, filedialog
+    with open(args.session, 'rb') as f:
+        data = f.read()
+    records = [json.loads(line) for line in data.decode().splitlines() if line.strip()]
+    header = records[0] if records and records[0].get("type") == "session" else {}
+    actions = [record for record in records if "action" in record]
+    if not actions:
+        print(f"No actions recorded in {args.session}")
+        return 1
+    folders = {}
+    histories = {}
+    for record in records:
+        if record.get("type") == "folder":
+            folders.setdefault(record["folder"], record)
+        elif record.get("type") == "history":
+            histories.setdefault(record["folder"], record)
+    sources = {}
+    for item in args.source:
+        recorded, _, path = item.partition("=")
+        sources[os.path.abspath(recorded)] = os.path.abspath(path)
 
-if __name__ == "__main__":
+    scratch = tempfile.TemporaryDirectory(prefix="power-cropper-replay-")
+    copies = {}  # recorded folder -> its copy
+    for record in actions:
+        if record["action"] != "open_folder":
+            continue
+        recorded = os.path.abspath(record["args"][0])
+        if recorded in copies:
+            continue
+        source = sources.get(recorded, recorded)
+        if not os.path.isdir(source):
+            print(f"Folder {recorded} of the recording not found, pass --source {recorded}=PATH")
+            return 1
+        recursive = folders.get(recorded, {}).get("recursive", False)
+        copy = copies[recorded] = os.path.join(scratch.name, f"{len(copies)}-{os.path.basename(source)}")
+        copy_session_folder(source, copy, recursive)
+        expected = folders.get(recorded, {}).get("fingerprint")
+        if expected and folder_fingerprint(copy, recursive) != expected:
+            print(f"Warning: the images in {source} differ from the recorded folder, the replay may diverge")
+
+    def remap(value):
+        for recorded, copy in copies.items():
+            if value == recorded or value.startswith(recorded + os.sep):
+                return copy + value[len(recorded):]
+        return value
+
+    def decode(value):
+        if isinstance(value, dict) and "pointer" in value:
+            # Headless canvases do not scroll, canvas and window coordinates are the same
+            return SimpleNamespace(x=value["pointer"][0] * app.zoom, y=value["pointer"][1] * app.zoom)
+        if isinstance(value, dict) and "size" in value:
+            return SimpleNamespace(width=value["size"][0], height=value["size"][1])
+        if isinstance(value, str):
+            return remap(value)
+        return value
+
+    saved_toolkit = ctk, ImageTk, messagebox, filedialog
+    cwd = os.getcwd()
+    # The application keeps its stores in the working directory
+    os.chdir(scratch.name)
+    samples = defaultdict(list)
+    try:
+        # Start from the crops the folders had when they were opened in the recorded session
+        store = SqliteCropStore("cropped_info.db")
+        for recorded, history in histories.items():
+            copy = copies.get(recorded)
+            if copy is None:
+                continue
+            crops = [(copy, os.path.join(copy, path), size, coords)
+                     for path, image_crops in history["crops"].items() for size, coords in image_crops]
+            last = history.get("last_cropped")
+            if last:
+                last = (copy, dict(last, image_path=os.path.join(copy, last["image_path"]), folder=copy))
+            store.add_crops(crops, last)
+        store.close()
+
+        dialogs = BenchDialogs()
+        messagebox = filedialog = dialogs
+        ctk, ImageTk = HeadlessToolkit, HeadlessImageTk
+        sizes = [record["args"][0]["size"] for record in actions if record["action"] == "on_canvas_configure"]
+        HeadlessCanvas.size = tuple(sizes[0]) if sizes else (1600, 900)
+        root = ctk.CTk()
+        app = PowerCropper(root)
+        instrumentation.reset()
+        instrumentation.enabled = True
+        start = time.perf_counter()
+        for record in actions:
+            if args.speed:
+                # The recorded pace, background work runs in the pauses as it did in the session
+                pump(root, start + record["t"] / args.speed - time.perf_counter())
+            method = getattr(app, record["action"], None)
+            if method is None:
+                print(f"Skipping unknown action {record['action']}")
+                continue
+            for option, value in record.get("options", {}).items():
+                getattr(app, option).set(value)
+            call_args = [decode(value) for value in record.get("args", [])]
+            call_kwargs = {key: decode(value) for key, value in record.get("kwargs", {}).items()}
+            if record["action"] == "open_folder":
+                app.flush_saves()  # As load_folder does before opening
+            begin = time.perf_counter()
+            method(*call_args, **call_kwargs)
+            app.coalescer.flush()
+            if record["action"] == "open_folder":
+                pump_until(root, lambda: app.current_folder == call_args[0] and app.current_image is not None)
+            samples[record["action"]].append((time.perf_counter() - begin) * 1000)
+            root.update()
+        timed(samples, "flush_saves", app.flush_saves)
+        elapsed = time.perf_counter() - start
+        app.on_close()
+        # Worker processes still starting up change into the scratch folder, it must outlive them
+        app.analysis_pool.shutdown(wait=True)
+        instrumentation.enabled = False
+        if dialogs.messages:
+            print("\n".join(dialogs.messages))
+    finally:
+        ctk, ImageTk, messagebox, filedialog = saved_toolkit
+        os.chdir(cwd)
+        scratch.cleanup()
+
+    name = os.path.splitext(os.path.basename(args.session))[0]
+    result = {"params": {"session": hashlib.blake2b(data, digest_size=16).hexdigest(), "actions": len(actions),
+                         "speed": args.speed},
+              "operations": {action: latency_stats(times) for action, times in samples.items()},
+              "phases": instrumentation.summary().get("phase", {})}
+    report = {"revision": git_revision(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "recorded": {"revision": header.get("revision"), "started": header.get("started")},
+              "scenarios": {name: result}}
+    print(f"\n{name}: {len(actions)} actions recorded {header.get('started')} ({header.get('revision')}), "
+          f"replayed in {elapsed:.1f} s")
+    print_latency_table(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            print_bench_comparison(json.load(f), report)
+    return 0
+
+
+def run_gui(trace_file=None, record_file=None, cache_mb=1024, prefetch_ahead=3, prefetch_behind=1):
+    import_gui()
+    if trace_file:
+        instrumentation.enabled = True
     root = ctk.CTk()
-    app = PowerCropper(root)
+    app = PowerCropper(root, cache_budget_mb=cache_mb, prefetch_ahead=prefetch_ahead, prefetch_behind=prefetch_behind)
+    app.trace_file = trace_file
+    if record_file:
+        app.recorder = SessionRecorder(record_file)
+        app.recorder.watch(app)
     root.geometry("1200x800")
     root.mainloop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Power Cropper. Starts the GUI when no command is given.")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="Time user actions and write a trace on exit (Chrome trace format, or JSON lines for .jsonl)")
+    parser.add_argument("--record", metavar="FILE",
+                        help="Record the actions of the session to FILE (JSON lines), to run it again with replay")
+    parser.add_argument("--cache-mb", type=int, default=1024, metavar="MB",
+                        help="Memory budget of the decoded image cache (default: %(default)s)")
+    parser.add_argument("--prefetch-ahead", type=int, default=3, metavar="N",
+                        help="Images after the current one decoded in the background (default: %(default)s)")
+    parser.add_argument("--prefetch-behind", type=int, default=1, metavar="N",
+                        help="Images before the current one decoded in the background (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command")
+
+    export = commands.add_parser("export", help="Re-render all stored crops without the GUI")
+    export.add_argument("folders", nargs="*", help="Folders to export (default: every folder in the store)")
+    export.add_argument("--store", default="cropped_info.db", help="Crop store, a .db or a cropped_info.json file")
+    export.add_argument("--output", help="Write into OUTPUT/<folder name> instead of <folder>/cropped")
+    export.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    export.add_argument("--check", choices=("mtime", "hash"), default="mtime",
+                        help="How to detect up-to-date outputs: output newer than source, or source hash + coords")
+    export.add_argument("--force", action="store_true", help="Re-render everything")
+    add_encoder_arguments(export)
+    export.set_defaults(func=export_command)
+
+    coverage = commands.add_parser("coverage", help="How much of the images the stored crops cover, without reading images")
+    coverage.add_argument("folders", nargs="*", help="Folders to summarize (default: every folder in the store)")
+    coverage.add_argument("--store", default="cropped_info.db", help="Crop store, a .db or a cropped_info.json file")
+    coverage.add_argument("--cache", default="analysis_cache.db", help="Analysis cache with the image dimensions")
+    coverage.add_argument("--iou", type=float, default=0.9, help="Count crop pairs overlapping at least this much (IoU)")
+    coverage.set_defaults(func=coverage_command)
+
+    shards = commands.add_parser("shards", help="Write all stored crops into tar shards for training")
+    shards.add_argument("output", help="Folder for the shards and index.jsonl")
+    shards.add_argument("folders", nargs="*", help="Folders to export (default: every folder in the store)")
+    shards.add_argument("--store", default="cropped_info.db", help="Crop store, a .db or a cropped_info.json file")
+    shards.add_argument("--shard-size", type=int, default=1024, help="Max size of a shard in MB")
+    shards.add_argument("--no-buckets", action="store_true",
+                        help="One sequence of shards instead of one per preset aspect ratio")
+    shards.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    shards.add_argument("--force", action="store_true",
+                        help="Write into a non-empty directory, replacing the shards of an earlier run")
+    add_encoder_arguments(shards)
+    shards.set_defaults(func=shards_command)
+
+    serve = commands.add_parser("serve", help="Accept crop and resize jobs from other tools over HTTP")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--socket", help="Listen on this Unix socket instead of a TCP port")
+    serve.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    serve.add_argument("--max-queue", type=int, default=256, help="Jobs waiting or running before batches are refused")
+    serve.add_argument("--store", default="cropped_info.db", help="Crop store, shared with the GUI")
+    serve.add_argument("--cache", default="analysis_cache.db", help="Analysis cache to refresh after resizes")
+    serve.add_argument("--prefer", choices=("portrait", "landscape"), default="portrait",
+                       help="Orientation preference for \"size\": \"auto\" crops")
+    serve.add_argument("--target", type=int, default=1024, help="Default max width/height of resize jobs")
+    serve.add_argument("--filter", choices=list(RESAMPLE_FILTERS), default="LANCZOS")
+    add_encoder_arguments(serve)
+    serve.set_defaults(func=serve_command)
+
+    resize_all = commands.add_parser("resize-all", help="Downscale every uncropped image of a folder")
+    resize_all.add_argument("folder")
+    resize_all.add_argument("--recursive", action="store_true", help="Include subfolders, like the Subfolders option")
+    resize_all.add_argument("--target", type=int, default=1024, help="Max width/height after resizing")
+    resize_all.add_argument("--filter", choices=list(RESAMPLE_FILTERS), default="LANCZOS")
+    resize_all.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    resize_all.add_argument("--store", default="cropped_info.db", help="Crop store, a .db or a cropped_info.json file")
+    resize_all.add_argument("--cache", default="analysis_cache.db", help="Analysis cache to refresh")
+    resize_all.set_defaults(func=resize_all_command)
+
+    bench_decode = commands.add_parser("bench-decode", help="Time to first pixel, full vs. preview decode of large JPEGs")
+    bench_decode.add_argument("images", nargs="*", help="JPEG files or folders (default: synthetic images)")
+    bench_decode.add_argument("--size", type=int, nargs=2, default=(8000, 6000), metavar=("W", "H"),
+                              help="Size of the synthetic images")
+    bench_decode.add_argument("--count", type=int, default=3, help="Number of synthetic images")
+    bench_decode.add_argument("--screen", type=int, nargs=2, default=(1920, 1080), metavar=("W", "H"))
+    bench_decode.add_argument("--repeat", type=int, default=3)
+    bench_decode.set_defaults(func=bench_decode_command)
+
+    bench_encode = commands.add_parser("bench-encode", help="Encode time and output size per output setting")
+    bench_encode.add_argument("images", nargs="+", help="Image files or folders to sample")
+    bench_encode.add_argument("--count", type=int, default=5, help="Number of images to sample")
+    bench_encode.add_argument("--crop", type=int, nargs=2, default=(1024, 1024), metavar=("W", "H"))
+    bench_encode.add_argument("--repeat", type=int, default=1)
+    bench_encode.set_defaults(func=bench_encode_command)
+
+    bench = commands.add_parser("bench", help="Latency of the core workflows on synthetic folders, headless")
+    bench.add_argument("--scenario", action="append", choices=list(BENCH_SCENARIOS),
+                       help="Scenario to run, repeatable (default: photos, png, large)")
+    bench.add_argument("--count", type=int, help="Override the number of images of the scenarios")
+    bench.add_argument("--data", default="bench-data", help="Where the generated images are kept between runs")
+    bench.add_argument("--repeat", type=int, default=3, help="How often the folder is opened")
+    bench.add_argument("--steps", type=int, default=30, help="Samples per operation")
+    bench.add_argument("--think-ms", type=int, default=50, help="Pause between actions, for background work")
+    bench.add_argument("--screen", type=int, nargs=2, default=(1600, 900), metavar=("W", "H"), help="Canvas size")
+    bench.add_argument("--seed", type=int, default=0)
+    bench.add_argument("--tk", action="store_true", help="Use the real Tk widgets (needs a display, e.g. xvfb-run)")
+    bench.add_argument("--output", help="Write the results as JSON")
+    bench.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    bench.set_defaults(func=bench_command)
+
+    bench_startup = commands.add_parser("bench-startup", help="Time to interactive with empty and large crop histories")
+    bench_startup.add_argument("--crops", type=int, nargs="+", default=[0, 100000],
+                               help="History sizes to measure (default: 0 100000)")
+    bench_startup.add_argument("--backend", nargs="+", choices=["sqlite", "json"], default=["sqlite"],
+                               help="Crop store backends to measure (default: sqlite)")
+    bench_startup.add_argument("--repeat", type=int, default=5, help="Startups per history, the median is reported")
+    bench_startup.add_argument("--tk", action="store_true", help="Use the real Tk widgets (needs a display, e.g. xvfb-run)")
+    bench_startup.add_argument("--output", help="Write the results as JSON")
+    bench_startup.set_defaults(func=bench_startup_command)
+
+    replay = commands.add_parser("replay", help="Run a recorded session (--record) again headlessly and time every action")
+    replay.add_argument("session", help="Recording written with --record")
+    replay.add_argument("--source", action="append", default=[], metavar="RECORDED=PATH",
+                        help="Take the images of a recorded folder from PATH, repeatable (default: the recorded path)")
+    replay.add_argument("--speed", type=float, default=0,
+                        help="Replay at this multiple of the recorded pace (default: 0, as fast as possible)")
+    replay.add_argument("--output", help="Write the results as JSON")
+    replay.add_argument("--compare", help="JSON results of an earlier replay of the same recording to compare against")
+    replay.set_defaults(func=replay_command)
+
+    probe = commands.add_parser("startup-probe")  # Used by bench-startup
+    probe.add_argument("--folder", required=True)
+    probe.add_argument("--backend", default="sqlite")
+    probe.add_argument("--t0", type=float, required=True)
+    probe.add_argument("--tk", action="store_true")
+    probe.set_defaults(func=startup_probe_command)
+
+    args = parser.parse_args(argv)
+    if min(args.cache_mb, args.prefetch_ahead, args.prefetch_behind) < 0:
+        parser.error("--cache-mb, --prefetch-ahead and --prefetch-behind must not be negative")
+    if args.command is None:
+        run_gui(args.trace, args.record, args.cache_mb, args.prefetch_ahead, args.prefetch_behind)
+        return 0
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
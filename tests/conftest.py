@@ -0,0 +1,10 @@
+import importlib.util
+import os
+import sys
+
+# The application is a single script with a dash in its name, the tests import it as power_cropper
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+spec = importlib.util.spec_from_file_location("power_cropper", os.path.join(ROOT, "power-cropper.py"))
+power_cropper = importlib.util.module_from_spec(spec)
+sys.modules["power_cropper"] = power_cropper
+spec.loader.exec_module(power_cropper)
@@ -0,0 +1,77 @@
+import random
+
+from power_cropper import CropIndex, box_iou, coverage_summary, union_area
+
+
+def random_crops(rng, count, width=4000, height=3000):
+    crops = []
+    for _ in range(count):
+        w, h = rng.choice([(1024, 1024), (768, 1024), (1024, 768), (200, 3000), (3900, 100)])
+        x0, y0 = rng.randrange(width - w + 1), rng.randrange(height - h + 1)
+        crops.append({"size": f"{w}x{h}", "coords": [x0, y0, x0 + w, y0 + h]})
+    return crops
+
+
+def test_box_iou():
+    assert box_iou((0, 0, 10, 10), (0, 0, 10, 10)) == 1.0
+    assert box_iou((0, 0, 10, 10), (10, 0, 20, 10)) == 0.0
+    assert box_iou((0, 0, 10, 10), (5, 0, 15, 10)) == 50 / 150
+
+
+def test_union_area():
+    assert union_area([]) == 0
+    assert union_area([(0, 0, 10, 10), (0, 0, 10, 10)]) == 100
+    assert union_area([(0, 0, 10, 10), (5, 5, 15, 15)]) == 175
+    assert union_area([(0, 0, 10, 10), (20, 20, 30, 30)]) == 200
+    assert union_area([(0, 0, 30, 10), (10, -5, 20, 20)]) == 300 + 150
+
+
+def test_queries_match_brute_force():
+    rng = random.Random(2)
+    crops = random_crops(rng, 200)
+    index = CropIndex(crops)
+    boxes = [(tuple(crop["coords"]), crop["size"]) for crop in crops]
+    for _ in range(300):
+        x, y = rng.uniform(0, 4000), rng.uniform(0, 3000)
+        expected = sorted((size, box) for box, size in boxes if box[0] <= x <= box[2] and box[1] <= y <= box[3])
+        assert sorted(index.at(x, y)) == expected
+    for box, _ in boxes[:50]:
+        expected = sorted((box_iou(box, other), size, other) for other, size in boxes
+                          if other != box and box_iou(box, other) > 0)
+        assert sorted(index.overlaps(box)) == expected
+
+
+def test_add_remove_and_contains():
+    index = CropIndex()
+    index.add("1024x1024", [0, 0, 1024, 1024])
+    index.add("1024x1024", [0, 0, 1024, 1024])
+    index.add("512x512", [4000, 0, 4512, 512])  # A far right box must not hide a wide box further left
+    index.add("3900x100", [10, 2000, 3910, 2100])
+    assert len(index) == 3
+    assert (0, 0, 1024, 1024) in index
+    assert [0, 0, 1024, 1023] not in index
+    assert index.at(3800, 2050) == [("3900x100", (10, 2000, 3910, 2100))]
+    index.remove("1024x1024", [0, 0, 1024, 1024])
+    assert (0, 0, 1024, 1024) not in index
+    assert index.at(10, 10) == []
+
+
+def test_coverage_summary():
+    crops = {
+        "a.jpg": [{"size": "50x100", "coords": [0, 0, 50, 100]}, {"size": "50x100", "coords": [0, 0, 50, 100]},
+                  {"size": "60x100", "coords": [0, 0, 60, 100]}],
+        "b.jpg": [{"size": "100x100", "coords": [0, 0, 100, 100]}],
+        "c.jpg": [{"size": "10x10", "coords": [0, 0, 10, 10]}],
+        "d.jpg": [],
+    }
+    dimensions = {"a.jpg": (100, 100), "b.jpg": (100, 100)}.get
+    summary = coverage_summary(crops, dimensions, total_images=10, iou_threshold=0.8, grid=2)
+    assert summary["cropped_images"] == 3
+    assert summary["crops"] == 5
+    assert summary["unknown_size"] == 1
+    assert summary["mapped_images"] == 2
+    # The duplicate record is one box, 50x100 vs 60x100 overlap with IoU 0.83
+    assert summary["overlapping_pairs"] == 1
+    assert summary["mean_coverage"] == (0.6 + 1.0) / 2
+    assert summary["histogram"] == [0, 0, 1, 1]
+    assert summary["grid"] == [[2, 1], [2, 1]]
@@ -0,0 +1,23 @@
+from power_cropper import CropService, SqliteCropStore
+
+
+def test_batch_outlives_the_eviction_of_its_first_jobs(tmp_path):
+    store_path = str(tmp_path / "cropped_info.db")
+    image = str(tmp_path / "a.jpg")
+    store = SqliteCropStore(store_path)
+    store.add_crop(str(tmp_path), image, "1024x1024", [0, 0, 1024, 1024])
+    store.close()
+    service = CropService(store_path, str(tmp_path / "analysis_cache.db"), workers=1, history=1)
+    try:
+        # Resizing a cropped image fails right away on the store thread, no worker process involved
+        batch, ids = service.submit([{"type": "resize", "image": image}] * 3)
+        versions = {}
+        finished = False
+        while not finished:
+            _, finished = service.wait_batch(batch, versions, timeout=10)
+        jobs = service.batch(batch)
+        assert [job["state"] for job in jobs] == ["expired", "expired", "failed"]
+        assert "already been cropped" in jobs[2]["error"]
+        assert service.metrics()["failed"] == 3
+    finally:
+        service.shutdown()
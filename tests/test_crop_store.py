@@ -0,0 +1,77 @@
+import json
+
+from power_cropper import JsonCropStore, SqliteCropStore
+
+
+def write_json_history(tmp_path):
+    cropped_info = {"data": {"/photos": {
+        "/photos/a.jpg": [{"size": "1024x1024", "coords": [0, 0, 1024, 1024]},
+                          {"size": "768x1024", "coords": [10, 0, 778, 1024]}],
+        "/photos/b.jpg": [{"size": "1024x1024", "coords": [5, 5, 1029, 1029]}],
+    }}}
+    last_cropped = {"/photos": {"image_path": "/photos/b.jpg", "size": "1024x1024", "folder": "/photos"}}
+    (tmp_path / "cropped_info.json").write_text(json.dumps(cropped_info))
+    (tmp_path / "last_cropped.json").write_text(json.dumps(last_cropped))
+    return cropped_info, last_cropped
+
+
+def test_import_json_copies_crops_last_cropped_and_stats(tmp_path):
+    cropped_info, last_cropped = write_json_history(tmp_path)
+    store = SqliteCropStore(str(tmp_path / "cropped_info.db"))
+    store.import_json(str(tmp_path / "cropped_info.json"), str(tmp_path / "last_cropped.json"))
+
+    assert store.load_folder("/photos") == cropped_info["data"]["/photos"]
+    assert store.load_last_cropped("/photos") == last_cropped["/photos"]
+    stats = store.folder_stats("/photos").as_dict(total_images=5)
+    assert stats["sizes"] == {"1024x1024": 2, "768x1024": 1}
+    assert stats["orientations"] == {"square": 2, "portrait": 1}
+    assert stats["total_crops"] == 3
+    assert stats["cropped_images"] == 2
+    assert stats["uncropped_images"] == 3
+    store.close()
+
+
+def test_import_json_runs_once(tmp_path):
+    write_json_history(tmp_path)
+    store = SqliteCropStore(str(tmp_path / "cropped_info.db"))
+    store.import_json(str(tmp_path / "cropped_info.json"), str(tmp_path / "last_cropped.json"))
+    store.remove_image("/photos", "/photos/b.jpg")
+    # A second start must not bring the removed image back from the old files
+    store.import_json(str(tmp_path / "cropped_info.json"), str(tmp_path / "last_cropped.json"))
+    assert list(store.load_folder("/photos")) == ["/photos/a.jpg"]
+    assert store.folder_stats("/photos").cropped_images == 1
+    store.close()
+
+
+def test_import_json_without_files(tmp_path):
+    store = SqliteCropStore(str(tmp_path / "cropped_info.db"))
+    store.import_json(str(tmp_path / "missing.json"), str(tmp_path / "missing_last.json"))
+    assert store.folders() == []
+    store.close()
+
+
+def test_duplicate_crops_are_stored_once(tmp_path):
+    store = SqliteCropStore(str(tmp_path / "cropped_info.db"))
+    crop = ("/photos", "/photos/a.jpg", "1024x1024", [0, 0, 1024, 1024])
+    store.add_crops([crop, crop])
+    store.add_crop(*crop)
+    assert store.load_folder("/photos") == {"/photos/a.jpg": [{"size": "1024x1024", "coords": [0, 0, 1024, 1024]}]}
+    assert store.folder_stats("/photos").total_crops == 1
+    store.close()
+
+
+def test_sqlite_and_json_stores_agree(tmp_path):
+    crops = [("/photos", "/photos/a.jpg", "1024x1024", [0, 0, 1024, 1024]),
+             ("/photos", "/photos/a.jpg", "1024x768", [0, 0, 1024, 768]),
+             ("/photos", "/photos/b.jpg", "768x1024", [0, 0, 768, 1024])]
+    stores = [SqliteCropStore(str(tmp_path / "cropped_info.db")),
+              JsonCropStore(str(tmp_path / "cropped_info.json"), str(tmp_path / "last_cropped.json"))]
+    for store in stores:
+        store.add_crops(crops, last_cropped=("/photos", {"image_path": "/photos/b.jpg"}))
+        store.remove_crop("/photos", "/photos/a.jpg", "1024x768", [0, 0, 1024, 768])
+    sqlite, json_store = stores
+    assert sqlite.load_folder("/photos") == json_store.load_folder("/photos")
+    assert sqlite.load_last_cropped("/photos") == json_store.load_last_cropped("/photos")
+    assert sqlite.folder_stats("/photos").as_dict() == json_store.folder_stats("/photos").as_dict()
+    for store in stores:
+        store.close()
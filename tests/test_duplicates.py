@@ -0,0 +1,79 @@
+import random
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from power_cropper import cluster_hashes, hamming_weight, image_dhash
+
+
+def brute_force_clusters(hashes, threshold):
+    parent = list(range(len(hashes)))
+
+    def find(i):
+        while parent[i] != i:
+            i = parent[i]
+        return i
+
+    for i in range(len(hashes)):
+        for j in range(i + 1, len(hashes)):
+            if bin(hashes[i] ^ hashes[j]).count("1") <= threshold:
+                parent[find(j)] = find(i)
+    clusters = {}
+    for i in range(len(hashes)):
+        clusters.setdefault(find(i), []).append(i)
+    return sorted(sorted(members) for members in clusters.values() if len(members) > 1)
+
+
+def random_hashes(rng, count):
+    # A few groups of nearby hashes plus unrelated ones and exact duplicates
+    centers = [rng.getrandbits(64) for _ in range(count // 10)]
+    hashes = []
+    for _ in range(count):
+        if rng.random() < 0.6:
+            value = rng.choice(centers)
+            for _ in range(rng.randrange(5)):
+                value ^= 1 << rng.randrange(64)
+            hashes.append(value)
+        else:
+            hashes.append(rng.getrandbits(64))
+    return hashes
+
+
+def test_cluster_hashes_matches_brute_force():
+    rng = random.Random(1)
+    hashes = random_hashes(rng, 300)
+    for threshold in (0, 3, 6):
+        # A small block size so the distances are computed over several blocks
+        clusters = cluster_hashes(hashes, threshold=threshold, block=37)
+        assert sorted(sorted(members) for members in clusters) == brute_force_clusters(hashes, threshold)
+
+
+def test_cluster_hashes_edge_cases():
+    assert cluster_hashes([]) == []
+    assert cluster_hashes([5]) == []
+    assert cluster_hashes([2 ** 64 - 1, 2 ** 64 - 1, 0]) == [[0, 1]]
+
+
+def test_hamming_weight_without_bitwise_count(monkeypatch):
+    values = np.array([[0, 1, 2 ** 64 - 1], [0xF0F0, 2 ** 63, 12345]], dtype=np.uint64)
+    expected = [[bin(int(v)).count("1") for v in row] for row in values]
+    assert hamming_weight(values).tolist() == expected
+    monkeypatch.delattr(np, "bitwise_count", raising=False)
+    assert hamming_weight(values).tolist() == expected
+
+
+def test_image_dhash_of_resized_copy_is_close(tmp_path):
+    image = Image.new("RGB", (640, 480), "white")
+    draw = ImageDraw.Draw(image)
+    for i in range(12):
+        draw.ellipse((i * 50, i * 30, i * 50 + 120, i * 30 + 90), fill=(i * 20, 255 - i * 20, 100))
+    image.save(tmp_path / "a.png")
+    image.resize((320, 240)).save(tmp_path / "a_small.jpg", quality=85)
+    image.transpose(Image.FLIP_LEFT_RIGHT).save(tmp_path / "b.png")
+
+    a = image_dhash(str(tmp_path / "a.png"))
+    small = image_dhash(str(tmp_path / "a_small.jpg"))
+    other = image_dhash(str(tmp_path / "b.png"))
+    assert (a["width"], a["height"]) == (640, 480)
+    assert bin(a["dhash"] ^ small["dhash"]).count("1") <= 6
+    assert bin(a["dhash"] ^ other["dhash"]).count("1") > 6
@@ -0,0 +1,63 @@
+import json
+import os
+
+from PIL import Image
+
+from power_cropper import OutputEncoder, SqliteCropStore, export_image_crops, main
+
+
+def make_image(path, color=(200, 40, 40)):
+    Image.new("RGB", (64, 48), color).save(path)
+    return str(path)
+
+
+def test_hash_check_skips_unchanged_crops(tmp_path):
+    source = make_image(tmp_path / "a.png")
+    out = str(tmp_path / "a_cropped_16x16.png")
+    crops = [((0, 0, 16, 16), out)]
+
+    (path, status, entry), = export_image_crops(source, crops, "hash", {})
+    assert (path, status) == (out, "rendered")
+    assert Image.open(out).size == (16, 16)
+
+    manifest = {os.path.basename(out): entry}
+    assert export_image_crops(source, crops, "hash", manifest)[0][1] == "skipped"
+    # Other coordinates, another encoder or a changed source are rendered again
+    assert export_image_crops(source, [((8, 8, 24, 24), out)], "hash", manifest)[0][1] == "rendered"
+    assert export_image_crops(source, crops, "hash", manifest, encoder=OutputEncoder(compress_level=1))[0][1] == "rendered"
+    make_image(tmp_path / "a.png", color=(0, 0, 0))
+    assert export_image_crops(source, crops, "hash", manifest)[0][1] == "rendered"
+    assert export_image_crops(source, crops, "hash", manifest, force=True)[0][1] == "rendered"
+
+
+def test_mtime_check(tmp_path):
+    source = make_image(tmp_path / "a.png")
+    out = str(tmp_path / "out.png")
+    crops = [((0, 0, 16, 16), out)]
+    export_image_crops(source, crops, "mtime", {})
+    assert export_image_crops(source, crops, "mtime", {})[0][1] == "skipped"
+    os.utime(source, (os.path.getmtime(out) + 10,) * 2)
+    assert export_image_crops(source, crops, "mtime", {})[0][1] == "rendered"
+
+
+def test_export_command_writes_manifest_and_skips_on_second_run(tmp_path, capsys):
+    folder = tmp_path / "photos"
+    folder.mkdir()
+    image = make_image(folder / "a.png")
+    store_path = str(tmp_path / "cropped_info.db")
+    store = SqliteCropStore(store_path)
+    # Two records of the same size: the latest one wins, like in the GUI
+    store.add_crops([(str(folder), image, "16x16", [0, 0, 16, 16]), (str(folder), image, "16x16", [4, 4, 20, 20]),
+                     (str(folder), image, "32x16", [0, 0, 32, 16])])
+    store.close()
+    output = tmp_path / "export"
+    command = ["export", "--store", store_path, "--output", str(output), "--jobs", "1", "--check", "hash"]
+
+    assert main(command) == 0
+    assert "rendered 2, skipped 0" in capsys.readouterr().out
+    manifest = json.loads((output / "photos" / ".export_manifest.json").read_text())
+    assert manifest["a_cropped_16x16.png"]["coords"] == [4, 4, 20, 20]
+    assert sorted(manifest) == ["a_cropped_16x16.png", "a_cropped_32x16.png"]
+
+    assert main(command) == 0
+    assert "rendered 0, skipped 2" in capsys.readouterr().out
@@ -0,0 +1,67 @@
+import os
+import time
+
+from power_cropper import find_new_images, index_directories, indexed_images
+
+
+def touch(path, age=0.0):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"")
+    if age:
+        t = time.time() - age
+        os.utime(path, (t, t))
+    return str(path)
+
+
+def make_dataset(root):
+    touch(root / "b.jpg", 60)
+    touch(root / "a.PNG", 60)
+    touch(root / "notes.txt", 60)
+    touch(root / "sub" / "c.jpeg", 60)
+    touch(root / "sub" / "deeper" / "d.bmp", 60)
+    touch(root / "cropped" / "a_cropped_1024x1024.png", 60)
+    touch(root / "originals" / "b.jpg", 60)
+    touch(root / ".thumbs" / "e.jpg", 60)
+
+
+def test_index_lists_images_and_skips_output_and_hidden_folders(tmp_path):
+    make_dataset(tmp_path)
+    flat = indexed_images(index_directories(tmp_path))
+    assert flat == [str(tmp_path / "a.PNG"), str(tmp_path / "b.jpg")]
+    recursive = indexed_images(index_directories(tmp_path, recursive=True))
+    assert recursive == [str(tmp_path / "a.PNG"), str(tmp_path / "b.jpg"),
+                         str(tmp_path / "sub" / "c.jpeg"), str(tmp_path / "sub" / "deeper" / "d.bmp")]
+
+
+def test_first_image_is_the_first_by_name(tmp_path):
+    for name in ("k.jpg", "c.jpg", "x.jpg", "a.jpg", "m.jpg"):
+        touch(tmp_path / name)
+    first = []
+    index_directories(tmp_path, on_first=first.append)
+    assert first == [str(tmp_path / "a.jpg")]
+
+
+def test_unchanged_directories_keep_their_entry(tmp_path):
+    make_dataset(tmp_path)
+    old = index_directories(tmp_path, recursive=True)
+    touch(tmp_path / "sub" / "new.jpg", 60)
+    new = index_directories(tmp_path, old, recursive=True)
+    assert new[str(tmp_path)] is old[str(tmp_path)]
+    assert new[str(tmp_path / "sub" / "deeper")] is old[str(tmp_path / "sub" / "deeper")]
+    assert "new.jpg" in new[str(tmp_path / "sub")][1]
+
+
+def test_find_new_images_waits_for_files_to_settle(tmp_path):
+    make_dataset(tmp_path)
+    index = index_directories(tmp_path, recursive=True)
+    assert find_new_images(str(tmp_path), index, recursive=True) == ([], index)
+
+    touch(tmp_path / "sub" / "copying.jpg")  # Just written, may still be copied
+    touch(tmp_path / "new_folder" / "f.jpg", 60)
+    new_images, new_index = find_new_images(str(tmp_path), index, recursive=True, settle=30)
+    assert new_images == [str(tmp_path / "new_folder" / "f.jpg")]
+    # The unsettled directory keeps its old entry, so the file is found again on the next rescan
+    assert new_index[str(tmp_path / "sub")] is index[str(tmp_path / "sub")]
+
+    new_images, _ = find_new_images(str(tmp_path), new_index, recursive=True, settle=0)
+    assert new_images == [str(tmp_path / "sub" / "copying.jpg")]
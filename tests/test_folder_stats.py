@@ -0,0 +1,45 @@
+import random
+
+from power_cropper import FolderStats, crop_orientation
+
+SIZES = ["1024x1024", "768x1024", "1024x768", "512x512"]
+
+
+def test_crop_orientation():
+    assert crop_orientation("768x1024") == "portrait"
+    assert crop_orientation("1024x768") == "landscape"
+    assert crop_orientation("512x512") == "square"
+
+
+def test_incremental_updates_match_a_recount():
+    rng = random.Random(0)
+    images = {}
+    stats = FolderStats()
+    for _ in range(500):
+        path = f"img{rng.randrange(40)}.jpg"
+        crops = images.setdefault(path, [])
+        if crops and rng.random() < 0.4:
+            crop = crops.pop(rng.randrange(len(crops)))
+            stats.remove_crop(crop["size"], last_of_image=not crops)
+        else:
+            crops.append({"size": rng.choice(SIZES)})
+            stats.add_crop(crops[-1]["size"], first_of_image=len(crops) == 1)
+    images = {path: crops for path, crops in images.items() if crops}
+    assert stats.as_dict() == FolderStats.from_crops(images).as_dict()
+
+
+def test_counters_round_trip():
+    stats = FolderStats.from_crops({"a.jpg": [{"size": "1024x1024"}, {"size": "768x1024"}],
+                                    "b.jpg": [{"size": "1024x1024"}]})
+    counters = {f"size:{size}": count for size, count in stats.sizes.items()}
+    counters.update((f"orientation:{name}", count) for name, count in stats.orientations.items())
+    counters.update(total_crops=stats.total_crops, cropped_images=stats.cropped_images)
+    assert FolderStats.from_counters(counters).as_dict() == stats.as_dict()
+
+
+def test_removing_the_last_crop_drops_the_counters():
+    stats = FolderStats()
+    stats.add_crop("1024x768", first_of_image=True)
+    stats.remove_crop("1024x768", last_of_image=True)
+    assert stats.as_dict(total_images=3) == {"sizes": {}, "orientations": {}, "total_crops": 0,
+                                             "cropped_images": 0, "total_images": 3, "uncropped_images": 3}
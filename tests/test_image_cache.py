@@ -0,0 +1,73 @@
+import time
+
+import pytest
+from PIL import Image
+
+from power_cropper import ImageCache, ImagePrefetcher, main, write_crop
+
+
+def image_of_mb(mb):
+    return Image.new("L", (1024, 1024 * mb))
+
+
+def test_lru_eviction_within_budget():
+    cache = ImageCache(budget_mb=3)
+    for key in "abc":
+        cache.put(key, image_of_mb(1))
+    assert cache.get("a") is not None  # a is now the most recently used
+    cache.put("d", image_of_mb(1))
+    assert "b" not in cache
+    assert all(key in cache for key in "acd")
+    stats = cache.stats()
+    assert stats["used_mb"] == 3 and stats["evictions"] == 1
+
+
+def test_larger_than_budget_is_not_cached():
+    cache = ImageCache(budget_mb=1)
+    cache.put("small", image_of_mb(1))
+    cache.put("huge", image_of_mb(2))
+    assert "huge" not in cache and "small" in cache
+
+
+def test_prefetch_depth(tmp_path):
+    paths = []
+    for i in range(10):
+        paths.append(str(tmp_path / f"{i}.png"))
+        Image.new("RGB", (32, 32)).save(paths[-1])
+    prefetcher = ImagePrefetcher(ImageCache(64), ahead=2, behind=1)
+    try:
+        prefetcher.schedule(paths, 0)
+        deadline = time.time() + 10
+        while prefetcher._pending and time.time() < deadline:
+            time.sleep(0.01)
+        # Two ahead, one behind (wrapping around), not the current image
+        assert [path in prefetcher.cache for path in paths] == [False, True, True] + [False] * 6 + [True]
+    finally:
+        prefetcher.shutdown()
+
+
+def test_negative_cache_options_are_rejected(capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        main(["--prefetch-ahead", "-1", "coverage"])
+    assert exit_info.value.code == 2
+    assert "must not be negative" in capsys.readouterr().err
+
+
+def test_full_decode_for_a_crop_is_accounted(tmp_path):
+    paths = []
+    for i in range(6):
+        paths.append(str(tmp_path / f"{i}.jpg"))
+        Image.new("RGB", (2000, 1500), (i * 40, 0, 0)).save(paths[-1])
+    cache = ImageCache(budget_mb=24)
+    prefetcher = ImagePrefetcher(cache, ahead=0, behind=0, preview_scale=lambda size: 0.25)
+    try:
+        for i, path in enumerate(paths):
+            decoded = prefetcher.get(path)
+            assert not decoded.has_full()
+            write_crop(decoded, (0, 0, 512, 512), str(tmp_path / f"crop{i}.png"))
+            held = sum(image.nbytes() for image, _ in cache._entries.values())
+            assert cache.stats()["used_mb"] * 1024 * 1024 == held
+            assert held <= cache.budget
+        assert cache.stats()["evictions"] > 0
+    finally:
+        prefetcher.shutdown()
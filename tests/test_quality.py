@@ -0,0 +1,63 @@
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from power_cropper import AnalysisCache, image_quality, quality_score
+
+
+def scene(width=2400, height=1800, seed=0):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    image = Image.fromarray(np.stack([x * 200 // width + 30, y * 180 // height + 40, (x + y) * 150 // (width + height) + 50],
+                                     axis=-1).astype(np.uint8))
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x0, y0 = int(rng.integers(0, width - 300)), int(rng.integers(0, height - 300))
+        draw.ellipse((x0, y0, x0 + int(rng.integers(50, 300)), y0 + int(rng.integers(50, 300))),
+                     fill=tuple(int(v) for v in rng.integers(0, 255, 3)))
+    return image
+
+
+def test_features_rank_sharp_above_blurred_blocky_and_noisy(tmp_path):
+    image = scene()
+    image.save(tmp_path / "sharp.jpg", quality=95)
+    image.filter(ImageFilter.GaussianBlur(6)).save(tmp_path / "blurred.jpg", quality=95)
+    image.save(tmp_path / "blocky.jpg", quality=8)
+    noise = np.random.default_rng(1).normal(0, 25, (image.height, image.width, 3))
+    Image.fromarray(np.clip(np.asarray(image) + noise, 0, 255).astype(np.uint8)).save(tmp_path / "noisy.png")
+    features = {name: image_quality(str(tmp_path / name)) for name in
+                ("sharp.jpg", "blurred.jpg", "blocky.jpg", "noisy.png")}
+
+    sharp = features["sharp.jpg"]
+    assert (sharp["width"], sharp["height"]) == (2400, 1800)
+    assert features["blurred.jpg"]["sharpness"] < sharp["sharpness"] / 3
+    assert features["blocky.jpg"]["blockiness"] > sharp["blockiness"] + 0.03
+    assert features["noisy.png"]["noise"] > sharp["noise"] * 1.5
+    scores = {name: quality_score(row) for name, row in features.items()}
+    assert max(scores, key=scores.get) == "sharp.jpg"
+
+
+def test_score_follows_the_largest_fitting_preset():
+    features = {"sharpness": 500.0, "noise": 1.0, "blockiness": 1.0}
+    labels = [("Square", "1024x1024"), ("Small", "512x512"), ("Custom", "custom")]
+    large = quality_score(dict(features, width=2000, height=1500), labels)
+    small = quality_score(dict(features, width=800, height=600), labels)
+    tiny = quality_score(dict(features, width=300, height=200), labels)
+    assert large > small > tiny
+    assert 0 <= tiny and large <= 100
+
+
+def test_tiny_images(tmp_path):
+    Image.new("L", (2, 2)).save(tmp_path / "tiny.png")
+    row = image_quality(str(tmp_path / "tiny.png"))
+    assert (row["sharpness"], row["noise"], row["blockiness"]) == (0.0, 0.0, 1.0)
+
+
+def test_cache_round_trip(tmp_path):
+    Image.new("RGB", (64, 48)).save(tmp_path / "a.png")
+    row = image_quality(str(tmp_path / "a.png"))
+    cache = AnalysisCache(str(tmp_path / "analysis_cache.db"))
+    cache.store_quality(str(tmp_path), [row])
+    assert cache.load_quality(str(tmp_path)) == {row["path"]: row}
+    cache.remove_index(row["path"])
+    assert cache.load_quality(str(tmp_path)) == {}
+    cache.close()
@@ -0,0 +1,93 @@
+import json
+import os
+import tarfile
+
+from PIL import Image
+
+from power_cropper import ShardWriter, SqliteCropStore, crop_bucket, main
+
+
+def test_offsets_point_at_the_file_data(tmp_path):
+    writer = ShardWriter(str(tmp_path), "shard", max_bytes=8 * 1024)
+    samples = {f"{i:04d}.bin": os.urandom(100 + 700 * i) for i in range(8)}
+    locations = {name: writer.add(name, data) for name, data in samples.items()}
+    writer.close()
+
+    assert writer.shards == [f"shard-{i:05d}.tar" for i in range(len(writer.shards))]
+    assert len(writer.shards) > 1
+    assert sorted(os.listdir(tmp_path)) == writer.shards  # No .tmp left
+    for name, (shard, offset) in locations.items():
+        with open(tmp_path / shard, "rb") as f:
+            f.seek(offset)
+            assert f.read(len(samples[name])) == samples[name]
+    for shard in writer.shards:
+        with tarfile.open(tmp_path / shard) as tar:
+            assert all(tar.extractfile(member).read() == samples[member.name] for member in tar.getmembers())
+
+
+def test_is_shard_name():
+    for name in ("shard-00000.tar", "1024x768-00012.tar", "768x1024-00001.tar.tmp"):
+        assert ShardWriter.is_shard_name(name)
+    for name in ("backup.tar", "shard-1.tar", "x-00001.tar", "axb-00000.tar", "1024x768-00012.tar.gz", "index.jsonl"):
+        assert not ShardWriter.is_shard_name(name)
+
+
+def test_crop_bucket():
+    presets = [(1024, 1024), (768, 1024), (1024, 768)]
+    assert crop_bucket(500, 500, presets) == (1024, 1024)
+    assert crop_bucket(600, 800, presets) == (768, 1024)
+    assert crop_bucket(2000, 1400, presets) == (1024, 768)
+
+
+def test_shards_command_replaces_only_its_own_shards(tmp_path, capsys):
+    folder = tmp_path / "photos"
+    folder.mkdir()
+    image = str(folder / "a.png")
+    Image.new("RGB", (64, 64), "red").save(image)
+    store_path = str(tmp_path / "cropped_info.db")
+    store = SqliteCropStore(store_path)
+    store.add_crops([(str(folder), image, "32x32", [0, 0, 32, 32]), (str(folder), image, "24x32", [0, 0, 24, 32])])
+    store.close()
+    output = tmp_path / "shards"
+    output.mkdir()
+    (output / "backup.tar").write_bytes(b"keep me")
+    command = ["shards", str(output), "--store", store_path, "--jobs", "1"]
+
+    assert main(command) == 1
+    assert "--force" in capsys.readouterr().out
+    assert sorted(os.listdir(output)) == ["backup.tar"]
+
+    (output / "shard-00007.tar.tmp").write_bytes(b"left over")
+    assert main(command + ["--force"]) == 0
+    rows = [json.loads(line) for line in (output / "index.jsonl").read_text().splitlines()]
+    assert sorted(row["bucket"] for row in rows) == ["512x512", "768x1024"]
+    for row in rows:
+        with open(output / row["shard"], "rb") as f:
+            f.seek(row["offset"])
+            assert f.read(8) == b"\x89PNG\r\n\x1a\n"
+    assert sorted(os.listdir(output)) == sorted({"backup.tar", "index.jsonl"} | {row["shard"] for row in rows})
+
+    # A later run replaces the shards listed in the index, other files stay
+    assert main(command + ["--force", "--no-buckets"]) == 0
+    assert sorted(os.listdir(output)) == ["backup.tar", "index.jsonl", "shard-00000.tar"]
+
+    # A mistyped store or folder leaves the earlier run alone, and creates no empty store
+    typo = str(tmp_path / "croped_info.db")
+    assert main(["shards", str(output), "--store", typo, "--force"]) == 1
+    assert not os.path.exists(typo)
+    assert main(["shards", str(output), str(tmp_path / "other"), "--store", store_path, "--force"]) == 1
+    assert "No crops of" in capsys.readouterr().out
+    assert sorted(os.listdir(output)) == ["backup.tar", "index.jsonl", "shard-00000.tar"]
+
+    # Names in the index are only removed when they look like shards
+    with open(output / "index.jsonl", "a") as f:
+        f.write(json.dumps({"shard": "backup.tar"}) + "\n")
+    assert main(command + ["--force", "--no-buckets"]) == 0
+    assert (output / "backup.tar").read_bytes() == b"keep me"
+
+
+def test_export_refuses_a_missing_store(tmp_path, capsys):
+    store_path = str(tmp_path / "missing.db")
+    assert main(["export", "--store", store_path]) == 1
+    assert "No crop store" in capsys.readouterr().out
+    assert not os.path.exists(store_path)